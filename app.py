@@ -1,19 +1,42 @@
 #!/usr/bin/env python3
 
+import argparse
+import collections
 import sys
 import os
+import shutil
+import tempfile
 import logging
-import threading
 import time
 import math
 
+# Start-up is profiled from here, before GStreamer and GTK are imported.
+IMPORT_START = time.perf_counter()
+
 import gi
 gi.require_version('Gst', '1.0')
 gi.require_version('Gtk', '3.0')
 gi.require_version('GstVideo', '1.0')
-from gi.repository import GObject, Gst, GstVideo, Gtk, Gdk
-from pythonosc import dispatcher, osc_server
-
+from gi.repository import GLib, GObject, Gst, GstVideo, Gtk, Gdk
+
+from automation import Automation
+from cputime import process_rss, process_time
+from deckproc import DeckProcess
+from framecache import FrameCache
+from governor import LoadGovernor
+from latency import LatencyTracer
+from library import MediaLibrary
+from lookahead import LOOKAHEAD, Lookahead
+from metrics import FrameCounter, Metrics, OscPublisher, flatten, queue_fill
+from mixer import Mixer, OUTPUT_HEIGHT, OUTPUT_WIDTH
+from monitor import Monitor, describe_preview_tap
+from oscserver import OscReceiver
+from presets import PresetStore, SLOTS
+from proxy import ProxyManager
+from record import Recorder, describe_file, describe_stream
+from setlist import load_setlist
+from startup import StartupProfile
+from sync import InterStats, next_frame_boundary
 from player import TrickPlayer
 
 
@@ -22,278 +45,826 @@ logger.setLevel(logging.DEBUG)
 
 class GTK_Main():
 
-    def __init__(self):
+    def __init__(self, decks=2, trace=False, processes=False, stream=None,
+                 setlist=None, lookahead=LOOKAHEAD, metrics_osc=None,
+                 profile=None, preroll=False, proxies=False):
+        self.profile = profile or StartupProfile()
         user_path = os.path.expanduser('~')
         vid_path = user_path + '/vids/'
-        cue_list = os.listdir(vid_path)
-        cue_list.sort()
-        self.cues = {'0':cue_list,'1':cue_list}
-        self.data = {'file_0' : self.cues['0'][0],
-                     'file_1' : self.cues['1'][0],
-                     'alpha_0' : 0.5,
-                     'alpha_1' : 0.5,
-                     'alpha_main' : 1.0,
-                     'rate_0' : 1.0,
-                     'rate_1' : 1.0,
+        self.library = MediaLibrary(vid_path)
+        self.library.stale()
+        cue_list = self.library.cues()
+        self.decks = decks
+        self.cues = {str(i):cue_list for i in range(decks)}
+        # Decks with a set list step through it instead of the library.
+        self.setlist = []
+        if setlist:
+            try:
+                self.setlist = load_setlist(setlist, vid_path)
+            except (OSError, ValueError, KeyError) as err:
+                logger.error("Cannot use set list %s: %s", setlist, err)
+        for i, deck in enumerate(self.setlist[:decks]):
+            if deck:
+                self.cues[str(i)] = [cue['file'] for cue in deck]
+        self.lookahead = Lookahead(self.library, lookahead, prerolled=preroll)
+        # Warmth of cued files by path until their first frame shows.
+        self.cue_warmth = {}
+        self.data = {'alpha_main' : 1.0,
                      'ipaddr' : '127.0.0.1',
                      'port' : 7701,
-                     'mode_0' : 0,
-                     'mode_1' : 0,
                      'filepath' : vid_path,
-                     'cue_0' : 0,
-                     'cue_1' : 0,
+                     'seek_mode' : 'snap',
+                     'cache_mb' : 512,
+                     'proxy_mb' : 4096,
+                     'monitor_fps' : 10,
+                     'record_path' : user_path + '/pyvj-recordings/',
+                     'metrics_port' : 7702,
+                     'metrics_interval' : 1.0,
+                     'metrics_log' : user_path + '/pyvj-metrics/metrics.jsonl',
                      }
+        for i in range(decks):
+            # The crossfader only weighs decks 0 and 1.
+            self.data['alpha_%d' % i] = 0.5 if i < 2 else 1.0
+            self.data['level_%d' % i] = 1.0
+            self.data['file_%d' % i] = vid_path + self.cues[str(i)][0]
+            self.data['rate_%d' % i] = 1.0
+            self.data['mode_%d' % i] = 0
+            self.data['cue_%d' % i] = 0
         self.controls = {}
+        self.tracer = LatencyTracer(trace)
+        self.presets = PresetStore(vid_path)
+        self.recall_times = collections.deque(maxlen=100)
+        self.inter_stats = [InterStats(i) for i in range(decks)]
+        self.profile.phase('library')
 
 
         # Create The control window
         self.create_ctrl_win()
-        
+        self.profile.phase('control window')
+
+        # Set up OSC server; messages are handled once the main loop runs.
+        self.create_dispatcher()
+        self.server.start()
+        self.profile.phase('osc')
+
         # Create the viewer window
         self.create_view_win()
+        self.profile.phase('view window')
  
         # Create Players
+        self.frame_cache = FrameCache(self.data['cache_mb'],
+                                      OUTPUT_WIDTH, OUTPUT_HEIGHT)
+        self.proxies = ProxyManager(self.library, OUTPUT_WIDTH, OUTPUT_HEIGHT,
+                                    auto=proxies,
+                                    budget_mb=self.data['proxy_mb'])
         self.players = []
-        self.players.append(TrickPlayer(0))
-        self.players.append(TrickPlayer(1))
-
-        # Create monitors
-        self.monitors = []
-        self.monitors.append(self.create_monitor(0))
-        self.monitors.append(self.create_monitor(1))
-        self.monitors.append(self.create_monitor(2))
+        self.processes = processes
+        self.shm_dir = None
+        if processes:
+            # Each deck decodes in its own process and hands frames over
+            # through shared memory sockets in this directory. Every worker
+            # keeps its own frame cache, so they share out the budget.
+            self.shm_dir = tempfile.mkdtemp(prefix='pyvj_')
+            options = {'path' : vid_path,
+                       'cache_mb' : self.data['cache_mb'] // decks,
+                       'width' : OUTPUT_WIDTH,
+                       'height' : OUTPUT_HEIGHT,
+                       }
+        for i in range(decks):
+            if processes:
+                self.players.append(DeckProcess(i, self.shm_dir, options))
+            else:
+                self.players.append(TrickPlayer(i, self.frame_cache,
+                                                self.library.keyframes,
+                                                self.proxies))
 
         # Create Output
         self.create_output()
 
-        self.create_busses()
-
-        self.monitors[0].set_state(Gst.State.PLAYING)
-        self.monitors[1].set_state(Gst.State.PLAYING)
-        self.monitors[2].set_state(Gst.State.PLAYING)
-        self.out.set_state(Gst.State.PLAYING)
-        self.players[0].file=self.data['filepath']+self.data['file_0']
-        self.players[1].file=self.data['filepath']+self.data['file_1']
-        for player in self.players:
+        self.tracer.attach_output(
+            self.out.get_by_name('output').get_static_pad('sink'))
+        self.tracer.start_reports()
 
-            player.run()
-            player.start()
+        # The monitor strip is built once the control window shows.
+        self.create_monitor()
 
+        self.create_busses()
+        self.create_governor()
 
+        # State changes are asynchronous: the output and every visible
+        # deck preroll side by side, and none waits for another.
+        self.profile.watch('output', self.out)
+        self.out.set_state(Gst.State.PLAYING)
+        if stream:
+            host, port = stream.rsplit(':', 1)
+            self.recorder.start('stream', describe_stream(host, int(port)))
+        self.started = [False] * decks
+        for i in range(decks):
+            if self.deck_alpha(i) > 0:
+                self.start_deck(i)
+            else:
+                logger.info("Deck %d starts when first used", i)
+        self.profile.phase('pipelines')
 
         self.ctrl_win.show_all()
         self.view_win.show_all()
 
-        # Set up OSC server
-        self.create_dispatcher()
-        self.server = osc_server.ThreadingOSCUDPServer(
-            (self.data['ipaddr'], self.data['port']), self.dispatcher)
-        self.server_thread = threading.Thread(target=self.server.serve_forever)
-        self.server_thread.start()
+        # Fill in metadata of new or changed clips in the background.
+        self.library.scan(self.on_library_update)
+        self.proxies.update(self.on_proxy_ready)
+        self.profile.phase('background jobs')
+        self.profile.start_reports()
+        GLib.timeout_add_seconds(60, self.report_inter_stats)
+
+        self.create_metrics(metrics_osc)
+
+    def start_deck(self, streamnum):
+        """Start a deck's player on its current cue."""
+        player = self.players[streamnum]
+        self.started[streamnum] = True
+        player.file = self.data['file_%d' % streamnum]
+        player.seek_mode = self.data['seek_mode']
+        player.on_switch = self.on_cue_started
+        player.run()
+        player.start()
+        self.inter_stats[streamnum].attach_deck(player.sink_pads())
+        pipelines = player.pipelines()
+        self.profile.watch('deck%d' % streamnum, pipelines[0])
+        for pipeline in pipelines:
+            self.governor.watch('deck%d' % streamnum, pipeline)
+        self.governor.count('deck%d' % streamnum, player.sink_pads())
+        if self.cue_settings(streamnum):
+            self.start_cue(streamnum)
+        else:
+            self.preload_cue(streamnum)
+
+    def deck(self, streamnum):
+        """Return a deck's player, started if it was not yet."""
+        if not self.started[streamnum]:
+            self.start_deck(streamnum)
+        return self.players[streamnum]
+
+    def started_players(self):
+        return [player for player in self.players if self.started[player.ident]]
+
+    def create_metrics(self, osc_target=None):
+        """Sample every counter once per interval, serve and log them."""
+        self.metrics = Metrics(self.data['metrics_interval'],
+                               log_path=self.data['metrics_log'])
+        self.output_frames = FrameCounter(
+            self.out.get_by_name('output').get_static_pad('sink'))
+        self.metrics.add('process', self.process_metrics)
+        self.metrics.add('output', self.output_metrics)
+        for i in range(self.decks):
+            self.metrics.add('deck%d' % i, lambda i=i: self.deck_metrics(i))
+        self.metrics.add('osc', self.server.rates)
+        self.metrics.add('governor', self.governor.stats)
+        self.metrics.add('cache', self.frame_cache.stats)
+        self.metrics.add('lookahead', self.lookahead.stats)
+        self.metrics.add('proxies', self.proxies.status)
+        self.metrics.add('recorder', lambda: dict(self.recorder.dropped))
+        self.metrics.add('presets', lambda: {
+            'recalls' : len(self.recall_times),
+            'last_recall_ms' : (self.recall_times[-1] * 1000
+                                if self.recall_times else None)})
+        if self.tracer.enabled:
+            self.metrics.add('latency', self.tracer.stats)
+        self.metrics.listen(self.update_overlay)
+        if osc_target:
+            host, port = osc_target.rsplit(':', 1)
+            self.metrics.listen(OscPublisher(host, int(port)))
+        self.metrics.serve(self.data['ipaddr'], self.data['metrics_port'])
+        self.metrics.start()
+
+    def process_metrics(self):
+        # /proc/<pid>/stat keeps the time of threads that have exited.
+        return {'cpu_percent' : 100 * self.metrics.rate(
+                    'process.cpu', process_time(os.getpid())),
+                'rss_mb' : process_rss() / (1 << 20),
+                }
+
+    def output_metrics(self):
+        return {'fps' : self.metrics.rate('output.frames',
+                                          self.output_frames.count),
+                'queue_fill' : queue_fill(self.out),
+                'scale' : self.mixer.scale,
+                'monitor_fps' : self.preview_fps,
+                }
+
+    def deck_metrics(self, streamnum):
+        """Return a deck's frame rates, channel counts and controls."""
+        if not self.started[streamnum]:
+            return {'started' : False}
+        player = self.players[streamnum]
+        stats = self.inter_stats[streamnum]
+        name = 'deck%d' % streamnum
+        deck = {'fps' : self.metrics.rate(name + '.frames', stats.produced),
+                'mixed_fps' : self.metrics.rate(name + '.mixed', stats.mixed),
+                'queue_fill' : queue_fill(player.pipelines()[0]),
+                'rate' : player.rate,
+                }
+        deck.update(stats.stats())
+        if self.processes:
+            deck['restarts'] = player.restarts
+            deck['failed'] = player.failed
+            if player.pid:
+                deck['cpu_percent'] = 100 * self.metrics.rate(
+                    name + '.cpu', process_time(player.pid))
+                deck['rss_mb'] = process_rss(player.pid) / (1 << 20)
+        else:
+            deck['seeks'] = dict(player.seek_counts)
+            if player.switch_latency is not None:
+                deck['switch_ms'] = player.switch_latency * 1000
+            if player.loop_gap is not None:
+                deck['loop_gap_ms'] = player.loop_gap * 1000
+        return deck
+
+    def update_overlay(self, sample):
+        """Show the numbers of a sample on the control window."""
+        if not self.overlay.get_visible():
+            return
+        groups = collections.OrderedDict()
+        for name, value in flatten(sample).items():
+            group, sep, key = name.partition('.')
+            if sep:
+                groups.setdefault(group, []).append(
+                    "%s %.4g" % (key, value))
+        self.overlay.set_text("\n".join(
+            "%s: %s" % (group, "  ".join(values))
+            for group, values in groups.items()))
+
+    def on_stats(self, button):
+        self.overlay.set_visible(button.get_active())
+        self.update_overlay(self.metrics.latest)
+
+    def sync_start(self):
+        """Restart the loops of all started decks on one output frame."""
+        frame = Gst.SECOND // 30
+        pad = self.out.get_by_name('output').get_static_pad('sink')
+        caps = pad.get_current_caps()
+        if caps:
+            ok, num, den = caps.get_structure(0).get_fraction('framerate')
+            if ok and num > 0:
+                frame = Gst.SECOND * den // num
+        base = next_frame_boundary(self.out, frame)
+        players = self.started_players()
+        for player in players:
+            player.sync_start(base)
+            self.set_widget(self.controls['cache%d' % player.ident], False,
+                            self.on_cache)
+        logger.info("Synchronized start of decks %s",
+                    [player.ident for player in players])
+
+    def on_sync_start(self, button):
+        self.sync_start()
+
+    def report_inter_stats(self):
+        """Log the frames each deck's channel repeated or dropped."""
+        for player in self.started_players():
+            stats = self.inter_stats[player.ident]
+            # Sink pads change as decks switch cues or cache clips.
+            stats.attach_deck(player.sink_pads())
+            self.governor.count('deck%d' % player.ident, player.sink_pads())
+            stats.sample()
+            logger.info("Deck %d channel: %s", player.ident, stats.stats())
+        return True
 
     def create_dispatcher(self):
-        self.dispatcher = dispatcher.Dispatcher()
-        for control in self.controls.items():
-            self.dispatcher.map('/video/'+control[0], self.udp_update, control[1])
+        self.server = OscReceiver(self.data['ipaddr'], self.data['port'],
+                                  tracer=self.tracer)
+        for name, control in self.controls.items():
+            # Faders only need their latest value, presses all arrive.
+            self.server.map('/video/'+name, self.udp_update, control,
+                            continuous=type(control)==Gtk.Scale)
+        self.server.map('/video/xfade', self.osc_automation, self.crossfade)
+        self.server.map('/video/fade_main', self.osc_automation, self.fade_master)
+        self.server.map('/video/proxy', self.osc_proxy)
 
     def udp_update(self, address, target, value):
-        if type(target[0])==Gtk.Scale:
-            target[0].set_value(value)
-        elif type(target[0])==Gtk.Button:
+        # Runs in the main loop, batched by the OSC receiver.
+        if type(target)==Gtk.Scale:
+            target.set_value(value)
+        elif type(target)==Gtk.Button:
             if value == 1.0:
-                target[0].clicked()
-        elif type(target[0])==Gtk.ToggleButton:
+                target.clicked()
+        elif type(target)==Gtk.ToggleButton:
             if value == 1.0:
-                target[0].toggled()
+                target.set_active(not target.get_active())
 
+    def osc_automation(self, address, ramp, value, seconds=2.0):
+        # e.g. /video/xfade 1.0 2.0 fades to deck 1 over 2s.
+        ramp(value, seconds)
+
+    def osc_proxy(self, address, name):
+        # e.g. /video/proxy clip.mp4 makes an intra-only proxy of one clip.
+        if name not in self.library.cues():
+            logger.warning("No clip %s to make a proxy of", name)
+            return
+        self.proxies.enqueue(name)
 
     def create_output(self):
-        output = Gst.parse_launch("""
-            videomixer
-                name=mix
-                    background=black
-                    sink_0::alpha=0.5
-                    sink_1::alpha=0.5 !
-                intervideosink channel=2
-            intervideosrc channel=2 !
-                queue !
-                video/x-raw,width=800,height=600 !
-                xvimagesink name=output
-            intervideosrc channel=0 !
-                videoscale !
-                video/x-raw,width=800,height=600 !
-                queue !
-                mix.sink_0
-            intervideosrc channel=1 !
-                videoscale !
-                video/x-raw,width=800,height=600 !
-                queue !
-                mix.sink_1
-            """)
-        self.out = output
-
-    def create_monitor(self, ident):
-        mon = Gst.parse_launch("""
-            intervideosrc channel=%d !
-            queue !
-            videoconvert !
-            videoscale !
-            video/x-raw,width=240,height=180 !
-            xvimagesink name=mon_%d
-            """ % (ident,ident))
-        return mon
+        self.mixer = Mixer(self.decks)
+        for i in range(self.decks):
+            self.mixer.alphas[i] = self.deck_alpha(i)
+        self.out = self.mixer.build(self.mixer.describe_program(
+            "xvimagesink name=output",
+            describe_preview_tap(self.data['monitor_fps'])))
+        for i, balance in enumerate(self.mixer.balances):
+            self.inter_stats[i].attach_mix(balance.get_static_pad('sink'))
+        self.automation = Automation(self.mixer)
+        self.recorder = Recorder(self.out, (OUTPUT_WIDTH, OUTPUT_HEIGHT))
+        # No previews until the monitor strip exists.
+        self.out.get_by_name('preview_valve').set_property('drop', True)
+
+    def create_monitor(self):
+        self.monitor_strip = None
+        self.preview_fps = self.data['monitor_fps']
+        self.ctrl_win.connect("map-event", self.on_ctrl_map)
+        self.ctrl_win.connect("unmap-event", self.on_ctrl_unmap)
+
+    def build_monitor_strip(self):
+        self.monitor_strip = Monitor(self.decks, self.preview_fps)
+        self.monitor_strip.build(self.out)
+        self.add_bus('monitor', self.monitor_strip.pipeline)
+        self.governor.watch('monitor', self.monitor_strip.pipeline,
+            [self.monitor_strip.pipeline.get_by_name('monitor')
+             .get_static_pad('sink')])
+        self.profile.watch('monitor', self.monitor_strip.pipeline)
+        self.monitor_strip.pipeline.set_state(Gst.State.PLAYING)
+
+    def on_ctrl_map(self, widget, event):
+        if self.monitor_strip is None:
+            self.build_monitor_strip()
+        self.monitor_strip.set_active(True)
+
+    def on_ctrl_unmap(self, widget, event):
+        # Nobody sees the previews, stop producing them.
+        if self.monitor_strip:
+            self.monitor_strip.set_active(False)
 
     def create_busses(self):
-        busses = {'output' : self.out.bus,
-                  # 'play_0' : self.players[0].bus,
-                  # 'play_1' : self.players[1].bus,
-                  'mon_0'  : self.monitors[0].bus,
-                  'mon_1'  : self.monitors[1].bus,
-                  'mon_2'  : self.monitors[2].bus
-                  }
-        for bus in busses.values():
-            bus.add_signal_watch()
-            bus.enable_sync_message_emission()
-            bus.connect('sync-message::element', self.on_sync_message)
-        self.busses=busses
-
-    def on_next_cue(self, button):
-        streamnum = int(button.props.name[-1])
+        self.busses = {}
+        self.add_bus('output', self.out)
+
+    def add_bus(self, name, pipeline):
+        bus = pipeline.bus
+        bus.add_signal_watch()
+        bus.enable_sync_message_emission()
+        bus.connect('sync-message::element', self.on_sync_message)
+        self.busses[name] = bus
+
+    def create_governor(self):
+        # Quality is given up in this order when frames start dropping.
+        self.governor = LoadGovernor([
+            ('monitor fps', self.set_monitor_quality),
+            ('deck decoding', self.set_deck_quality),
+            ('composite resolution', self.set_mix_quality),
+            ])
+        self.governor.watch('output', self.out,
+            [self.out.get_by_name('output').get_static_pad('sink')])
+        self.governor.start()
+
+    def set_monitor_quality(self, low):
+        fps = self.data['monitor_fps']
+        self.preview_fps = max(1, fps // 2) if low else fps
+        if self.monitor_strip:
+            self.monitor_strip.set_fps(self.preview_fps)
+
+    def set_deck_quality(self, low):
+        for player in self.players:
+            if self.started[player.ident]:
+                player.set_low_quality(low)
+            else:
+                # Applied when the deck starts.
+                player.low_quality = low
+
+    def set_mix_quality(self, low):
+        self.mixer.set_scale(0.5 if low else 1.0)
+
+    def on_next_cue(self, button, streamnum):
         if self.data['cue_%d' % streamnum] < len(self.cues[str(streamnum)])-1:
             self.data['cue_%d' % streamnum] += 1
-            self.data['file_%d' % streamnum] = self.data['filepath']+self.cues[str(streamnum)][self.data['cue_%d'%streamnum]]
-            self.players[streamnum].change_file(self.data['file_%d'%streamnum])
+            self.start_cue(streamnum)
 
-    def on_prev_cue(self, button):
-        streamnum = int(button.props.name[-1])
+    def on_prev_cue(self, button, streamnum):
         if self.data['cue_%d' % streamnum] > 0:
             self.data['cue_%d' % streamnum] -= 1
-            self.data['file_%d' % streamnum] = self.data['filepath']+self.cues[str(streamnum)][self.data['cue_%d'%streamnum]]
-            self.players[streamnum].change_file(self.data['file_%d'%streamnum])
-
-    def on_reverse(self, button):
-        streamnum = int(button.props.name[-1])
-        self.players[streamnum].reverse()
-
-    def on_jump(self, button):
-        streamnum = int(button.props.name[-1])
-        self.players[streamnum].jump_loop()
+            self.start_cue(streamnum)
+
+    def cue_settings(self, streamnum):
+        """Return the set list entry of a deck's current cue, or None."""
+        if streamnum < len(self.setlist) and self.setlist[streamnum]:
+            return self.setlist[streamnum][self.data['cue_%d' % streamnum]]
+        return None
+
+    def start_cue(self, streamnum):
+        """Switch a deck to its current cue, with its set list settings."""
+        player = self.deck(streamnum)
+        filename = (self.data['filepath']
+                    + self.cues[str(streamnum)][self.data['cue_%d' % streamnum]])
+        self.data['file_%d' % streamnum] = filename
+        if filename != player.file:
+            self.cue_warmth[filename] = self.lookahead.is_warm(
+                self.proxies.resolve(filename))
+        cue = self.cue_settings(streamnum)
+        if cue is None:
+            player.change_file(filename)
+        else:
+            self.data['rate_%d' % streamnum] = cue['rate']
+            player.recall(filename, cue['rate'], cue['loop'], cue['loop_points'])
+            self.set_widget(self.controls['speed%d' % streamnum],
+                            self.speed_value(cue['rate']), self.on_change_speed)
+            self.set_widget(self.controls['bounce%d' % streamnum],
+                            cue['loop'] > 1, self.on_bounce)
+        self.preload_cue(streamnum)
+
+    def on_cue_started(self, filename, seconds):
+        warm = self.cue_warmth.pop(filename, None)
+        # Switches made by presets are not cue starts.
+        if warm is not None:
+            self.lookahead.started(filename, seconds, warm)
+
+    def on_library_update(self):
+        """Rebuild the cue lists from the index, keeping current cues."""
+        cue_list = self.library.cues()
+        if self.processes:
+            for player in self.started_players():
+                player.reload_library()
+        for key in self.cues:
+            if self.cue_settings(int(key)):
+                self.preload_cue(int(key))
+                continue
+            current = os.path.basename(self.data['file_%s' % key])
+            self.cues[key] = cue_list
+            if current in cue_list:
+                self.data['cue_%s' % key] = cue_list.index(current)
+            self.preload_cue(int(key))
+        self.proxies.update(self.on_proxy_ready)
+
+    def on_proxy_ready(self, name):
+        """Preroll the next cues again so new proxies get used."""
+        if self.processes:
+            for player in self.started_players():
+                player.proxy_ready(name)
+        for key in self.cues:
+            self.preload_cue(int(key))
+
+    def preload_cue(self, streamnum):
+        """Preroll the cue after the current one on the standby pipeline."""
+        if not self.started[streamnum]:
+            # Preloaded when the deck starts.
+            return
+        cue = self.data['cue_%d' % streamnum] + 1
+        if cue < len(self.cues[str(streamnum)]):
+            filename = self.data['filepath'] + self.cues[str(streamnum)][cue]
+            if streamnum < len(self.setlist) and self.setlist[streamnum]:
+                # Preroll with the settings the cue will be started with.
+                settings = self.setlist[streamnum][cue]
+                self.deck(streamnum).preload(filename, settings['rate'],
+                                             settings['loop_points'])
+            else:
+                self.deck(streamnum).preload(filename)
+        else:
+            self.deck(streamnum).preload(None)
+        self.plan_lookahead()
+
+    def plan_lookahead(self):
+        """Warm the upcoming cues of every deck, nearest first."""
+        clips = []
+        for offset in range(1, self.lookahead.depth + 1):
+            for i in range(self.decks):
+                cues = self.cues[str(i)]
+                cue = self.data['cue_%d' % i] + offset
+                if cue >= len(cues):
+                    continue
+                start = None
+                if i < len(self.setlist) and self.setlist[i]:
+                    start = self.setlist[i][cue]['loop_points'][0]
+                clips.append((self.proxies.resolve(self.data['filepath']
+                                                   + cues[cue]), start))
+        self.lookahead.plan(clips)
+
+    def trace_deck(self, kind, streamnum, restart=True):
+        """Follow a change applied to a deck through to the screen."""
+        player = self.deck(streamnum)
+        # Cached decks pick up changes on their next frame.
+        self.tracer.applied(kind, streamnum, player.sink_pad(),
+                            restart and not player.cached_clip)
+
+    def on_reverse(self, button, streamnum):
+        self.deck(streamnum).reverse()
+        self.trace_deck('reverse', streamnum)
+
+    def on_jump(self, button, streamnum):
+        self.deck(streamnum).jump_loop()
+        self.trace_deck('jump', streamnum)
+
+    def on_loop_in(self, button, streamnum):
+        self.deck(streamnum).set_loop_in()
+        self.trace_deck('loop', streamnum)
+
+    def on_loop_out(self, button, streamnum):
+        self.deck(streamnum).set_loop_out()
+        self.trace_deck('loop', streamnum)
+
+    def on_loop_clear(self, button, streamnum):
+        self.deck(streamnum).set_loop_points()
+        self.trace_deck('loop', streamnum)
 
     def on_alpha_move(self, slider):
         if slider.props.name == 'alpha_main':
             self.data[slider.props.name] = slider.get_value()
-        else:
+        elif self.decks > 1:
             self.data['alpha_0'] = 1 - slider.get_value()
             self.data['alpha_1'] = slider.get_value()
         self.update_alpha_channels()
+        self.tracer.applied('alpha')
+
+    def on_level_move(self, slider, streamnum):
+        self.data['level_%d' % streamnum] = slider.get_value()
+        self.update_alpha_channels()
+        self.tracer.applied('level', streamnum)
 
-    def on_slider_move(self, slider, channel):
-        streamnum = int(slider.props.name[-1])
-        self.players[streamnum].update_color_channel(channel, slider.get_value())
+    def on_slider_move(self, slider, channel, streamnum):
+        self.mixer.set_color(streamnum, channel, slider.get_value())
+        self.tracer.applied('color', streamnum)
 
     def on_channel_reset(self, button, slider):
         slider.set_value(0)
 
-    def on_pause(self, button):
-        streamnum=int(button.props.name[-1])
-        if self.players[streamnum].playing:
-            self.monitors[streamnum].set_state(Gst.State.PAUSED)
-        else:
-            self.monitors[streamnum].set_state(Gst.State.PLAYING)
-        self.players[streamnum].pause_play()
+    def on_pause(self, button, streamnum):
+        self.deck(streamnum).pause_play()
 
-    def on_bounce(self, button):
-        streamnum=int(button.props.name[-1])
+    def on_bounce(self, button, streamnum):
         if button.get_active():
-            self.players[streamnum].loop = 2
+            self.deck(streamnum).loop = 2
         else:
-            self.players[streamnum].loop = 1
+            self.deck(streamnum).loop = 1
+
+    def on_cache(self, button, streamnum):
+        self.deck(streamnum).set_cache_mode(button.get_active())
 
     def on_fullscreen(self, button):
         self.view_win.fullscreen()
 
-    def on_change_speed(self, slider):
-        streamnum = int(slider.props.name[-1])
+    def on_record(self, button):
+        if button.get_active():
+            os.makedirs(self.data['record_path'], exist_ok=True)
+            path = (self.data['record_path']
+                    + time.strftime('pyvj-%Y%m%d-%H%M%S.mkv'))
+            self.recorder.start('record', describe_file(path))
+        else:
+            self.recorder.stop('record')
+
+    def on_change_speed(self, slider, streamnum):
         current_speed = slider.get_value()
         if current_speed >= 1:
             new_speed = current_speed ** 4
         else:
             new_speed = math.log(current_speed+1,2)
         self.data['rate_%d' % streamnum] = new_speed
-        self.players[streamnum].set_speed(new_speed)
+        self.deck(streamnum).set_speed(new_speed)
+        self.trace_deck('speed', streamnum)
 
 
     def on_sync_message(self, bus, msg):
         msg.src.set_property('force-aspect-ratio', True)
         if msg.src.name == "output":
             msg.src.set_window_handle(self.xid2)
-        elif msg.src.name == "mon_0":
-            msg.src.set_window_handle(self.monitor.get_property('window').get_xid())
-            msg.src.set_render_rectangle(0,0,240,180)
-        elif msg.src.name == "mon_1":
-            msg.src.set_render_rectangle(480,0,240,180)
-            msg.src.set_window_handle(self.monitor.get_property('window').get_xid())
-        elif msg.src.name == "mon_2":
-            msg.src.set_render_rectangle(240,0,240,180)
+        elif msg.src.name == "monitor":
             msg.src.set_window_handle(self.monitor.get_property('window').get_xid())
         msg.src.expose()
 
+    def deck_alpha(self, streamnum):
+        return (self.data['alpha_%d' % streamnum]
+                * self.data['level_%d' % streamnum]
+                * self.data['alpha_main'])
+
     def update_alpha_channels(self):
-        alpha_0 = self.data['alpha_0'] * self.data['alpha_main']
-        alpha_1 = self.data['alpha_1'] * self.data['alpha_main']
-        mixer = self.out.get_by_name('mix')
-        sink_0 = mixer.get_static_pad('sink_0')
-        sink_1 = mixer.get_static_pad('sink_1')
-        sink_0.set_property('alpha', alpha_0)
-        sink_1.set_property('alpha', alpha_1)
+        for i in range(self.decks):
+            self.mixer.set_alpha(i, self.deck_alpha(i))
+        self.start_visible()
+
+    def start_visible(self):
+        """Start the decks that have become visible in the mix."""
+        for i in range(self.decks):
+            if self.deck_alpha(i) > 0:
+                self.deck(i)
+
+    def snapshot(self):
+        """Return every deck and mixer parameter as a preset."""
+        decks = []
+        for i, player in enumerate(self.players):
+            decks.append({'file' : os.path.basename(self.data['file_%d' % i]),
+                          'speed' : self.controls['speed%d' % i].get_value(),
+                          'rate' : player.rate,
+                          'loop' : player.loop,
+                          'loop_points' : list(player.get_loop_points()),
+                          'level' : self.data['level_%d' % i],
+                          'colors' : dict(self.mixer.colors[i]),
+                          })
+        return {'decks' : decks,
+                'mixer' : {'alpha_main' : self.data['alpha_main'],
+                           'crossfade' : self.controls['crossfader'].get_value(),
+                           }}
+
+    def recall(self, name):
+        """Apply a preset in one batch and report how long it took.
+
+        Widgets are updated with their handlers blocked, each deck gets at
+        most one seek or cue switch, and mixer properties are set in one
+        main loop callback.
+        """
+        preset = self.presets.get(name)
+        if preset is None:
+            logger.warning("No preset %s", name)
+            return
+        start = time.perf_counter()
+        widgets = []
+        for i, deck in enumerate(preset['decks'][:self.decks]):
+            player = self.deck(i)
+            filename = self.data['file_%d' % i]
+            if deck['file'] in self.cues[str(i)]:
+                self.data['cue_%d' % i] = self.cues[str(i)].index(deck['file'])
+                filename = self.data['filepath'] + deck['file']
+            else:
+                logger.warning("Preset %s: %s is not in the library",
+                               name, deck['file'])
+            changed = filename != player.file
+            self.data['file_%d' % i] = filename
+            self.data['rate_%d' % i] = deck['rate']
+            self.data['level_%d' % i] = deck['level']
+            player.recall(filename, deck['rate'], deck['loop'],
+                          deck['loop_points'])
+            if changed:
+                self.preload_cue(i)
+            for channel in ("HUE","SATURATION","CONTRAST","BRIGHTNESS"):
+                value = deck['colors'].get(channel, 0)
+                self.mixer.set_color(i, channel, value)
+                widgets.append((self.controls[channel.lower()+str(i)],
+                                self.on_slider_move, value))
+            widgets.append((self.controls['speed%d' % i],
+                            self.on_change_speed, deck['speed']))
+            widgets.append((self.controls['level%d' % i],
+                            self.on_level_move, deck['level']))
+            widgets.append((self.controls['bounce%d' % i],
+                            self.on_bounce, deck['loop'] > 1))
+        mixer = preset['mixer']
+        self.data['alpha_main'] = mixer['alpha_main']
+        if self.decks > 1:
+            self.data['alpha_0'] = 1 - mixer['crossfade']
+            self.data['alpha_1'] = mixer['crossfade']
+        self.update_alpha_channels()
+        widgets.append((self.controls['master'], self.on_alpha_move,
+                        mixer['alpha_main']))
+        widgets.append((self.controls['crossfader'], self.on_alpha_move,
+                        mixer['crossfade']))
+        applied = time.perf_counter()
+        for widget, handler, value in widgets:
+            widget.handler_block_by_func(handler)
+            if type(widget)==Gtk.ToggleButton:
+                widget.set_active(value)
+            else:
+                widget.set_value(value)
+            widget.handler_unblock_by_func(handler)
+        GLib.timeout_add(5, self.on_recall_progress, name, start, applied)
+
+    def on_recall_progress(self, name, start, applied):
+        """Report the recall once every deck has finished seeking."""
+        elapsed = time.perf_counter() - start
+        if not all(player.settled() for player in self.players):
+            if elapsed < 5:
+                return True
+            logger.warning("Preset %s: decks still seeking after %.1fs",
+                           name, elapsed)
+        self.recall_times.append(elapsed)
+        logger.info("Recalled preset %s in %.1fms (applied in %.1fms)",
+                    name, elapsed * 1000, (applied - start) * 1000)
+        return False
+
+    def on_preset(self, button, slot):
+        store = self.controls['store']
+        if store.get_active():
+            self.presets.store(slot, self.snapshot())
+            store.set_active(False)
+        else:
+            self.recall(slot)
+
+    def set_widget(self, widget, value, handler):
+        """Show a value reached by automation without handling it again."""
+        widget.handler_block_by_func(handler)
+        if type(widget)==Gtk.ToggleButton:
+            widget.set_active(value)
+        else:
+            widget.set_value(value)
+        widget.handler_unblock_by_func(handler)
+
+    def speed_value(self, rate):
+        """Return the speed slider value playing at rate, see on_change_speed."""
+        rate = abs(rate)
+        if rate >= 1:
+            return rate ** 0.25
+        return 2 ** rate - 1
+
+    def crossfade(self, position, seconds=2.0):
+        """Move the crossfader to position over seconds, 1 is deck 1."""
+        if self.decks < 2:
+            return
+        self.data['alpha_0'] = 1 - position
+        self.data['alpha_1'] = position
+        self.start_visible()
+        self.automation.fade({i : self.deck_alpha(i) for i in range(2)},
+            seconds, lambda: self.set_widget(self.controls['crossfader'],
+                                             position, self.on_alpha_move))
+
+    def fade_master(self, level, seconds=2.0):
+        """Fade the grandmaster to level over seconds, 0 is a blackout."""
+        self.data['alpha_main'] = level
+        self.start_visible()
+        self.automation.fade({i : self.deck_alpha(i) for i in range(self.decks)},
+            seconds, lambda: self.set_widget(self.controls['master'],
+                                             level, self.on_alpha_move))
+
+    def sweep_color(self, streamnum, channel, value, seconds=2.0):
+        """Sweep a deck colour channel to value (-1000 to 1000)."""
+        self.automation.sweep_color(streamnum, channel, value, seconds,
+            lambda: self.set_widget(self.controls[channel.lower()+str(streamnum)],
+                                    value, self.on_slider_move))
 
     def clean_quit(self, destroy, *args):
-        self.players[0].stop()
-        self.players[1].stop()
-        self.monitors[0].set_state(Gst.State.NULL)
-        self.monitors[1].set_state(Gst.State.NULL)
-        self.monitors[2].set_state(Gst.State.NULL)
+        for player in self.started_players():
+            player.stop()
+        if self.monitor_strip:
+            self.monitor_strip.pipeline.set_state(Gst.State.NULL)
+        # Recordings get their index and duration from the EOS.
+        self.recorder.finish()
         self.out.set_state(Gst.State.NULL)
+        self.proxies.shutdown()
+        if self.shm_dir:
+            shutil.rmtree(self.shm_dir, ignore_errors=True)
         Gtk.main_quit(destroy,*args)
         self.server.shutdown()
+        self.metrics.shutdown()
 
     def build_speed_controls(self):
         control_box = Gtk.Grid()
-        for i in range(2):
+        for i in range(self.decks):
             speed_slider = Gtk.Scale.new_with_range(0,0,2,.01)
             speed_slider.set_size_request(240,40)
             speed_slider.add_mark(1, Gtk.PositionType.BOTTOM, None)
             speed_slider.set_value(1)
             speed_slider.set_name('speed%d' % i)
-            speed_slider.connect("value_changed", self.on_change_speed)
+            speed_slider.connect("value_changed", self.on_change_speed, i)
             self.controls['speed%d' % i] = speed_slider
             reverse_button = Gtk.Button(label='REV')
             reverse_button.set_name('reverse%d' % i)
-            reverse_button.connect("clicked", self.on_reverse)
+            reverse_button.connect("clicked", self.on_reverse, i)
             self.controls['reverse%d' % i] = reverse_button
             control_box.attach(speed_slider,i*7,0,7,2)
             control_box.attach_next_to(reverse_button,speed_slider,3,1,1)
             jump_button = Gtk.Button(label='JMP')
             jump_button.set_name('jump%d' % i)
-            jump_button.connect("clicked", self.on_jump)
+            jump_button.connect("clicked", self.on_jump, i)
             self.set_control(jump_button)
             control_box.attach_next_to(jump_button,reverse_button,Gtk.PositionType.RIGHT,1,1)
             pause_button = Gtk.Button(label='PP',name='pause%d'%i)
-            pause_button.connect("clicked", self.on_pause)
+            pause_button.connect("clicked", self.on_pause, i)
             self.set_control(pause_button)
             control_box.attach_next_to(pause_button,jump_button,Gtk.PositionType.RIGHT,1,1)
             bounce_button = Gtk.ToggleButton(label='BNC', name='bounce%d'%i)
-            bounce_button.connect("toggled", self.on_bounce)
+            bounce_button.connect("toggled", self.on_bounce, i)
             self.set_control(bounce_button)
             control_box.attach_next_to(bounce_button,pause_button,Gtk.PositionType.RIGHT,1,1)
             next_cue = Gtk.Button(label="NXT",name="next%d"%i)
-            next_cue.connect("clicked", self.on_next_cue)
+            next_cue.connect("clicked", self.on_next_cue, i)
             self.set_control(next_cue)
             prev_cue = Gtk.Button(label="PRV",name="prev%d"%i)
-            prev_cue.connect("clicked", self.on_prev_cue)
+            prev_cue.connect("clicked", self.on_prev_cue, i)
             self.set_control(prev_cue)
             control_box.attach_next_to(prev_cue,bounce_button,Gtk.PositionType.RIGHT,1,1)
             control_box.attach_next_to(next_cue,prev_cue,Gtk.PositionType.RIGHT,1,1)
+            loop_in = Gtk.Button(label="IN",name="loopin%d"%i)
+            loop_in.connect("clicked", self.on_loop_in, i)
+            self.set_control(loop_in)
+            control_box.attach_next_to(loop_in,reverse_button,Gtk.PositionType.BOTTOM,1,1)
+            loop_out = Gtk.Button(label="OUT",name="loopout%d"%i)
+            loop_out.connect("clicked", self.on_loop_out, i)
+            self.set_control(loop_out)
+            control_box.attach_next_to(loop_out,loop_in,Gtk.PositionType.RIGHT,1,1)
+            loop_clear = Gtk.Button(label="CLR",name="loopclr%d"%i)
+            loop_clear.connect("clicked", self.on_loop_clear, i)
+            self.set_control(loop_clear)
+            control_box.attach_next_to(loop_clear,loop_out,Gtk.PositionType.RIGHT,1,1)
+            cache_button = Gtk.ToggleButton(label='RAM', name='cache%d'%i)
+            cache_button.connect("toggled", self.on_cache, i)
+            self.set_control(cache_button)
+            control_box.attach_next_to(cache_button,loop_clear,Gtk.PositionType.RIGHT,1,1)
+            level = Gtk.Scale.new_with_range(0,0,1,.01)
+            level.set_value(1.0)
+            level.set_name('level%d' % i)
+            level.connect('value_changed', self.on_level_move, i)
+            self.set_control(level)
+            control_box.attach_next_to(level,loop_in,Gtk.PositionType.BOTTOM,7,1)
         return control_box
 
     def set_control(self, widget):
@@ -303,7 +874,7 @@ class GTK_Main():
     def build_color_sliders(self):
         slider_box = Gtk.Grid()
         channels = ["HUE","SATURATION","CONTRAST","BRIGHTNESS"]
-        for i in range(2):
+        for i in range(self.decks):
             j = 0
             for channel in channels:
                 slider = Gtk.Scale.new_with_range(1,-1000,1000,50)
@@ -312,7 +883,7 @@ class GTK_Main():
                 slider.set_size_request(40,400)
                 slider.set_value(0)
                 slider.add_mark(0, Gtk.PositionType.LEFT, None)
-                slider.connect("value_changed", self.on_slider_move, channel)
+                slider.connect("value_changed", self.on_slider_move, channel, i)
                 slider_box.attach(slider,j+i*4,0,1,1)
                 button = Gtk.Button(label=channel[0:3])
                 button.connect("clicked", self.on_channel_reset, slider)
@@ -323,6 +894,18 @@ class GTK_Main():
                 j += 1
         return slider_box
 
+    def build_preset_buttons(self):
+        preset_box = Gtk.Grid()
+        store = Gtk.ToggleButton(label='STO', name='store')
+        self.set_control(store)
+        preset_box.attach(store,0,0,1,1)
+        for slot in range(SLOTS):
+            button = Gtk.Button(label='P%d' % (slot+1), name='preset%d' % slot)
+            button.connect("clicked", self.on_preset, slot)
+            self.set_control(button)
+            preset_box.attach(button,slot+1,0,1,1)
+        return preset_box
+
     def create_grandmaster(self):
         grandmaster = Gtk.Scale.new_with_range(1,0,1,.01)
         grandmaster.set_inverted(True)
@@ -345,7 +928,7 @@ class GTK_Main():
 
     def create_view_win(self):
         self.view_win = Gtk.Window(Gtk.WindowType.TOPLEVEL)
-        self.view_win.set_default_size(800,600)
+        self.view_win.set_default_size(OUTPUT_WIDTH,OUTPUT_HEIGHT)
         drawing_area = Gtk.DrawingArea()
         self.view_win.add(drawing_area)
         self.view_win.show_all()
@@ -357,7 +940,7 @@ class GTK_Main():
         self.ctrl_win.set_default_size(800,800)
         grid = Gtk.Grid()
         self.monitor = Gtk.DrawingArea()
-        self.monitor.set_size_request(720,180)
+        self.monitor.set_size_request(240*(self.decks+1),180)
         grid.attach(self.monitor,0,0,10,1)
         gm = self.create_grandmaster()
         grid.attach_next_to(gm,self.monitor,Gtk.PositionType.RIGHT,1,2)
@@ -368,15 +951,58 @@ class GTK_Main():
         fs = Gtk.Button(label="FS")
         fs.connect("clicked", self.on_fullscreen)
         grid.attach_next_to(fs,gm,Gtk.PositionType.BOTTOM,1,1)
+        rec = Gtk.ToggleButton(label="REC", name="record")
+        rec.connect("toggled", self.on_record)
+        self.set_control(rec)
+        grid.attach_next_to(rec,fs,Gtk.PositionType.BOTTOM,1,1)
+        sync = Gtk.Button(label="SYNC", name="sync")
+        sync.connect("clicked", self.on_sync_start)
+        self.set_control(sync)
+        grid.attach_next_to(sync,rec,Gtk.PositionType.BOTTOM,1,1)
+        stats = Gtk.ToggleButton(label="STATS", name="stats")
+        stats.connect("toggled", self.on_stats)
+        self.set_control(stats)
+        grid.attach_next_to(stats,sync,Gtk.PositionType.BOTTOM,1,1)
         sliders = self.build_color_sliders()
         grid.attach_next_to(sliders,cf,Gtk.PositionType.BOTTOM,8,8)
+        presets = self.build_preset_buttons()
+        grid.attach_next_to(presets,sliders,Gtk.PositionType.BOTTOM,8,1)
+        # Metrics overlay, shown with the STATS button.
+        self.overlay = Gtk.Label(xalign=0)
+        self.overlay.set_no_show_all(True)
+        grid.attach_next_to(self.overlay,presets,Gtk.PositionType.BOTTOM,8,1)
 
         self.ctrl_win.add(grid)
         self.ctrl_win.show_all()
         self.xid1 = self.ctrl_win.get_property("window").get_xid()        
 
 if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="pyvj video mixer")
+    parser.add_argument('--decks', type=int, default=2,
+                        help="number of decks (layers) to mix")
+    parser.add_argument('--trace', action='store_true',
+                        help="log control-to-photon latency")
+    parser.add_argument('--processes', action='store_true',
+                        help="run every deck in its own process")
+    parser.add_argument('--stream', metavar='HOST:PORT',
+                        help="also stream the program as RTP over UDP")
+    parser.add_argument('--setlist', metavar='FILE',
+                        help="JSON set list of the clips each deck plays")
+    parser.add_argument('--lookahead', type=int, default=LOOKAHEAD,
+                        help="upcoming cues per deck to warm up")
+    parser.add_argument('--preroll', action='store_true',
+                        help="also preroll a decoder on every warmed cue")
+    parser.add_argument('--proxies', action='store_true',
+                        help="make intra-only proxies of every long-GOP clip")
+    parser.add_argument('--metrics-osc', metavar='HOST:PORT',
+                        help="also send every metrics sample over OSC")
+    args = parser.parse_args()
+    profile = StartupProfile(IMPORT_START)
+    profile.phase('imports')
     Gdk.threads_init()
     Gst.init()
-    g = GTK_Main()
+    profile.phase('gst init')
+    g = GTK_Main(args.decks, args.trace, args.processes, args.stream,
+                 args.setlist, args.lookahead, args.metrics_osc,
+                 profile, args.preroll, args.proxies)
     Gtk.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import logging
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstController', '1.0')
+from gi.repository import GLib, Gst, GstController
+
+from mixer import color_property
+
+
+logger = logging.getLogger(__name__)
+
+# Extra time before a finished ramp hands its property back, so the last
+# frame of the ramp has been synced.
+SETTLE_MS = 50
+
+
+class Automation():
+    """Timed ramps of mixer properties, interpolated per frame in the
+    streaming threads by GstController control sources.
+
+    A control binding is created once per property and only enabled
+    while a ramp runs; afterwards the property is set to the target and
+    can be changed directly again. Setting it directly through the mixer
+    during a ramp cancels the ramp.
+    """
+
+    def __init__(self, mixer):
+        self.mixer = mixer
+        mixer.automation = self
+        # (object, property) -> (binding, control source, generation)
+        self.bindings = {}
+
+    def running_time(self):
+        """Return the running time of the output pipeline in ns."""
+        pipeline = self.mixer.pipeline
+        clock = pipeline.get_clock()
+        if clock is None:
+            return 0
+        return clock.get_time() - pipeline.get_base_time()
+
+    def ramp(self, obj, prop, target, seconds, done=None):
+        """Move a property linearly from its value to target over seconds.
+
+        done is called from the main loop once the ramp has finished, and
+        not at all when a later ramp of the same property replaced it.
+        """
+        key = (obj, prop)
+        entry = self.bindings.get(key)
+        if entry is None:
+            source = GstController.InterpolationControlSource()
+            source.set_property('mode', GstController.InterpolationMode.LINEAR)
+            binding = GstController.DirectControlBinding.new_absolute(
+                obj, prop, source)
+            obj.add_control_binding(binding)
+            entry = (binding, source, 0)
+        binding, source, generation = entry
+        generation += 1
+        self.bindings[key] = (binding, source, generation)
+        now = self.running_time()
+        source.unset_all()
+        source.set(now, obj.get_property(prop))
+        source.set(now + int(seconds * Gst.SECOND), target)
+        binding.set_disabled(False)
+        GLib.timeout_add(int(seconds * 1000) + SETTLE_MS, self.__finish,
+                         key, target, generation, done)
+
+    def cancel(self, obj, prop):
+        """Stop a ramp of a property where it is, without calling done."""
+        key = (obj, prop)
+        entry = self.bindings.get(key)
+        if entry is None:
+            return
+        binding, source, generation = entry
+        self.bindings[key] = (binding, source, generation + 1)
+        binding.set_disabled(True)
+
+    def __finish(self, key, target, generation, done):
+        """Release a property from its finished ramp."""
+        binding, source, current = self.bindings[key]
+        if current != generation:
+            return False
+        binding.set_disabled(True)
+        key[0].set_property(key[1], target)
+        if done:
+            done()
+        return False
+
+    def fade(self, alphas, seconds, done=None):
+        """Fade deck opacities to {deck : alpha} over seconds."""
+        remaining = [len(alphas)]
+
+        def finished(deck, alpha):
+            self.mixer.alphas[deck] = alpha
+            remaining[0] -= 1
+            if done and not remaining[0]:
+                done()
+
+        for deck, alpha in alphas.items():
+            self.ramp(self.mixer.pads[deck], 'alpha', alpha, seconds,
+                      lambda deck=deck, alpha=alpha: finished(deck, alpha))
+        logger.info("Fading decks to %s over %.1fs", alphas, seconds)
+
+    def sweep_color(self, deck, channel, value, seconds, done=None):
+        """Sweep a deck colour channel to value (-1000 to 1000)."""
+        prop, target = color_property(channel, value)
+
+        def finished():
+            self.mixer.colors[deck][channel] = value
+            if done:
+                done()
+
+        self.ramp(self.mixer.balances[deck], prop, target, seconds, finished)
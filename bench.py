@@ -0,0 +1,644 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import json
+import os
+import random
+import resource
+import select
+import shutil
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+from cputime import process_time
+from deckproc import START_TIMEOUT, DeckProcess
+from library import scan_keyframes, snap
+from mixer import Mixer, OUTPUT_HEIGHT, OUTPUT_WIDTH
+from monitor import Monitor, describe_preview_tap
+from player import TrickPlayer
+from udpsplit import Destination, Relay
+
+# Frame rate of generated test media.
+MEDIA_FPS = 30
+
+
+def summarize(samples):
+    """Return latency statistics in ms for a list of durations in s."""
+    samples = sorted(s * 1000 for s in samples)
+    if not samples:
+        return {'count' : 0}
+    return {'count' : len(samples),
+            'mean_ms' : statistics.mean(samples),
+            'median_ms' : statistics.median(samples),
+            'p95_ms' : samples[int(len(samples) * .95) - 1],
+            'max_ms' : samples[-1],
+            }
+
+
+def cpu_seconds():
+    """Return the user and system CPU seconds used by this process."""
+    used = resource.getrusage(resource.RUSAGE_SELF)
+    return used.ru_utime + used.ru_stime
+
+
+def generate_media(directory, count=2, seconds=10, width=1280, height=720,
+                   gop=MEDIA_FPS):
+    """Encode count test clips into directory, return their paths.
+
+    Clips are H.264 with a keyframe every gop frames, like camera or web
+    footage; without x264enc they fall back to intra-only MJPEG.
+    """
+    if Gst.ElementFactory.find('x264enc'):
+        encoder = ("x264enc key-int-max=%d speed-preset=ultrafast ! h264parse"
+                   % gop)
+    else:
+        encoder = "jpegenc"
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, 'clip%d.mkv' % i)
+        run_to_eos(Gst.parse_launch(
+            "videotestsrc num-buffers=%d pattern=%d ! "
+            "video/x-raw,width=%d,height=%d,framerate=%d/1 ! videoconvert ! "
+            "%s ! matroskamux ! filesink location=%s"
+            % (seconds * MEDIA_FPS, i % 20, width, height, MEDIA_FPS,
+               encoder, path)))
+        paths.append(path)
+    return paths
+
+
+def count_buffers(pad):
+    """Count the buffers passing a pad, return the one-item count list."""
+    count = [0]
+
+    def on_buffer(pad, info):
+        count[0] += 1
+        return Gst.PadProbeReturn.OK
+
+    pad.add_probe(Gst.PadProbeType.BUFFER, on_buffer)
+    return count
+
+
+def run_loop(seconds, done=None):
+    """Run the main loop for seconds, or until done() returns True."""
+    loop = GLib.MainLoop()
+
+    def check():
+        if done():
+            loop.quit()
+            return False
+        return True
+
+    timeout = GLib.timeout_add(int(seconds * 1000), loop.quit)
+    if done:
+        GLib.timeout_add(10, check)
+    loop.run()
+    GLib.source_remove(timeout)
+
+
+def make_player(path):
+    """Return a prerolled playbin rendering to a fakesink."""
+    pipeline = Gst.ElementFactory.make('playbin')
+    pipeline.set_property('uri', Gst.filename_to_uri(path))
+    pipeline.set_property('flags', 0x00000611)
+    sink = Gst.ElementFactory.make('fakesink')
+    sink.set_property('sync', False)
+    pipeline.set_property('video-sink', sink)
+    pipeline.set_state(Gst.State.PAUSED)
+    pipeline.get_state(Gst.CLOCK_TIME_NONE)
+    return pipeline
+
+
+def bench_seek(path, count=50, seed=0):
+    """Compare flushing seek latency for accurate, keyunit and snap modes."""
+    pipeline = make_player(path)
+    ok, duration = pipeline.query_duration(Gst.Format.TIME)
+    if not ok:
+        raise RuntimeError("Cannot query duration of %s" % path)
+    keyframes = scan_keyframes(path)
+    rng = random.Random(seed)
+    targets = [rng.randrange(0, duration) for i in range(count)]
+    modes = {
+        'accurate' : (Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE, False),
+        'keyunit' : (Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT
+                     | Gst.SeekFlags.SNAP_NEAREST, False),
+        'snap' : (Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE, True),
+        }
+    results = {'file' : path, 'keyframes' : len(keyframes)}
+    for mode, (flags, snapped) in modes.items():
+        times = []
+        for target in targets:
+            if snapped:
+                target = snap(keyframes, target)
+            start = time.perf_counter()
+            pipeline.seek_simple(Gst.Format.TIME, flags, target)
+            # A flushing seek in PAUSED completes when it has prerolled.
+            pipeline.get_state(Gst.CLOCK_TIME_NONE)
+            times.append(time.perf_counter() - start)
+        results[mode] = summarize(times)
+    pipeline.set_state(Gst.State.NULL)
+    return results
+
+
+def bench_switch(paths, count=20, interval=0.5, cold=False):
+    """Measure TrickPlayer cue switch latency, with or without preroll."""
+    player = TrickPlayer(0)
+    player.file = paths[0]
+    player.run()
+    player.start()
+    if not cold:
+        player.preload(paths[1])
+    cue = [0]
+    misses = [0]
+
+    def step():
+        if len(player.switch_latencies) >= count:
+            return False
+        if player.switch_requested is None:
+            cue[0] += 1
+            newfile = paths[cue[0] % len(paths)]
+            if player.standby_file != newfile or not player.standby_ready:
+                misses[0] += 1
+            player.change_file(newfile)
+            if not cold:
+                player.preload(paths[(cue[0] + 1) % len(paths)])
+        return True
+
+    GLib.timeout_add(int(interval * 1000), step)
+    run_loop(count * interval * 4,
+             lambda: len(player.switch_latencies) >= count)
+    player.cleanup()
+    results = summarize(player.switch_latencies)
+    results['not_ready'] = misses[0]
+    return results
+
+
+def bench_trick(path, seconds=10, rate=2.0):
+    """Measure TrickPlayer frame throughput forward, reverse and bouncing.
+
+    Bouncing runs between loop points 1 and 3 s into the clip, so most of
+    its time is spent around the direction changes.
+    """
+    results = {'file' : path, 'rate' : rate}
+    for mode, (speed, loop) in {'forward' : (rate, 1),
+                                'reverse' : (-rate, 1),
+                                'bounce' : (rate, 2)}.items():
+        player = TrickPlayer(0)
+        player.file = path
+        player.rate = speed
+        player.loop = loop
+        if mode == 'bounce':
+            player.loop_points[path] = (1 * Gst.SECOND, 3 * Gst.SECOND)
+        player.run()
+        frames = count_buffers(player.video_sink.get_static_pad('sink'))
+        cpu = cpu_seconds()
+        player.start()
+        run_loop(seconds)
+        used = cpu_seconds() - cpu
+        player.cleanup()
+        results[mode] = {'fps' : frames[0] / seconds,
+                         'target_fps' : MEDIA_FPS * abs(rate),
+                         'cpu_percent' : used * 100 / seconds,
+                         'flushing_seeks' : player.seek_counts['flushing'],
+                         'loops' : len(player.loop_gaps),
+                         }
+        if player.loop_gaps:
+            results[mode]['loop_gap'] = summarize(player.loop_gaps)
+    return results
+
+
+def bench_pipelines(paths, decks=2, seconds=10, fps=10):
+    """Measure the CPU added by the decks, the output and the monitor.
+
+    Each stage runs the previous ones too, so its marginal CPU is the
+    difference to the stage before.
+    """
+    players = []
+    for i in range(decks):
+        player = TrickPlayer(i)
+        player.file = paths[i % len(paths)]
+        player.run()
+        player.start()
+        players.append(player)
+    mixer = Mixer(decks)
+    output = mixer.build(mixer.describe_program(
+        "fakesink name=output", describe_preview_tap(fps)))
+    monitor = Monitor(decks, fps)
+    monitor.build(output, "fakesink name=monitor sync=false")
+    frames = {name : count_buffers(
+                  pipeline.get_by_name(name).get_static_pad('sink'))
+              for name, pipeline in (('output', output),
+                                     ('monitor', monitor.pipeline))}
+    # Let the decks preroll and enter segment mode first.
+    run_loop(1)
+    results = {'decks' : decks}
+    total = 0.0
+    for stage, pipeline in (('decks', None), ('output', output),
+                            ('monitor', monitor.pipeline)):
+        if pipeline:
+            pipeline.set_state(Gst.State.PLAYING)
+        for count in frames.values():
+            count[0] = 0
+        monitor.cpu_percent()
+        cpu = cpu_seconds()
+        run_loop(seconds)
+        percent = (cpu_seconds() - cpu) * 100 / seconds
+        results[stage] = {'cpu_percent' : percent,
+                          'marginal_cpu_percent' : percent - total,
+                          'output_fps' : frames['output'][0] / seconds,
+                          'monitor_fps' : frames['monitor'][0] / seconds,
+                          }
+        total = percent
+    results['monitor']['monitor_threads_cpu_percent'] = monitor.cpu_percent()
+    monitor.pipeline.set_state(Gst.State.NULL)
+    output.set_state(Gst.State.NULL)
+    for player in players:
+        player.cleanup()
+    return results
+
+
+def bench_processes(paths, decks=2, seconds=10, rate=1.0):
+    """Compare decks in this process with one worker process per deck."""
+    results = {'decks' : decks, 'rate' : rate, 'cpus' : os.cpu_count()}
+    for mode in ('single', 'processes'):
+        directory = tempfile.mkdtemp(prefix='pyvj_bench_shm_')
+        players = []
+        for i in range(decks):
+            if mode == 'processes':
+                player = DeckProcess(i, directory,
+                    {'path' : os.path.dirname(paths[0]), 'cache_mb' : 64,
+                     'width' : OUTPUT_WIDTH, 'height' : OUTPUT_HEIGHT})
+            else:
+                player = TrickPlayer(i)
+            player.file = paths[i % len(paths)]
+            player.rate = rate
+            player.run()
+            player.start()
+            players.append(player)
+        output = Mixer(decks).build("fakesink name=output")
+        frames = count_buffers(output.get_by_name('output').get_static_pad('sink'))
+        output.set_state(Gst.State.PLAYING)
+        # Deck processes report ready asynchronously.
+        run_loop(START_TIMEOUT, lambda: all(
+            getattr(player, 'pid', 0) is not None for player in players))
+        run_loop(1)
+        pids = [player.pid for player in players if mode == 'processes']
+        frames[0] = 0
+        cpu = cpu_seconds()
+        workers = sum(process_time(pid) for pid in pids)
+        start = time.perf_counter()
+        run_loop(seconds)
+        wall = time.perf_counter() - start
+        main = cpu_seconds() - cpu
+        workers = sum(process_time(pid) for pid in pids) - workers
+        results[mode] = {'output_fps' : frames[0] / wall,
+                         'main_cpu_percent' : main * 100 / wall,
+                         'worker_cpu_percent' : workers * 100 / wall,
+                         'cores_used' : (main + workers) / wall,
+                         }
+        output.set_state(Gst.State.NULL)
+        for player in players:
+            player.cleanup()
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def run_to_eos(pipeline):
+    """Play a pipeline until EOS, return wall and CPU seconds used."""
+    cpu = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    pipeline.set_state(Gst.State.PLAYING)
+    msg = pipeline.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE,
+        Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    wall = time.perf_counter() - start
+    used = resource.getrusage(resource.RUSAGE_SELF)
+    pipeline.set_state(Gst.State.NULL)
+    if msg.type == Gst.MessageType.ERROR:
+        err, debug = msg.parse_error()
+        raise RuntimeError(err.message)
+    return wall, (used.ru_utime - cpu.ru_utime) + (used.ru_stime - cpu.ru_stime)
+
+
+def bench_composite(max_decks=8, frames=300, in_width=1920, in_height=1080,
+                    width=OUTPUT_WIDTH, height=OUTPUT_HEIGHT):
+    """Measure unsynced compositor fps for 1 to max_decks decks."""
+    results = {'input' : '%dx%d' % (in_width, in_height),
+               'output' : '%dx%d' % (width, height)}
+    for decks in range(1, max_decks + 1):
+        mixer = Mixer(decks, width, height)
+        sources = "\n".join(
+            "videotestsrc num-buffers=%d pattern=%d ! "
+            "video/x-raw,width=%d,height=%d,framerate=30/1 ! queue ! mix.sink_%d"
+            % (frames, i % 20, in_width, in_height, i) for i in range(decks))
+        pipeline = Gst.parse_launch("%s ! fakesink sync=false\n%s"
+                                    % (mixer.describe_compositor(), sources))
+        wall, cpu = run_to_eos(pipeline)
+        results['decks_%d' % decks] = {'fps' : frames / wall,
+                                       'cpu_ms_per_frame' : cpu * 1000 / frames}
+    return results
+
+
+def bench_composite_sizes(max_decks=8, frames=300, in_width=1920,
+                          in_height=1080, outputs=((OUTPUT_WIDTH, OUTPUT_HEIGHT),)):
+    """Run bench_composite for each output resolution."""
+    return {'%dx%d' % (width, height) : bench_composite(
+                max_decks, frames, in_width, in_height, width, height)
+            for width, height in outputs}
+
+
+def run_live(pipeline, seconds, sink_name='output', others=()):
+    """Play a live pipeline for seconds, return frames at sink and CPU %.
+
+    others are played alongside, e.g. a monitor fed from the pipeline.
+    """
+    frames = count_buffers(
+        pipeline.get_by_name(sink_name).get_static_pad('sink'))
+    cpu = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    for other in others:
+        other.set_state(Gst.State.PLAYING)
+    pipeline.set_state(Gst.State.PLAYING)
+    msg = pipeline.get_bus().timed_pop_filtered(int(seconds * Gst.SECOND),
+                                                Gst.MessageType.ERROR)
+    wall = time.perf_counter() - start
+    used = resource.getrusage(resource.RUSAGE_SELF)
+    pipeline.set_state(Gst.State.NULL)
+    for other in others:
+        other.set_state(Gst.State.NULL)
+    if msg:
+        err, debug = msg.parse_error()
+        raise RuntimeError(err.message)
+    cpu = (used.ru_utime - cpu.ru_utime) + (used.ru_stime - cpu.ru_stime)
+    return frames[0], cpu * 100 / wall
+
+
+def describe_legacy_output(decks, source):
+    """Return the output graph used before the compositor/tee rework."""
+    return "\n".join([
+        "videomixer name=mix background=black ! intervideosink channel=bench_mix",
+        "intervideosrc channel=bench_mix ! queue ! "
+        "video/x-raw,width=%d,height=%d ! fakesink name=output"
+        % (OUTPUT_WIDTH, OUTPUT_HEIGHT),
+        "intervideosrc channel=bench_mix ! queue ! videoconvert ! videoscale ! "
+        "video/x-raw,width=240,height=180 ! fakesink name=monitor",
+        ] + ["%s ! videoscale ! video/x-raw,width=%d,height=%d ! queue ! mix.sink_%d"
+             % (source % {'ident' : i}, OUTPUT_WIDTH, OUTPUT_HEIGHT, i)
+             for i in range(decks)])
+
+
+def build_lean_output(decks, source, fps):
+    """Return the output and monitor strip pipelines as the app builds them."""
+    mixer = Mixer(decks)
+    output = mixer.build(mixer.describe_program(
+        "fakesink name=output", describe_preview_tap(fps)), source)
+    monitor = Monitor(decks, fps)
+    monitor.build(output, "fakesink name=monitor sync=false")
+    return output, [monitor.pipeline]
+
+
+def bench_output(decks=2, seconds=10, in_width=1920, in_height=1080, fps=10):
+    """Compare CPU use of the legacy and lean output graphs in real time.
+
+    lean is the compositor, program tee, preview tap and monitor strip the
+    app runs, with previews at fps.
+    """
+    source = ("videotestsrc is-live=true pattern=%%(ident)d ! "
+              "video/x-raw,width=%d,height=%d,framerate=30/1"
+              % (in_width, in_height))
+    graphs = {
+        'legacy' : (Gst.parse_launch(describe_legacy_output(decks, source)),
+                    []),
+        'lean' : build_lean_output(decks, source, fps),
+        }
+    results = {'decks' : decks, 'input' : '%dx%d' % (in_width, in_height)}
+    for name, (pipeline, others) in graphs.items():
+        frames, cpu = run_live(pipeline, seconds, others=others)
+        results[name] = {'fps' : frames / seconds,
+                         'cpu_percent' : cpu}
+    return results
+
+
+def osc_message(address, value):
+    """Return an OSC message carrying one float."""
+    address = address.encode()
+    address += b'\0' * (4 - len(address) % 4)
+    return address + b',f\0\0' + struct.pack('>f', value)
+
+
+def bench_relay(destinations=2, seconds=5, bundle=1):
+    """Blast OSC through a loopback relay, return sustained packets/s."""
+    sinks = []
+    for i in range(destinations):
+        sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sink.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        sink.bind(('127.0.0.1', 0))
+        sink.setblocking(False)
+        sinks.append(sink)
+    relay = Relay(('127.0.0.1', 0),
+                  [Destination(*sink.getsockname()) for sink in sinks])
+    delivered = [0] * destinations
+    running = [True]
+
+    def drain():
+        while running[0]:
+            readable, _, _ = select.select(sinks, [], [], 0.1)
+            for sock in readable:
+                i = sinks.index(sock)
+                try:
+                    while True:
+                        sock.recv(65535)
+                        delivered[i] += 1
+                except BlockingIOError:
+                    pass
+
+    packet = osc_message('/video/speed0', 0.5)
+    if bundle > 1:
+        # A bundle of faders as a controller sends on a sweep.
+        packet = b'#bundle\0' + b'\0' * 7 + b'\1' + b''.join(
+            struct.pack('>i', len(packet)) + packet for i in range(bundle))
+    threads = [threading.Thread(target=relay.run),
+               threading.Thread(target=drain)]
+    for thread in threads:
+        thread.start()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sent = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        try:
+            sender.sendto(packet, relay.address)
+            sent += 1
+        except OSError:
+            pass
+    wall = time.perf_counter() - start
+    # Let the relay and sinks catch up before stopping them.
+    time.sleep(0.5)
+    relay.stop()
+    running[0] = False
+    for thread in threads:
+        thread.join()
+    stats = relay.stats()
+    relay.close()
+    sender.close()
+    for sink in sinks:
+        sink.close()
+    results = {'destinations' : destinations,
+               'packet_bytes' : len(packet),
+               'sent_pps' : sent / wall,
+               'relayed_pps' : stats['received'] / wall,
+               }
+    for i, dest in enumerate(relay.destinations):
+        results['dest_%d' % i] = dict(dest.stats(),
+                                      delivered=delivered[i],
+                                      delivered_pps=delivered[i] / wall)
+    return results
+
+
+def metadata():
+    """Return what a result has to be compared against: commit and versions."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit' : commit or None,
+            'gstreamer' : Gst.version_string(),
+            'python' : sys.version.split()[0],
+            'time' : datetime.datetime.now().isoformat(timespec='seconds'),
+            }
+
+
+def print_table(results, prefix=''):
+    """Print benchmark results for people."""
+    for name, value in results.items():
+        name = prefix + str(name)
+        if isinstance(value, dict) and any(isinstance(v, dict)
+                                           for v in value.values()):
+            print_table(value, name + '.')
+        elif isinstance(value, dict):
+            print("%-12s %s" % (name, "  ".join(
+                "%s=%.2f" % (k, v) if isinstance(v, float) else "%s=%s" % (k, v)
+                for k, v in value.items())))
+        else:
+            print("%-12s %s" % (name, value))
+
+
+def size(value):
+    """Parse a WxH frame size."""
+    return tuple(int(v) for v in value.split('x'))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Headless pyvj benchmarks.")
+    parser.add_argument('--json', action='store_true',
+                        help="print machine-readable results")
+    parser.add_argument('--out', help="also write the JSON results to a file")
+    parser.add_argument('--media', type=size, default=(1280, 720),
+                        help="size of generated test clips, WxH")
+    parser.add_argument('--gop', type=int, default=MEDIA_FPS,
+                        help="keyframe interval of generated test clips")
+    sub = parser.add_subparsers(dest='bench', required=True)
+    seek = sub.add_parser('seek', help="seek latency per seek mode")
+    seek.add_argument('file', nargs='?',
+                      help="clip to seek in, a generated one if omitted")
+    seek.add_argument('--count', type=int, default=50)
+    seek.add_argument('--seed', type=int, default=0)
+    switch = sub.add_parser('switch', help="cue switch latency")
+    switch.add_argument('--count', type=int, default=20)
+    switch.add_argument('--interval', type=float, default=0.5)
+    trick = sub.add_parser('trick', help="reverse and bounce throughput")
+    trick.add_argument('--seconds', type=float, default=10)
+    trick.add_argument('--rate', type=float, default=2.0)
+    pipelines = sub.add_parser('pipelines', help="CPU per pipeline")
+    pipelines.add_argument('--decks', type=int, default=2)
+    pipelines.add_argument('--seconds', type=float, default=10)
+    processes = sub.add_parser('processes',
+                               help="single process vs process per deck")
+    processes.add_argument('--decks', type=int, default=2)
+    processes.add_argument('--seconds', type=float, default=10)
+    processes.add_argument('--rate', type=float, default=1.0)
+    composite = sub.add_parser('composite', help="compositor fps per deck count")
+    composite.add_argument('--decks', type=int, default=8)
+    composite.add_argument('--frames', type=int, default=300)
+    composite.add_argument('--input', type=size, default=(1920, 1080),
+                           help="deck frame size, WxH")
+    composite.add_argument('--outputs', default='%dx%d' % (OUTPUT_WIDTH,
+                                                           OUTPUT_HEIGHT),
+                           help="comma separated output sizes, WxH")
+    output = sub.add_parser('output', help="legacy vs lean output graph CPU")
+    output.add_argument('--decks', type=int, default=2)
+    output.add_argument('--seconds', type=float, default=10)
+    output.add_argument('--input', type=size, default=(1920, 1080),
+                        help="deck frame size, WxH")
+    relay = sub.add_parser('relay', help="OSC relay loopback load test")
+    relay.add_argument('--destinations', type=int, default=2)
+    relay.add_argument('--seconds', type=float, default=5)
+    relay.add_argument('--bundle', type=int, default=1,
+                       help="messages per packet, more than 1 sends bundles")
+    sub.add_parser('all', help="every benchmark on generated media")
+    args = parser.parse_args(argv)
+
+    Gst.init(None)
+    with tempfile.TemporaryDirectory(prefix='pyvj_bench_') as directory:
+        paths = []
+        if args.bench in ('switch', 'trick', 'pipelines', 'processes',
+                          'all') or (
+                args.bench == 'seek' and not args.file):
+            paths = generate_media(directory, 2, 10, *args.media, args.gop)
+        if args.bench == 'seek':
+            results = bench_seek(args.file or paths[0], args.count, args.seed)
+        elif args.bench == 'switch':
+            results = {'warm' : bench_switch(paths, args.count, args.interval),
+                       'cold' : bench_switch(paths, args.count, args.interval,
+                                             cold=True)}
+        elif args.bench == 'trick':
+            results = bench_trick(paths[0], args.seconds, args.rate)
+        elif args.bench == 'pipelines':
+            results = bench_pipelines(paths, args.decks, args.seconds)
+        elif args.bench == 'processes':
+            results = bench_processes(paths, args.decks, args.seconds,
+                                      args.rate)
+        elif args.bench == 'composite':
+            results = bench_composite_sizes(args.decks, args.frames,
+                *args.input,
+                [size(output) for output in args.outputs.split(',')])
+        elif args.bench == 'output':
+            results = bench_output(args.decks, args.seconds, *args.input)
+        elif args.bench == 'relay':
+            results = bench_relay(args.destinations, args.seconds, args.bundle)
+        elif args.bench == 'all':
+            results = {
+                'seek' : bench_seek(paths[0]),
+                'switch' : {'warm' : bench_switch(paths),
+                            'cold' : bench_switch(paths, cold=True)},
+                'trick' : bench_trick(paths[0]),
+                'pipelines' : bench_pipelines(paths),
+                'processes' : bench_processes(paths),
+                'composite' : bench_composite_sizes(4, 150, *args.media,
+                    [(OUTPUT_WIDTH, OUTPUT_HEIGHT), (1280, 720), (1920, 1080)]),
+                'output' : bench_output(2, 10, *args.media),
+                'relay' : bench_relay(),
+                }
+    results = {'bench' : args.bench, 'meta' : metadata(), 'results' : results}
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print_table(results)
+
+
+if __name__=='__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import os
+import time
+
+# Clock ticks per second used by /proc stat times.
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def parse_stat(stat):
+    """Return the name and CPU seconds in a /proc stat line."""
+    # The name is in parentheses and may contain spaces.
+    name = stat[stat.index('(') + 1:stat.rindex(')')]
+    fields = stat[stat.rindex(')') + 2:].split()
+    return name, (int(fields[11]) + int(fields[12])) / CLK_TCK
+
+
+def process_time(pid):
+    """Return the CPU seconds used by all threads of a process."""
+    with open('/proc/%d/stat' % pid) as f:
+        return parse_stat(f.read())[1]
+
+
+def process_rss(pid=None):
+    """Return the resident memory of a process, this one by default."""
+    with open('/proc/%s/statm' % (pid or 'self')) as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def thread_times():
+    """Return CPU seconds used by each thread of this process by name.
+
+    GStreamer names streaming threads after their element and pad, so
+    threads can be attributed to pipelines by element name prefix.
+    """
+    times = {}
+    for tid in os.listdir('/proc/self/task'):
+        try:
+            with open('/proc/self/task/%s/stat' % tid) as f:
+                stat = f.read()
+        except OSError:
+            continue
+        name, used = parse_stat(stat)
+        times[name] = times.get(name, 0) + used
+    return times
+
+
+class CpuMeter():
+    """CPU use of the threads whose names start with a prefix."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.last = (time.monotonic(), self.used())
+
+    def used(self):
+        """Return the CPU seconds used so far by matching threads."""
+        return sum(used for name, used in thread_times().items()
+                   if name.startswith(self.prefix))
+
+    def percent(self):
+        """Return the CPU % of one core used since the previous call."""
+        now, used = time.monotonic(), self.used()
+        then, before = self.last
+        self.last = (now, used)
+        if now == then:
+            return 0.0
+        return (used - before) * 100 / (now - then)
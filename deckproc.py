@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+
+import logging
+import multiprocessing
+import os
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+from framecache import FrameCache
+from library import MediaLibrary
+from mixer import deck_channel
+from player import TrickPlayer
+from proxy import ProxyManager
+
+
+logger = logging.getLogger(__name__)
+
+# Frame rate decks are handed to the mixer at.
+DECK_FPS = 30
+
+# Frames the shared memory area of a deck holds; the receiver, the
+# intervideo channel and the compositor each keep one referenced.
+SHM_FRAMES = 8
+
+# TrickPlayer methods and attributes a deck process accepts.
+COMMANDS = {'start', 'stop', 'change_file', 'preload', 'reverse',
+            'jump_loop', 'set_loop_in', 'set_loop_out', 'set_loop_points',
+            'pause_play', 'set_cache_mode', 'set_speed', 'recall',
+            'sync_start'}
+ATTRIBUTES = {'loop'}
+
+# How often a worker reports changed deck state, in ms.
+STATE_INTERVAL = 50
+
+# Seconds to wait for a worker to start producing frames.
+START_TIMEOUT = 10
+
+# Seconds before restarting a dead worker, doubled on every exit in a row,
+# and the exits in a row after which the deck is given up.
+RESTART_DELAY = 0.5
+RESTART_LIMIT = 5
+
+# Seconds a worker must run before its exit no longer counts as in a row.
+RESTART_STABLE = 60
+
+# videoscale methods of the bridge at full and reduced quality.
+SCALE_METHODS = {False : 1, True : 0}
+
+
+def describe_bridge(ident, socket_path, width, height):
+    """Return the worker pipeline moving deck frames into shared memory."""
+    size = width * height * 3 // 2
+    return ("intervideosrc channel=%s ! videoconvert ! videoscale name=scale ! "
+            "video/x-raw,format=I420,width=%d,height=%d,framerate=%d/1 ! "
+            "shmsink socket-path=%s shm-size=%d wait-for-connection=false "
+            "sync=false"
+            % (deck_channel(ident), width, height, DECK_FPS, socket_path,
+               size * SHM_FRAMES))
+
+
+def describe_receiver(ident, socket_path, width, height):
+    """Return the mixer-side pipeline feeding a deck's frames to its channel.
+
+    shmsrc wraps the shared memory without copying, and the intervideo
+    channel passes the same buffer on to the compositor and the monitor.
+    """
+    return ("shmsrc socket-path=%s is-live=true do-timestamp=true ! "
+            "video/x-raw,format=I420,width=%d,height=%d,framerate=%d/1 ! "
+            "intervideosink name=sink channel=%s"
+            % (socket_path, width, height, DECK_FPS, deck_channel(ident)))
+
+
+def _run_deck(ident, conn, options):
+    """Play one deck in a worker process, driven over conn."""
+    Gst.init(None)
+    width, height = options['width'], options['height']
+    library = MediaLibrary(options['path'])
+    proxies = ProxyManager(library, width, height)
+    player = TrickPlayer(ident, FrameCache(options['cache_mb'], width, height),
+                         library.keyframes, proxies)
+    player.file = options['file']
+    player.seek_mode = options['seek_mode']
+    player.rate = options['rate']
+    player.loop = options['loop']
+    player.loop_points.update(options['loop_points'])
+    player.on_switch = lambda *switch: conn.send(('switched', switch))
+    player.run()
+    bridge = Gst.parse_launch(describe_bridge(ident, options['socket'],
+                                              width, height))
+    bridge.set_state(Gst.State.PLAYING)
+    loop = GLib.MainLoop()
+    sent = [None]
+
+    def send_state():
+        state = {'file' : player.file,
+                 'rate' : player.rate,
+                 'loop' : player.loop,
+                 'loop_points' : player.get_loop_points(),
+                 'cached' : player.cached_clip is not None,
+                 'settled' : player.settled(),
+                 }
+        if state != sent[0]:
+            sent[0] = state
+            conn.send(('state', state))
+        return True
+
+    def on_command(fd, condition):
+        if condition & (GLib.IO_HUP | GLib.IO_ERR):
+            loop.quit()
+            return False
+        while conn.poll():
+            command, args = conn.recv()
+            if command == 'quit':
+                loop.quit()
+                return False
+            if command == 'reload':
+                library.load()
+                proxies.forget()
+            elif command == 'proxy_ready':
+                proxies.forget(*args)
+            elif command == 'set_low_quality':
+                player.set_low_quality(*args)
+                bridge.get_by_name('scale').set_property(
+                    'method', SCALE_METHODS[args[0]])
+            elif command in ATTRIBUTES:
+                setattr(player, command, *args)
+            elif command in COMMANDS:
+                getattr(player, command)(*args)
+        send_state()
+        return True
+
+    GLib.io_add_watch(conn.fileno(), GLib.PRIORITY_DEFAULT,
+                      GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, on_command)
+    GLib.timeout_add(STATE_INTERVAL, send_state)
+    conn.send(('ready', os.getpid()))
+    loop.run()
+    player.cleanup()
+    bridge.set_state(Gst.State.NULL)
+
+
+class DeckProcess():
+    """A TrickPlayer run in its own process, with the same control calls.
+
+    Frames come back through shared memory, controls go out over a pipe
+    and deck state is mirrored from the worker's reports, so no call
+    waits for the worker. A worker that dies is restarted with the last
+    known state while the other decks play on, after a growing delay, and
+    the deck is marked failed once workers keep dying.
+    """
+
+    def __init__(self, ident, directory, options):
+        self.ident = ident
+        self.socket = os.path.join(directory, 'deck%d' % ident)
+        self.options = options
+        self.file = None
+        self.seek_mode = 'snap'
+        self.rate = 1.0
+        self._loop = 1
+        self.loop_points = {}
+        self.cached_clip = None
+        self.is_settled = True
+        self.process = None
+        self.conn = None
+        self.watch = None
+        self.receiver = None
+        self.pid = None
+        self.playing = False
+        self.stopping = False
+        self.restarts = 0
+        # Exits without a stable run in between, and whether the deck is
+        # given up.
+        self.failures = 0
+        self.failed = False
+        self.started_at = None
+        self.low_quality = False
+        self.on_switch = None
+
+    def run(self):
+        """Start the worker; frames are received once it reports ready.
+
+        Nothing waits for the worker, so decks start side by side and a
+        deck failing to start holds up no other.
+        """
+        context = multiprocessing.get_context('spawn')
+        self.conn, child = context.Pipe()
+        if os.path.exists(self.socket):
+            os.remove(self.socket)
+        options = dict(self.options, file=self.file, socket=self.socket,
+                       seek_mode=self.seek_mode, rate=self.rate,
+                       loop=self._loop, loop_points=self.loop_points)
+        self.process = context.Process(target=_run_deck, name='deck%d' % self.ident,
+                                       args=(self.ident, child, options),
+                                       daemon=True)
+        self.process.start()
+        self.started_at = time.monotonic()
+        child.close()
+        self.pid = None
+        self.watch = GLib.io_add_watch(self.conn.fileno(), GLib.PRIORITY_DEFAULT,
+            GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self.on_message)
+        GLib.timeout_add_seconds(START_TIMEOUT, self.on_start_timeout,
+                                 self.process)
+        if self.low_quality:
+            self.send('set_low_quality', True)
+        # A restarted worker reuses the receiver, so bus watches on it last.
+        if self.receiver is None:
+            self.receiver = Gst.parse_launch(describe_receiver(
+                self.ident, self.socket, self.options['width'],
+                self.options['height']))
+            bus = self.receiver.get_bus()
+            bus.add_signal_watch()
+            bus.connect('message::error', self.on_receiver_error)
+
+    def on_start_timeout(self, process):
+        if process is self.process and self.pid is None:
+            logger.error("Deck %d process did not start.", self.ident)
+        return False
+
+    def on_message(self, fd, condition):
+        """Mirror state reports, restart the worker when it has gone."""
+        try:
+            while self.conn.poll():
+                message, value = self.conn.recv()
+                if message == 'ready':
+                    self.pid = value
+                    self.receiver.set_state(Gst.State.PLAYING)
+                elif message == 'state':
+                    self.file = value['file']
+                    self.rate = value['rate']
+                    self._loop = value['loop']
+                    self.loop_points[self.file] = tuple(value['loop_points'])
+                    self.cached_clip = value['cached'] or None
+                    self.is_settled = value['settled']
+                elif message == 'switched' and self.on_switch:
+                    self.on_switch(*value)
+        except (EOFError, OSError):
+            condition = GLib.IO_HUP
+        if condition & (GLib.IO_HUP | GLib.IO_ERR):
+            self.watch = None
+            if not self.stopping:
+                self.schedule_restart()
+            return False
+        return True
+
+    def on_receiver_error(self, bus, message):
+        err, debug = message.parse_error()
+        logger.warning("Deck %d frames: %s", self.ident, err.message)
+
+    def schedule_restart(self):
+        """Restart a dead worker after a delay, or give the deck up."""
+        self.receiver.set_state(Gst.State.NULL)
+        self.conn.close()
+        if time.monotonic() - self.started_at >= RESTART_STABLE:
+            self.failures = 0
+        self.failures += 1
+        if self.failures > RESTART_LIMIT:
+            self.failed = True
+            logger.error("Deck %d process exited (%s) %d times in a row, "
+                         "giving up.", self.ident, self.process.exitcode,
+                         RESTART_LIMIT + 1)
+            return
+        delay = RESTART_DELAY * 2 ** (self.failures - 1)
+        logger.error("Deck %d process exited (%s), restarting in %.1fs.",
+                     self.ident, self.process.exitcode, delay)
+        GLib.timeout_add(int(delay * 1000), self.restart)
+
+    def restart(self):
+        """Replace a dead worker, resuming its file, rate and loop."""
+        if self.stopping:
+            return False
+        self.restarts += 1
+        self.run()
+        if self.playing:
+            self.start()
+        return False
+
+    def send(self, command, *args):
+        """Send a control to the worker without waiting for it."""
+        if self.conn.closed:
+            # The worker is waiting to be restarted, or given up.
+            return
+        try:
+            self.conn.send((command, args))
+        except OSError as err:
+            logger.warning("Deck %d: %s not sent: %s", self.ident, command, err)
+
+    @property
+    def loop(self):
+        return self._loop
+
+    @loop.setter
+    def loop(self, loop):
+        self._loop = loop
+        self.send('loop', loop)
+
+    def start(self):
+        self.playing = True
+        self.send('start')
+
+    def stop(self):
+        """End the worker and stop receiving its frames."""
+        self.stopping = True
+        self.playing = False
+        self.send('quit')
+        self.process.join(2)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.receiver.set_state(Gst.State.NULL)
+        if os.path.exists(self.socket):
+            os.remove(self.socket)
+
+    cleanup = stop
+
+    def change_file(self, newfile):
+        self.file = newfile
+        self.is_settled = False
+        self.send('change_file', newfile)
+
+    def preload(self, newfile, rate=None, loop_points=None):
+        self.send('preload', newfile, rate, loop_points)
+
+    def reverse(self):
+        self.rate *= -1.0
+        self.send('reverse')
+
+    def jump_loop(self):
+        self.send('jump_loop')
+
+    def set_loop_in(self):
+        self.send('set_loop_in')
+
+    def set_loop_out(self):
+        self.send('set_loop_out')
+
+    def set_loop_points(self, loop_in=None, loop_out=None):
+        self.send('set_loop_points', loop_in, loop_out)
+
+    def pause_play(self):
+        self.playing = not self.playing
+        self.send('pause_play')
+
+    def set_cache_mode(self, enabled):
+        self.send('set_cache_mode', enabled)
+
+    def set_speed(self, rate):
+        self.rate = rate
+        self.send('set_speed', rate)
+
+    def recall(self, filename, rate, loop, loop_points):
+        self.file = filename
+        self.rate = rate
+        self._loop = loop
+        self.loop_points[filename] = tuple(loop_points)
+        self.is_settled = False
+        self.send('recall', filename, rate, loop, loop_points)
+
+    def reload_library(self):
+        """Have the worker read the library index again."""
+        self.send('reload')
+
+    def proxy_ready(self, name):
+        """Have the worker look for the proxy of a file again."""
+        self.send('proxy_ready', name)
+
+    def set_low_quality(self, low):
+        self.low_quality = low
+        self.send('set_low_quality', low)
+
+    def sync_start(self, base_time):
+        # The system clock is monotonic, the same in every process.
+        self.playing = True
+        self.send('sync_start', base_time)
+
+    def pipelines(self):
+        return [self.receiver]
+
+    def sink_pads(self):
+        return [self.receiver.get_by_name('sink').get_static_pad('sink')]
+
+    def get_loop_points(self, filename=None):
+        return self.loop_points.get(filename or self.file, (None, None))
+
+    def settled(self):
+        return self.is_settled
+
+    def sink_pad(self):
+        # Deck buffers are produced in the worker; trace to the output only.
+        return None
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+import collections
+import logging
+import threading
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+from mixer import deck_channel
+
+
+logger = logging.getLogger(__name__)
+
+class CachedClip():
+
+    def __init__(self, key, caps, frames, duration):
+        self.key = key
+        self.caps = caps
+        self.frames = frames
+        # Duration of one frame in ns.
+        self.duration = duration
+        self.size = sum(frame.get_size() for frame in frames)
+        self.users = 0
+
+
+class FrameCache():
+    """Decoded frames of short clips shared by all decks, LRU evicted."""
+
+    def __init__(self, budget_mb=512, width=None, height=None):
+        self.budget = budget_mb * 1024 * 1024
+        self.width = width
+        self.height = height
+        self.clips = collections.OrderedDict()
+        self.used = 0
+        # Bytes held by decodes in progress, counted against the budget.
+        self.reserved = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def stats(self):
+        """Return cache counters."""
+        return {'hits' : self.hits,
+                'misses' : self.misses,
+                'evictions' : self.evictions,
+                'clips' : len(self.clips),
+                'used_bytes' : self.used,
+                'reserved_bytes' : self.reserved,
+                'budget_bytes' : self.budget,
+                }
+
+    def get(self, key):
+        """Return a cached clip and mark it recently used, or None."""
+        with self.lock:
+            clip = self.clips.get(key)
+            if clip is None:
+                self.misses += 1
+                return None
+            self.clips.move_to_end(key)
+            self.hits += 1
+            return clip
+
+    def fill(self, filename, loop_in, loop_out, callback):
+        """Decode a clip region in the background.
+
+        callback is called from the main loop with the CachedClip, or None
+        when the region does not fit the budget or fails to decode.
+        """
+        key = (filename, loop_in, loop_out)
+        with self.lock:
+            if key in self.pending:
+                self.pending[key].append(callback)
+                return
+            self.pending[key] = [callback]
+        thread = threading.Thread(target=self.__decode,
+                                  args=(key,), daemon=True)
+        thread.start()
+
+    def acquire(self, clip):
+        """Protect a clip from eviction while a deck plays it."""
+        with self.lock:
+            clip.users += 1
+
+    def release(self, clip):
+        """Allow a clip to be evicted again."""
+        with self.lock:
+            clip.users -= 1
+
+    def __decode(self, key):
+        """Decode the frames of a clip region into memory."""
+        filename, loop_in, loop_out = key
+        clip = None
+        try:
+            clip = self.__decode_frames(key)
+        except GLib.Error as err:
+            logger.error("Caching %s failed: %s", filename, err.message)
+        if clip is not None:
+            self.__insert(clip)
+        with self.lock:
+            callbacks = self.pending.pop(key, [])
+        for callback in callbacks:
+            GLib.idle_add(callback, clip)
+
+    def __decode_frames(self, key):
+        """Run a decode pipeline over the region and pull every frame."""
+        filename, loop_in, loop_out = key
+        caps = "video/x-raw"
+        if self.width and self.height:
+            caps += ",width=%d,height=%d" % (self.width, self.height)
+        pipeline = Gst.parse_launch("""
+            uridecodebin uri=file://%s !
+            videoconvert !
+            videoscale !
+            %s !
+            appsink name=sink sync=false max-buffers=8
+            """ % (filename, caps))
+        sink = pipeline.get_by_name('sink')
+        frames = []
+        size = 0
+        reserved = 0
+        sample_caps = None
+        clip = None
+        try:
+            pipeline.set_state(Gst.State.PAUSED)
+            ret, state, pending = pipeline.get_state(Gst.CLOCK_TIME_NONE)
+            if ret == Gst.StateChangeReturn.FAILURE:
+                logger.error("Cannot decode %s for caching.", filename)
+                return None
+            # Nothing is evicted for a region that will not fit anyway.
+            estimate = self.__estimate(pipeline, sink, loop_in, loop_out)
+            if estimate > self.budget or not self.__reserve(estimate):
+                logger.warning("%s does not fit the frame cache "
+                               "(%.1f MB).", filename, estimate / (1 << 20))
+                return None
+            reserved = estimate
+            if loop_in is not None or loop_out is not None:
+                pipeline.seek(1.0, Gst.Format.TIME,
+                    (Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE),
+                    Gst.SeekType.SET,
+                    loop_in if loop_in is not None else 0,
+                    Gst.SeekType.SET,
+                    loop_out if loop_out is not None else -1)
+            pipeline.set_state(Gst.State.PLAYING)
+            while True:
+                sample = sink.emit('pull-sample')
+                if sample is None:
+                    break
+                buf = sample.get_buffer()
+                size += buf.get_size()
+                if size > reserved:
+                    # Larger than estimated, reserve the rest as it comes.
+                    if not self.__reserve(size - reserved):
+                        logger.warning("%s does not fit the frame cache.",
+                                       filename)
+                        return None
+                    reserved = size
+                sample_caps = sample.get_caps()
+                frames.append(buf)
+            if frames:
+                ok, num, den = sample_caps.get_structure(0).get_fraction(
+                    'framerate')
+                if not ok or num == 0:
+                    num, den = 30, 1
+                clip = CachedClip(key, sample_caps, frames,
+                                  Gst.util_uint64_scale(Gst.SECOND, den, num))
+            return clip
+        finally:
+            pipeline.set_state(Gst.State.NULL)
+            # Give back what the clip does not use; its size goes on
+            # being reserved until it is inserted.
+            with self.lock:
+                self.reserved -= reserved if clip is None else reserved - size
+
+    def __estimate(self, pipeline, sink, loop_in, loop_out):
+        """Return the bytes a region should take, from the prerolled frame.
+
+        Returns 0 when the clip's duration is unknown and the region ends
+        at the end of the clip.
+        """
+        sample = sink.emit('pull-preroll')
+        if sample is None:
+            return 0
+        stop = loop_out
+        if stop is None:
+            ok, stop = pipeline.query_duration(Gst.Format.TIME)
+            if not ok or stop <= 0:
+                return 0
+        ok, num, den = sample.get_caps().get_structure(0).get_fraction(
+            'framerate')
+        if not ok or num == 0:
+            num, den = 30, 1
+        frames = Gst.util_uint64_scale(max(0, stop - (loop_in or 0)),
+                                       num, den * Gst.SECOND)
+        return frames * sample.get_buffer().get_size()
+
+    def __evict(self, size):
+        """Evict least recently used clips until size more bytes fit.
+
+        Called with the lock held. Returns whether they fit, evicting
+        nothing when they cannot.
+        """
+        unused = sum(clip.size for clip in self.clips.values()
+                     if not clip.users)
+        if self.used - unused + self.reserved + size > self.budget:
+            return False
+        for key in list(self.clips):
+            if self.used + self.reserved + size <= self.budget:
+                break
+            old = self.clips[key]
+            if old.users:
+                continue
+            del self.clips[key]
+            self.used -= old.size
+            self.evictions += 1
+        return self.used + self.reserved + size <= self.budget
+
+    def __reserve(self, size):
+        """Count decoded bytes against the budget before keeping them."""
+        with self.lock:
+            if not self.__evict(size):
+                return False
+            self.reserved += size
+            return True
+
+    def __insert(self, clip):
+        """Add a decoded clip, turning its reserved bytes into used ones."""
+        with self.lock:
+            self.reserved -= clip.size
+            old = self.clips.pop(clip.key, None)
+            if old:
+                self.used -= old.size
+            self.clips[clip.key] = clip
+            self.used += clip.size
+        logger.info("Cached %d frames of %s (%.1f MB)", len(clip.frames),
+                    clip.key[0], clip.size / (1024 * 1024))
+
+
+class CachePlayer():
+    """Plays a CachedClip through appsrc at the deck's rate and loop mode."""
+
+    def __init__(self, deck):
+        self.deck = deck
+        self.clip = None
+        self.position = 0.0
+        self.pts = 0
+        # Rate after a bounce until the main loop turns the deck's rate.
+        self.bounced = None
+        self.pipeline = Gst.parse_launch("""
+            appsrc name=src format=time max-bytes=0 block=false !
+            intervideosink name=sink channel=%s
+            """ % deck_channel(deck.ident))
+        self.src = self.pipeline.get_by_name('src')
+        self.sink = self.pipeline.get_by_name('sink')
+        self.src.connect('need-data', self.on_need_data)
+
+    def play(self, clip, position=None):
+        """Start pushing frames of clip, from position in ns if given."""
+        self.clip = clip
+        self.pts = 0
+        self.bounced = None
+        if position is None:
+            self.position = 0.0 if self.deck.rate > 0 else len(clip.frames) - 1
+        else:
+            self.position = self.__index(position)
+        self.src.set_property('caps', clip.caps)
+        self.pipeline.set_state(Gst.State.PLAYING if self.deck.playing
+                                else Gst.State.PAUSED)
+
+    def stop(self):
+        """Stop pushing frames and return the position in ns."""
+        self.pipeline.set_state(Gst.State.NULL)
+        position = self.get_position()
+        self.clip = None
+        return position
+
+    def jump(self):
+        """Restart from the loop start in the current direction."""
+        if self.clip:
+            self.position = 0.0 if self.deck.rate > 0 else len(self.clip.frames) - 1
+
+    def get_position(self):
+        """Return the current position in ns within the clip."""
+        if not self.clip:
+            return None
+        loop_in = self.clip.key[1] or 0
+        return loop_in + int(self.position) * self.clip.duration
+
+    def __index(self, position):
+        """Map a ns position to a frame index of the clip."""
+        loop_in = self.clip.key[1] or 0
+        index = (position - loop_in) // self.clip.duration
+        return float(max(0, min(index, len(self.clip.frames) - 1)))
+
+    def on_need_data(self, src, length):
+        """Push the next frame, stepping by the deck rate."""
+        clip = self.clip
+        if clip is None:
+            return
+        last = len(clip.frames) - 1
+        index = int(self.position)
+        buf = clip.frames[index].copy_region(Gst.BufferCopyFlags.ALL, 0, -1)
+        buf.pts = self.pts
+        buf.dts = Gst.CLOCK_TIME_NONE
+        buf.duration = clip.duration
+        self.pts += clip.duration
+        src.emit('push-buffer', buf)
+        rate = self.deck.rate if self.bounced is None else self.bounced
+        self.position += rate
+        if 0 <= self.position <= last:
+            return
+        if self.deck.loop > 1:
+            # This runs in the streaming thread, the deck's rate is turned
+            # in the main loop.
+            self.bounced = -rate
+            GLib.idle_add(self.__bounce, self.bounced)
+            self.position = max(0.0, min(self.position, float(last)))
+        elif self.deck.loop:
+            self.position %= (last + 1)
+        else:
+            self.position = max(0.0, min(self.position, float(last)))
+
+    def __bounce(self, rate):
+        """Turn the deck's rate after a bounce, unless it changed since."""
+        if self.bounced == rate:
+            if self.deck.rate == -rate:
+                self.deck.rate = rate
+            self.bounced = None
+        return False
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import collections
+import logging
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds of QoS reports weighed per decision.
+WINDOW = 2.0
+
+# Share of frames dropped above which quality is stepped down, and below
+# which it may be stepped up again.
+DEGRADE_RATE = 0.05
+RESTORE_RATE = 0.01
+
+# Calm windows in a row before a step is restored, so a step that just
+# relieved the load is not undone at once.
+RESTORE_WINDOWS = 5
+
+
+class LoadGovernor():
+    """Steps quality down when sinks drop frames and back up once calm.
+
+    Every watched pipeline reports through its bus; video sinks post QoS
+    messages with their dropped frame counts. Those are only posted when
+    a frame is dropped, so the frames processed are counted on the sink
+    pads of each pipeline instead. steps is a list of (name, apply) in
+    the order quality is given up, apply(True) sheds the load of a step
+    and apply(False) restores it.
+    """
+
+    def __init__(self, steps, window=WINDOW, degrade=DEGRADE_RATE,
+                 restore=RESTORE_RATE, restore_windows=RESTORE_WINDOWS):
+        self.steps = steps
+        self.window = window
+        self.degrade = degrade
+        self.restore = restore
+        self.restore_windows = restore_windows
+        self.level = 0
+        self.calm = 0
+        # (pipeline, element name) -> last dropped count; a deck's live and
+        # standby pipelines share a name and element names.
+        self.counts = {}
+        self.counted_pads = set()
+        # pipeline name -> [processed, dropped] within this window
+        self.frames = {}
+        self.drop_rate = 0.0
+        self.decisions = collections.deque(maxlen=100)
+
+    def watch(self, name, pipeline, pads=()):
+        """Follow the QoS and latency messages of a pipeline, counting
+        the frames passing its sink pads.
+        """
+        bus = pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect('message::qos', self.on_qos, name, pipeline)
+        bus.connect('message::latency', self.on_latency, pipeline)
+        self.count(name, pads)
+
+    def count(self, name, pads):
+        """Count the frames passing sink pads as processed by name, once."""
+        for pad in pads:
+            if pad not in self.counted_pads:
+                self.counted_pads.add(pad)
+                pad.add_probe(Gst.PadProbeType.BUFFER, self.on_buffer, name)
+
+    def on_buffer(self, pad, info, name):
+        self.frames.setdefault(name, [0, 0])[0] += 1
+        return Gst.PadProbeReturn.OK
+
+    def start(self):
+        GLib.timeout_add(int(self.window * 1000), self.evaluate)
+
+    def on_qos(self, bus, message, name, pipeline):
+        fmt, processed, dropped = message.parse_qos_stats()
+        if fmt != Gst.Format.BUFFERS or processed < 0 or dropped < 0:
+            return
+        key = (pipeline, message.src.get_name())
+        last_dropped = self.counts.get(key, 0)
+        # Counts start over after a flushing seek.
+        if dropped < last_dropped:
+            last_dropped = 0
+        self.counts[key] = dropped
+        self.frames.setdefault(name, [0, 0])[1] += dropped - last_dropped
+
+    def on_latency(self, bus, message, pipeline):
+        # An element's latency changed, e.g. a deck switched decoders.
+        pipeline.recalculate_latency()
+
+    def evaluate(self):
+        """Weigh the last window's drops and step quality if needed."""
+        processed = sum(frames[0] for frames in self.frames.values())
+        dropped = sum(frames[1] for frames in self.frames.values())
+        total = processed + dropped
+        self.drop_rate = dropped / total if total else 0.0
+        worst = max(self.frames, key=lambda name: self.frames[name][1],
+                    default=None)
+        self.frames = {}
+        if self.drop_rate > self.degrade:
+            self.calm = 0
+            if self.level < len(self.steps):
+                self.__step(True, worst)
+        elif self.drop_rate < self.restore:
+            self.calm += 1
+            if self.level and self.calm >= self.restore_windows:
+                self.calm = 0
+                self.__step(False, worst)
+        else:
+            self.calm = 0
+        return True
+
+    def __step(self, degrade, worst):
+        if degrade:
+            name, apply = self.steps[self.level]
+            self.level += 1
+        else:
+            self.level -= 1
+            name, apply = self.steps[self.level]
+        apply(degrade)
+        decision = {'time' : GLib.get_monotonic_time() / 1e6,
+                    'step' : name,
+                    'degrade' : degrade,
+                    'level' : self.level,
+                    'drop_rate' : self.drop_rate,
+                    'worst' : worst,
+                    }
+        self.decisions.append(decision)
+        if degrade:
+            logger.warning("Dropping %.1f%% of frames (most in %s), "
+                           "lowering %s (level %d)", 100 * self.drop_rate,
+                           worst, name, self.level)
+        else:
+            logger.info("Dropping %.1f%% of frames, restoring %s (level %d)",
+                        100 * self.drop_rate, name, self.level)
+
+    def stats(self):
+        return {'level' : self.level,
+                'drop_rate' : self.drop_rate,
+                'decisions' : len(self.decisions),
+                }
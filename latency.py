@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+import bisect
+import logging
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bucket bounds in ms, the last bucket takes everything slower.
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Events slower than this end to end are logged with their stages.
+SLOW_MS = 100
+
+# Events that restart the deck's stream with the control applied.
+RESTART_EVENTS = tuple(getattr(Gst.EventType, name)
+                       for name in ('SEGMENT', 'INSTANT_RATE_CHANGE')
+                       if hasattr(Gst.EventType, name))
+
+
+class Histogram():
+    """Counts of latencies in fixed ms buckets."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(BUCKETS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def to_dict(self):
+        buckets = {'le_%d' % bound : count
+                   for bound, count in zip(BUCKETS, self.counts)}
+        buckets['inf'] = self.counts[-1]
+        return {'count' : self.count,
+                'mean_ms' : self.total / self.count if self.count else 0.0,
+                'max_ms' : self.max,
+                'buckets' : buckets,
+                }
+
+
+class TraceEvent():
+    """One control change followed from receipt to the screen."""
+
+    def __init__(self, kind, deck, received, dispatched, applied):
+        self.kind = kind
+        self.deck = deck
+        self.stages = [('received', received), ('dispatched', dispatched),
+                       ('applied', applied)]
+        self.restarted = False
+
+    def mark(self, stage, when):
+        self.stages.append((stage, when))
+
+    def describe(self):
+        """Return the time spent reaching each stage in ms."""
+        return ", ".join("%s +%.1fms" % (stage, (when - before) * 1000)
+                         for (_, before), (stage, when)
+                         in zip(self.stages, self.stages[1:]))
+
+
+class LatencyTracer():
+    """Control-to-photon latency per control type and per deck.
+
+    A control event starts when OSC receives it, or when its GTK handler
+    runs for local input. It reaches the deck with the first buffer at
+    the deck's sink after the change took effect, and the screen with the
+    next buffer at the output sink. Only the latest event per control and
+    deck is followed, and nothing is probed while tracing is off.
+    """
+
+    def __init__(self, enabled=False, slow_ms=SLOW_MS):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.origin = None
+        self.pending = {}
+        self.waiting = []
+        self.lock = threading.Lock()
+        self.kinds = {}
+        self.decks = {}
+        self.superseded = 0
+        self.slow = 0
+
+    def attach_output(self, pad):
+        """Watch the output sink pad for the frames events end on."""
+        if self.enabled:
+            pad.add_probe(Gst.PadProbeType.BUFFER, self.__on_output_buffer)
+
+    def begin(self, received):
+        """Mark the handlers run until end() as caused by an OSC message."""
+        self.origin = (received, time.perf_counter())
+
+    def end(self):
+        self.origin = None
+
+    def applied(self, kind, deck=None, pad=None, restart=False):
+        """Start following a control change that has just been applied.
+
+        pad is the deck's sink pad, None for mix controls which only
+        wait for the output. With restart the deck stage waits for the
+        new segment or rate the change causes.
+        """
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        received, dispatched = self.origin or (now, now)
+        event = TraceEvent(kind, deck, received, dispatched, now)
+        with self.lock:
+            if self.pending.pop((kind, deck), None) is not None:
+                self.superseded += 1
+            self.pending[(kind, deck)] = event
+            if pad is None:
+                self.waiting.append(event)
+                return
+        event.restarted = not restart
+        pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM,
+                      self.__on_deck_buffer, event)
+
+    def __on_deck_buffer(self, pad, info, event):
+        """Mark the first deck frame produced with the change."""
+        if info.type & Gst.PadProbeType.EVENT_DOWNSTREAM:
+            if info.get_event().type in RESTART_EVENTS:
+                event.restarted = True
+            return Gst.PadProbeReturn.OK
+        if not event.restarted:
+            return Gst.PadProbeReturn.OK
+        with self.lock:
+            if self.pending.get((event.kind, event.deck)) is event:
+                event.mark('deck', time.perf_counter())
+                self.waiting.append(event)
+        return Gst.PadProbeReturn.REMOVE
+
+    def __on_output_buffer(self, pad, info):
+        """Complete every event waiting for the next output frame."""
+        if not self.waiting:
+            return Gst.PadProbeReturn.OK
+        now = time.perf_counter()
+        with self.lock:
+            done, self.waiting = self.waiting, []
+            for event in done:
+                if self.pending.get((event.kind, event.deck)) is event:
+                    del self.pending[(event.kind, event.deck)]
+                    event.mark('output', now)
+                    self.__record(event)
+        return Gst.PadProbeReturn.OK
+
+    def __record(self, event):
+        """Add a completed event to the histograms."""
+        ms = (event.stages[-1][1] - event.stages[0][1]) * 1000
+        self.kinds.setdefault(event.kind, Histogram()).add(ms)
+        deck = 'mix' if event.deck is None else 'deck%d' % event.deck
+        self.decks.setdefault(deck, Histogram()).add(ms)
+        if ms > self.slow_ms:
+            self.slow += 1
+            logger.warning("Slow %s on %s: %.1fms (%s)", event.kind, deck,
+                           ms, event.describe())
+
+    def start_reports(self, seconds=60):
+        """Log the per-type histograms every seconds while tracing."""
+        if self.enabled:
+            GLib.timeout_add_seconds(seconds, self.__report)
+
+    def __report(self):
+        for kind, hist in self.stats()['kinds'].items():
+            logger.info("Latency %s: %d events, mean %.1fms, max %.1fms",
+                        kind, hist['count'], hist['mean_ms'], hist['max_ms'])
+        return True
+
+    def stats(self):
+        """Return latency histograms per control type and per deck."""
+        with self.lock:
+            return {'kinds' : {kind : hist.to_dict()
+                               for kind, hist in self.kinds.items()},
+                    'decks' : {deck : hist.to_dict()
+                               for deck, hist in self.decks.items()},
+                    'pending' : len(self.pending),
+                    'superseded' : self.superseded,
+                    'slow' : self.slow,
+                    }
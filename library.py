@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+import bisect
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import os
+import threading
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstPbutils', '1.0')
+from gi.repository import GLib, Gst, GstPbutils
+
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = '.pyvj_library.json'
+KEYFRAME_DIR = '.pyvj_keyframes'
+INDEX_VERSION = 1
+
+# Discoverer timeout per file in ns.
+DISCOVER_TIMEOUT = 10 * Gst.SECOND
+
+# Results discovered between saves of the index.
+SAVE_EVERY = 100
+
+_local = threading.local()
+
+
+def discover(path):
+    """Return the metadata of one media file."""
+    if not hasattr(_local, 'discoverer'):
+        _local.discoverer = GstPbutils.Discoverer.new(DISCOVER_TIMEOUT)
+    info = _local.discoverer.discover_uri(Gst.filename_to_uri(path))
+    streams = info.get_video_streams()
+    if not streams:
+        return {'error' : 'no video stream'}
+    video = streams[0]
+    caps = video.get_caps()
+    return {'duration' : info.get_duration(),
+            'seekable' : info.get_seekable(),
+            'width' : video.get_width(),
+            'height' : video.get_height(),
+            'framerate' : [video.get_framerate_num(),
+                           video.get_framerate_denom()],
+            'codec' : GstPbutils.pb_utils_get_codec_description(caps),
+            'caps' : caps.to_string(),
+            }
+
+
+def scan_keyframes(path):
+    """Return the timestamps of the video keyframes of a file.
+
+    The file is only demuxed and parsed, nothing is decoded.
+    """
+    pipeline = Gst.Pipeline()
+    src = Gst.ElementFactory.make('filesrc')
+    src.set_property('location', path)
+    parse = Gst.ElementFactory.make('parsebin')
+    pipeline.add(src)
+    pipeline.add(parse)
+    src.link(parse)
+    keyframes = []
+
+    def on_buffer(pad, info):
+        buf = info.get_buffer()
+        if not buf.has_flags(Gst.BufferFlags.DELTA_UNIT):
+            keyframes.append(buf.pts)
+        return Gst.PadProbeReturn.OK
+
+    def on_pad_added(element, pad):
+        sink = Gst.ElementFactory.make('fakesink')
+        sink.set_property('sync', False)
+        pipeline.add(sink)
+        sink.sync_state_with_parent()
+        pad.link(sink.get_static_pad('sink'))
+        caps = pad.get_current_caps() or pad.query_caps(None)
+        if caps.get_structure(0).get_name().startswith('video/'):
+            pad.add_probe(Gst.PadProbeType.BUFFER, on_buffer)
+
+    parse.connect('pad-added', on_pad_added)
+    pipeline.set_state(Gst.State.PLAYING)
+    msg = pipeline.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE,
+        Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+    if msg and msg.type == Gst.MessageType.ERROR:
+        err, debug = msg.parse_error()
+        raise GLib.Error(err.message)
+    return sorted(ts for ts in keyframes if ts != Gst.CLOCK_TIME_NONE)
+
+
+def _init_worker():
+    """Initialize GStreamer in a keyframe indexing process."""
+    Gst.init(None)
+
+
+def _index_keyframes(path):
+    """Keyframe scan run in a worker process, errors returned as text."""
+    try:
+        return scan_keyframes(path)
+    except GLib.Error as err:
+        return err.message
+
+
+def snap(keyframes, position):
+    """Return the keyframe timestamp nearest to position."""
+    if not keyframes or position is None or position < 0:
+        return position
+    i = bisect.bisect_left(keyframes, position)
+    if i == 0:
+        return keyframes[0]
+    if i == len(keyframes):
+        return keyframes[-1]
+    before, after = keyframes[i - 1], keyframes[i]
+    return before if position - before <= after - position else after
+
+
+class MediaLibrary():
+    """Per-file metadata of a clip directory, persisted between runs."""
+
+    def __init__(self, path, workers=None):
+        self.path = path
+        self.index_path = os.path.join(path, INDEX_FILE)
+        self.keyframe_path = os.path.join(path, KEYFRAME_DIR)
+        self.workers = workers or os.cpu_count()
+        self.entries = {}
+        self.keyframe_cache = {}
+        self.lock = threading.Lock()
+        self.scanning = False
+        self.load()
+
+    def load(self):
+        """Read the index from disk."""
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        if index.get('version') == INDEX_VERSION:
+            self.entries = index['files']
+
+    def save(self):
+        """Write the index to disk atomically."""
+        with self.lock:
+            index = {'version' : INDEX_VERSION, 'files' : dict(self.entries)}
+        tmp = self.index_path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp, self.index_path)
+        except OSError as err:
+            logger.error("Cannot save library index: %s", err)
+
+    def files(self):
+        """Return the media file names in the directory with their stat."""
+        found = {}
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                found[entry.name] = (stat.st_mtime, stat.st_size)
+        return found
+
+    def stale(self):
+        """Sync the index with the directory, return names to discover."""
+        found = self.files()
+        stale = []
+        with self.lock:
+            for name in list(self.entries):
+                if name not in found:
+                    del self.entries[name]
+            for name, (mtime, size) in found.items():
+                entry = self.entries.get(name)
+                if (entry is None or entry['mtime'] != mtime
+                        or entry['size'] != size
+                        or not ('keyframes' in entry or 'error' in entry)):
+                    self.entries[name] = {'mtime' : mtime, 'size' : size}
+                    stale.append(name)
+        return stale
+
+    def cues(self):
+        """Return the sorted playable file names, pending ones included."""
+        with self.lock:
+            return sorted(name for name, entry in self.entries.items()
+                          if 'error' not in entry)
+
+    def get(self, name):
+        """Return the metadata of a file."""
+        with self.lock:
+            return dict(self.entries.get(name, {}))
+
+    def ensure(self, name):
+        """Discover a file now unless the index already describes it."""
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None or 'duration' in entry or 'error' in entry:
+                return dict(entry or {})
+        try:
+            meta = discover(os.path.join(self.path, name))
+        except GLib.Error as err:
+            meta = {'error' : err.message}
+        with self.lock:
+            if name in self.entries:
+                self.entries[name].update(meta)
+            return dict(self.entries.get(name, {}))
+
+    def keyframes(self, name):
+        """Return the sorted keyframe timestamps of a file, or None."""
+        name = os.path.basename(name)
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None or not entry.get('keyframes'):
+                return None
+            cached = self.keyframe_cache.get(name)
+            if cached and cached[0] == entry['mtime']:
+                return cached[1]
+        try:
+            with open(os.path.join(self.keyframe_path, name + '.json')) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if stored.get('mtime') != entry['mtime']:
+            return None
+        with self.lock:
+            self.keyframe_cache[name] = (entry['mtime'], stored['keyframes'])
+        return stored['keyframes']
+
+    def __save_keyframes(self, name, keyframes):
+        """Store the keyframe index of a file next to the library."""
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                return
+            entry['keyframes'] = len(keyframes)
+            mtime = entry['mtime']
+            self.keyframe_cache[name] = (mtime, keyframes)
+        try:
+            os.makedirs(self.keyframe_path, exist_ok=True)
+            with open(os.path.join(self.keyframe_path, name + '.json'), 'w') as f:
+                json.dump({'mtime' : mtime, 'keyframes' : keyframes}, f)
+        except OSError as err:
+            logger.error("Cannot save keyframes of %s: %s", name, err)
+
+    def scan(self, callback=None):
+        """Discover new and changed files in a background worker pool.
+
+        callback is called from the main loop once the scan is done and
+        the index has changed.
+        """
+        stale = self.stale()
+        if not stale or self.scanning:
+            return
+        self.scanning = True
+        thread = threading.Thread(target=self.__scan, args=(stale, callback),
+                                  daemon=True)
+        thread.start()
+
+    def __scan(self, names, callback):
+        """Run discovery over names and store the results."""
+        try:
+            logger.info("Discovering %d files in %s", len(names), self.path)
+            with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+                jobs = {pool.submit(discover,
+                                    os.path.join(self.path, name)) : name
+                        for name in names}
+                for done, job in enumerate(
+                        concurrent.futures.as_completed(jobs), 1):
+                    name = jobs[job]
+                    try:
+                        meta = job.result()
+                    except GLib.Error as err:
+                        meta = {'error' : err.message}
+                    if 'error' in meta:
+                        logger.warning("Skipping %s: %s", name, meta['error'])
+                    with self.lock:
+                        if name in self.entries:
+                            self.entries[name].update(meta)
+                    if done % SAVE_EVERY == 0:
+                        self.save()
+            self.save()
+            self.__index(names)
+            self.save()
+        finally:
+            # A failed scan must not keep later scans from starting.
+            self.scanning = False
+        if callback:
+            GLib.idle_add(callback)
+
+    def __index(self, names):
+        """Build keyframe indexes in a process pool, off the GIL."""
+        with self.lock:
+            names = [name for name in names
+                     if 'error' not in self.entries.get(name, {'error' : 1})]
+        if not names:
+            return
+        logger.info("Indexing keyframes of %d files", len(names))
+        context = multiprocessing.get_context('spawn')
+        with concurrent.futures.ProcessPoolExecutor(
+                self.workers, mp_context=context,
+                initializer=_init_worker) as pool:
+            jobs = {pool.submit(_index_keyframes,
+                                os.path.join(self.path, name)) : name
+                    for name in names}
+            for job in concurrent.futures.as_completed(jobs):
+                name = jobs[job]
+                keyframes = job.result()
+                if isinstance(keyframes, str):
+                    logger.warning("No keyframe index for %s: %s",
+                                   name, keyframes)
+                    # Not retried until the file changes.
+                    with self.lock:
+                        if name in self.entries:
+                            self.entries[name]['keyframes'] = None
+                    continue
+                self.__save_keyframes(name, keyframes)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+import bisect
+import collections
+import logging
+import os
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+
+logger = logging.getLogger(__name__)
+
+# Upcoming cues warmed per deck.
+LOOKAHEAD = 3
+
+# Bytes of upcoming clips kept warm in the page cache, in MB.
+WARM_BUDGET_MB = 256
+
+# Container headers are read from both ends, indexes may sit at the end.
+HEADER_BYTES = 1 << 20
+
+# GOP span assumed for clips without a keyframe index.
+DEFAULT_GOP_NS = 2 * Gst.SECOND
+
+# Seconds a decoder preroll may take before it is given up.
+PREROLL_TIMEOUT = 5
+
+
+def readahead(path, ranges):
+    """Ask the kernel to read byte ranges of a file into the page cache.
+
+    Reads the ranges where fadvise is missing. Returns the bytes asked for.
+    """
+    total = 0
+    with open(path, 'rb') as f:
+        fd = f.fileno()
+        for offset, length in ranges:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+            else:
+                f.seek(offset)
+                f.read(length)
+            total += length
+    return total
+
+
+def preroll(path):
+    """Preroll a clip into a throwaway pipeline, so its demuxer, decoder
+    and plugins are loaded once before the deck needs them.
+    """
+    pipeline = Gst.parse_launch("playbin uri=%s video-sink=fakesink "
+                                "audio-sink=fakesink"
+                                % Gst.filename_to_uri(path))
+    pipeline.set_state(Gst.State.PAUSED)
+    result, state, pending = pipeline.get_state(PREROLL_TIMEOUT * Gst.SECOND)
+    pipeline.set_state(Gst.State.NULL)
+    return result != Gst.StateChangeReturn.FAILURE
+
+
+class Lookahead():
+    """Warms the clips expected to be cued next in a background thread.
+
+    Each clip's headers and the GOP at its loop start are read ahead into
+    the page cache and its metadata discovered, and optionally a decoder
+    is prerolled on it, while the warmed bytes stay within the budget.
+    Cue start times are kept apart for warm and cold clips.
+    """
+
+    def __init__(self, library, depth=LOOKAHEAD, budget_mb=WARM_BUDGET_MB,
+                 prerolled=False):
+        self.library = library
+        self.depth = depth
+        self.budget = budget_mb << 20
+        self.prerolled = prerolled
+        self.lock = threading.Lock()
+        self.wanted = []
+        self.changed = threading.Event()
+        self.thread = None
+        # path -> bytes read ahead, for clips still wanted.
+        self.warm = collections.OrderedDict()
+        self.start_times = {'warm' : collections.deque(maxlen=100),
+                            'cold' : collections.deque(maxlen=100)}
+
+    def plan(self, clips):
+        """Warm clips, a list of (path, loop start in ns) nearest first."""
+        with self.lock:
+            self.wanted = list(clips)
+        self.changed.set()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.__run, name='lookahead',
+                                           daemon=True)
+            self.thread.start()
+
+    def is_warm(self, path):
+        with self.lock:
+            return path in self.warm
+
+    def started(self, path, seconds, warm):
+        """Record how long a cue took to show its first frame."""
+        kind = 'warm' if warm else 'cold'
+        self.start_times[kind].append(seconds)
+        logger.info("%s cue start of %s took %.1fms", kind.capitalize(),
+                    os.path.basename(path), seconds * 1000)
+
+    def stats(self):
+        """Return the count and mean of warm and cold cue start times."""
+        stats = {}
+        for kind, times in self.start_times.items():
+            stats[kind] = {'count' : len(times),
+                           'mean_ms' : (1000 * sum(times) / len(times)
+                                        if times else None)}
+        with self.lock:
+            stats['warm_mb'] = sum(self.warm.values()) / (1 << 20)
+        return stats
+
+    def ranges(self, path, start):
+        """Return the byte ranges to read ahead for a clip starting at start."""
+        size = os.path.getsize(path)
+        name = os.path.basename(path)
+        duration = self.library.ensure(name).get('duration')
+        ranges = [(0, min(HEADER_BYTES, size)),
+                  (max(0, size - HEADER_BYTES), min(HEADER_BYTES, size))]
+        if not duration:
+            return ranges
+        start = start or 0
+        span = DEFAULT_GOP_NS
+        keyframes = self.library.keyframes(name)
+        if keyframes:
+            i = max(0, bisect.bisect_right(keyframes, start) - 1)
+            start = keyframes[i]
+            if i + 1 < len(keyframes):
+                span = keyframes[i + 1] - start
+        # Bytes are assumed spread evenly over the clip's duration.
+        offset = size * start // duration
+        ranges.append((offset, max(1, size * span // duration)))
+        return ranges
+
+    def __run(self):
+        while True:
+            self.changed.wait()
+            self.changed.clear()
+            with self.lock:
+                wanted = list(self.wanted)
+                paths = set(path for path, start in wanted)
+                for path in list(self.warm):
+                    if path not in paths:
+                        del self.warm[path]
+                used = sum(self.warm.values())
+            for path, start in wanted:
+                if self.changed.is_set():
+                    break
+                if self.is_warm(path):
+                    continue
+                began = time.perf_counter()
+                try:
+                    ranges = self.ranges(path, start)
+                    length = sum(length for offset, length in ranges)
+                    if used + length > self.budget:
+                        logger.debug("Lookahead budget reached at %s", path)
+                        break
+                    readahead(path, ranges)
+                    if self.prerolled:
+                        preroll(path)
+                except OSError as err:
+                    logger.warning("Cannot warm %s: %s", path, err)
+                    continue
+                used += length
+                with self.lock:
+                    self.warm[path] = length
+                logger.debug("Warmed %s (%.1fMB) in %.1fms",
+                             os.path.basename(path), length / (1 << 20),
+                             (time.perf_counter() - began) * 1000)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+import collections
+import http.server
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+from pythonosc import udp_client
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds between samples.
+SAMPLE_INTERVAL = 1.0
+
+# Samples kept in memory and served as history.
+HISTORY = 600
+
+# The sample log rotates through this many files of this size.
+LOG_BYTES = 4 << 20
+LOG_FILES = 4
+
+
+def flatten(sample, prefix=''):
+    """Return the numbers of a nested sample keyed by dotted paths."""
+    flat = {}
+    for key, value in sample.items():
+        name = '%s%s' % (prefix, key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def queue_fill(pipeline):
+    """Return the fullest queue of a pipeline as a percentage."""
+    fill = 0.0
+    for element in pipeline.iterate_recurse():
+        if not element.find_property('current-level-buffers'):
+            continue
+        limit = element.get_property('max-size-buffers')
+        if limit:
+            level = element.get_property('current-level-buffers') / limit
+        else:
+            limit = element.get_property('max-size-time')
+            level = (element.get_property('current-level-time') / limit
+                     if limit else 0.0)
+        fill = max(fill, level * 100)
+    return fill
+
+
+class FrameCounter():
+    """Counts the buffers passing a pad."""
+
+    def __init__(self, pad):
+        self.count = 0
+        pad.add_probe(Gst.PadProbeType.BUFFER, self.on_buffer)
+
+    def on_buffer(self, pad, info):
+        self.count += 1
+        return Gst.PadProbeReturn.OK
+
+
+class Metrics():
+    """Samples counters from the pipelines and control path periodically.
+
+    Sources are callables returning a dict, called in the main loop once
+    per interval. The latest samples are kept in memory for the status
+    server and the overlay, and each is appended to a rotating log so a
+    show can be looked into afterwards.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, history=HISTORY,
+                 log_path=None):
+        self.interval = interval
+        self.sources = collections.OrderedDict()
+        self.samples = collections.deque(maxlen=history)
+        # Copy of samples for the server thread, replaced on every sample.
+        self.history = []
+        self.latest = {}
+        self.listeners = []
+        # name -> (time, count) of counters turned into rates.
+        self.counts = {}
+        self.cost = 0.0
+        self.server = None
+        self.log = None
+        if log_path:
+            try:
+                os.makedirs(os.path.dirname(log_path), exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    log_path, maxBytes=LOG_BYTES, backupCount=LOG_FILES)
+            except OSError as err:
+                logger.error("Cannot log metrics to %s: %s", log_path, err)
+            else:
+                self.log = logging.getLogger('pyvj.metrics')
+                self.log.propagate = False
+                self.log.setLevel(logging.INFO)
+                self.log.addHandler(handler)
+
+    def add(self, name, source):
+        """Sample source() under name."""
+        self.sources[name] = source
+
+    def listen(self, callback):
+        """Call callback(sample) after every sample."""
+        self.listeners.append(callback)
+
+    def rate(self, name, count):
+        """Return the per-second change of a counter since last sampled."""
+        now = time.monotonic()
+        then, before = self.counts.get(name, (now, count))
+        self.counts[name] = (now, count)
+        if now == then:
+            return 0.0
+        return (count - before) / (now - then)
+
+    def start(self):
+        GLib.timeout_add(int(self.interval * 1000), self.sample)
+
+    def sample(self):
+        """Take one sample of every source."""
+        start = time.perf_counter()
+        sample = {'time' : time.time(), 'sample_ms' : self.cost * 1000}
+        for name, source in self.sources.items():
+            try:
+                sample[name] = source()
+            except Exception as err:
+                # A failing source must not stop the others being sampled.
+                logger.debug("Metrics source %s failed: %s", name, err)
+        self.latest = sample
+        self.samples.append(sample)
+        self.history = list(self.samples)
+        if self.log:
+            self.log.info(json.dumps(sample, default=str))
+        for callback in self.listeners:
+            callback(sample)
+        self.cost = time.perf_counter() - start
+        return True
+
+    def serve(self, host, port):
+        """Serve the latest sample as JSON over HTTP, on its own thread.
+
+        GET /metrics returns the latest sample, /history all kept ones.
+        """
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path in ('/', '/metrics'):
+                    body = metrics.latest
+                elif self.path == '/history':
+                    body = metrics.history
+                else:
+                    self.send_error(404)
+                    return
+                data = json.dumps(body, default=str).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        try:
+            self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        except OSError as err:
+            logger.error("Cannot serve metrics on %s:%d: %s", host, port, err)
+            return
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='metrics',
+                         daemon=True).start()
+        logger.info("Serving metrics on http://%s:%d/metrics", host, port)
+
+    def shutdown(self):
+        if self.server:
+            self.server.shutdown()
+            self.server = None
+
+
+class OscPublisher():
+    """Sends every number of each sample as an OSC message.
+
+    A sample's 'deck0.fps' is sent as /pyvj/metrics/deck0/fps.
+    """
+
+    def __init__(self, host, port, prefix='/pyvj/metrics'):
+        self.client = udp_client.SimpleUDPClient(host, port)
+        self.prefix = prefix
+
+    def __call__(self, sample):
+        for name, value in flatten(sample).items():
+            try:
+                self.client.send_message('%s/%s' % (self.prefix,
+                                                    name.replace('.', '/')),
+                                         value)
+            except OSError as err:
+                logger.debug("Cannot send metrics: %s", err)
+                return
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+import logging
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_WIDTH = 800
+OUTPUT_HEIGHT = 600
+
+# Range of the colour sliders, as in the ColorBalance interface.
+COLOR_RANGE = 1000
+
+# videobalance property and its range for each colour channel.
+COLOR_CHANNELS = {
+    'HUE' : ('hue', -1.0, 1.0),
+    'SATURATION' : ('saturation', 0.0, 2.0),
+    'CONTRAST' : ('contrast', 0.0, 2.0),
+    'BRIGHTNESS' : ('brightness', -1.0, 1.0),
+    }
+
+
+def deck_channel(ident):
+    """Return the intervideo channel name of a deck."""
+    return 'deck%d' % ident
+
+
+def color_property(channel, value):
+    """Return the videobalance property and value for a channel value."""
+    prop, low, high = COLOR_CHANNELS[channel]
+    value = max(-COLOR_RANGE, min(value, COLOR_RANGE))
+    return prop, low + (value + COLOR_RANGE) * (high - low) / (2 * COLOR_RANGE)
+
+
+class Mixer():
+    """Composites every deck in one compositor into the program output.
+
+    Each deck pad is scaled by the compositor straight to its layout
+    rectangle, so a deck frame is scaled once on its way to the mix. Deck
+    colour balance is applied here too, so it outlives cue switches.
+    """
+
+    def __init__(self, decks, width=OUTPUT_WIDTH, height=OUTPUT_HEIGHT):
+        self.decks = decks
+        self.width = width
+        self.height = height
+        self.pipeline = None
+        self.pads = []
+        self.balances = []
+        # Per-deck (xpos, ypos, width, height) and z-order.
+        self.layouts = [(0, 0, width, height) for i in range(decks)]
+        self.zorders = list(range(decks))
+        self.alphas = [1.0 for i in range(decks)]
+        self.colors = [{} for i in range(decks)]
+        # Fraction of the output size the compositor works at.
+        self.scale = 1.0
+        # Automation whose ramps give way to values set directly.
+        self.automation = None
+
+    def scaled(self, *values):
+        return [int(value * self.scale) for value in values]
+
+    def describe_compositor(self):
+        """Return the launch description of the compositor element."""
+        pads = []
+        for i in range(self.decks):
+            x, y, w, h = self.scaled(*self.layouts[i])
+            pads.append("sink_%d::alpha=%f sink_%d::zorder=%d "
+                        "sink_%d::xpos=%d sink_%d::ypos=%d "
+                        "sink_%d::width=%d sink_%d::height=%d"
+                        % (i, self.alphas[i], i, self.zorders[i],
+                           i, x, i, y, i, w, i, h))
+        return ("compositor name=mix background=black %s ! "
+                "capsfilter name=mix_caps caps=video/x-raw,width=%d,height=%d"
+                % ((" ".join(pads),) + tuple(self.scaled(self.width,
+                                                         self.height))))
+
+    def describe_sources(self, source="intervideosrc channel=%(channel)s"):
+        """Return the launch description feeding every deck into the mix.
+
+        source is formatted with the deck's ident and channel, or is a
+        list holding each deck's own description.
+        """
+        if not isinstance(source, list):
+            source = [source % {'ident' : i, 'channel' : deck_channel(i)}
+                      for i in range(self.decks)]
+        return "\n".join("%s ! videobalance name=balance_%d ! queue ! mix.sink_%d"
+                         % (source[i], i, i)
+                         for i in range(self.decks))
+
+    def describe_program(self, output, monitor):
+        """Return a tee fanning the mix out to the output and its monitor.
+
+        Both branches share the composited buffer. The monitor branch is
+        meant for describe_preview_tap, which drops to the preview rate
+        before the monitor strip scales the mix down in its compositor.
+        """
+        return ("tee name=program\n"
+                "program. ! queue ! %s\n"
+                "program. ! queue leaky=downstream max-size-buffers=1 ! %s"
+                % (output, monitor))
+
+    def describe(self, sink, source="intervideosrc channel=%(channel)s"):
+        """Return the launch description of the output pipeline."""
+        return "%s ! %s\n%s" % (self.describe_compositor(), sink,
+                                self.describe_sources(source))
+
+    def build(self, sink, source="intervideosrc channel=%(channel)s"):
+        """Create the output pipeline ending in sink and cache the pads."""
+        self.pipeline = Gst.parse_launch(self.describe(sink, source))
+        mix = self.pipeline.get_by_name('mix')
+        self.pads = [mix.get_static_pad('sink_%d' % i)
+                     for i in range(self.decks)]
+        self.balances = [self.pipeline.get_by_name('balance_%d' % i)
+                         for i in range(self.decks)]
+        for deck, colors in enumerate(self.colors):
+            for channel, value in colors.items():
+                self.set_color(deck, channel, value)
+        return self.pipeline
+
+    def set_alpha(self, deck, alpha):
+        """Set the opacity of a deck in the mix."""
+        self.alphas[deck] = alpha
+        if self.pads:
+            if self.automation:
+                self.automation.cancel(self.pads[deck], 'alpha')
+            self.pads[deck].set_property('alpha', alpha)
+
+    def set_color(self, deck, channel, value):
+        """Set a colour channel of a deck, value from -1000 to 1000."""
+        self.colors[deck][channel] = value
+        if self.balances:
+            prop, target = color_property(channel, value)
+            if self.automation:
+                self.automation.cancel(self.balances[deck], prop)
+            self.balances[deck].set_property(prop, target)
+
+    def set_layout(self, deck, xpos, ypos, width, height):
+        """Place and scale a deck within the output frame."""
+        self.layouts[deck] = (xpos, ypos, width, height)
+        if self.pads:
+            pad = self.pads[deck]
+            xpos, ypos, width, height = self.scaled(xpos, ypos, width, height)
+            pad.set_property('xpos', xpos)
+            pad.set_property('ypos', ypos)
+            pad.set_property('width', width)
+            pad.set_property('height', height)
+
+    def set_scale(self, scale):
+        """Composite at a fraction of the output size while running.
+
+        The output sink scales the smaller mix back up to its window.
+        """
+        self.scale = scale
+        if self.pipeline:
+            self.pipeline.get_by_name('mix_caps').set_property(
+                'caps', Gst.Caps.from_string("video/x-raw,width=%d,height=%d"
+                    % tuple(self.scaled(self.width, self.height))))
+            for deck, layout in enumerate(self.layouts):
+                self.set_layout(deck, *layout)
+
+    def set_zorder(self, deck, zorder):
+        """Set the stacking order of a deck, higher is on top."""
+        self.zorders[deck] = zorder
+        if self.pads:
+            self.pads[deck].set_property('zorder', zorder)
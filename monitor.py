@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import logging
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from cputime import CpuMeter
+from mixer import deck_channel
+
+
+logger = logging.getLogger(__name__)
+
+THUMB_WIDTH = 240
+THUMB_HEIGHT = 180
+
+# Channel the output pipeline sends its low-rate mix thumbnail on.
+PREVIEW_CHANNEL = 'mix_preview'
+
+# Every element here is named with this prefix so that its streaming
+# threads can be told apart from deck and output threads.
+PREFIX = 'mon_'
+
+
+def describe_preview_tap(fps):
+    """Return the output branch feeding the mix into the monitor strip."""
+    return ("valve name=preview_valve ! "
+            "videorate name=preview_rate drop-only=true max-rate=%d ! "
+            "intervideosink channel=%s" % (fps, PREVIEW_CHANNEL))
+
+
+class Monitor():
+    """All deck and mix previews composited into one low-rate strip."""
+
+    def __init__(self, decks, fps=10):
+        self.decks = decks
+        self.fps = fps
+        self.width = THUMB_WIDTH * (decks + 1)
+        self.height = THUMB_HEIGHT
+        self.pipeline = None
+        self.output = None
+        self.cpu = CpuMeter(PREFIX)
+
+    def slot(self, source):
+        """Return the strip position of a source: deck 0, mix, decks 1+."""
+        if source == 'mix':
+            return 1
+        return 0 if source == 0 else source + 1
+
+    def describe(self, sink="xvimagesink name=monitor sync=false"):
+        """Return the launch description of the monitor strip."""
+        sources = list(range(self.decks)) + ['mix']
+        pads = []
+        branches = []
+        for i, source in enumerate(sources):
+            channel = PREVIEW_CHANNEL if source == 'mix' else deck_channel(source)
+            pads.append("sink_%d::xpos=%d sink_%d::width=%d sink_%d::height=%d"
+                        % (i, self.slot(source) * THUMB_WIDTH,
+                           i, THUMB_WIDTH, i, THUMB_HEIGHT))
+            branches.append("intervideosrc name=%ssrc_%d channel=%s ! "
+                            "videorate name=%srate_%d drop-only=true max-rate=%d ! "
+                            "queue name=%sq_%d leaky=downstream max-size-buffers=1 ! "
+                            "%sstrip.sink_%d"
+                            % (PREFIX, i, channel, PREFIX, i, self.fps,
+                               PREFIX, i, PREFIX, i))
+        return ("compositor name=%sstrip background=black %s ! "
+                "capsfilter name=%scaps "
+                "caps=video/x-raw,width=%d,height=%d,framerate=%d/1 ! "
+                "%s\n%s"
+                % (PREFIX, " ".join(pads), PREFIX, self.width, self.height,
+                   self.fps, sink, "\n".join(branches)))
+
+    def build(self, output, sink="xvimagesink name=monitor sync=false"):
+        """Create the strip pipeline; output holds the mix preview valve."""
+        self.output = output
+        self.pipeline = Gst.parse_launch(self.describe(sink))
+        return self.pipeline
+
+    def set_active(self, active):
+        """Run or stop every preview, e.g. when the window is hidden."""
+        self.pipeline.set_state(Gst.State.PLAYING if active
+                                else Gst.State.PAUSED)
+        valve = self.output.get_by_name('preview_valve')
+        if valve:
+            valve.set_property('drop', not active)
+        logger.info("Previews %s", "on" if active else "off")
+
+    def set_fps(self, fps):
+        """Change the preview frame rate while running."""
+        self.fps = fps
+        for i in range(self.decks + 1):
+            self.pipeline.get_by_name('%srate_%d' % (PREFIX, i)).set_property(
+                'max-rate', fps)
+        self.pipeline.get_by_name('%scaps' % PREFIX).set_property(
+            'caps', Gst.Caps.from_string(
+                "video/x-raw,width=%d,height=%d,framerate=%d/1"
+                % (self.width, self.height, fps)))
+        rate = self.output.get_by_name('preview_rate')
+        if rate:
+            rate.set_property('max-rate', fps)
+
+    def cpu_percent(self):
+        """Return the CPU % used by the strip since the previous call."""
+        return self.cpu.percent()
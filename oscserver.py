@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import asyncio
+import logging
+import threading
+import time
+
+from gi.repository import GLib
+from pythonosc import osc_packet
+
+
+logger = logging.getLogger(__name__)
+
+# Batches handed to the main loop per second at most.
+FLUSH_HZ = 60
+
+
+class _Protocol(asyncio.DatagramProtocol):
+
+    def __init__(self, receiver):
+        self.receiver = receiver
+
+    def datagram_received(self, data, addr):
+        self.receiver.receive(data)
+
+
+class OscReceiver():
+    """Receives OSC on one asyncio thread and dispatches in the main loop.
+
+    Continuous controls keep only their latest value per address until the
+    next batch; discrete controls are queued so every press is delivered
+    exactly once. Each batch is handed over in a single idle callback.
+    """
+
+    def __init__(self, ipaddr, port, flush_hz=FLUSH_HZ, tracer=None):
+        self.address = (ipaddr, port)
+        # Optional LatencyTracer told when each dispatched message arrived.
+        self.tracer = tracer
+        self.interval = 1.0 / flush_hz
+        self.handlers = {}
+        self.latest = {}
+        self.events = []
+        self.lock = threading.Lock()
+        self.scheduled = False
+        self.last_flush = 0.0
+        self.loop = None
+        self.thread = None
+        self.counts = {'received' : 0,
+                       'coalesced' : 0,
+                       'dispatched' : 0,
+                       'errors' : 0,
+                       }
+        self.last = (time.monotonic(), dict(self.counts))
+
+    def map(self, address, handler, *args, continuous=False):
+        """Call handler(address, *args, *params) for messages to address."""
+        self.handlers[address] = (handler, args, continuous)
+
+    def start(self):
+        """Start receiving on a background thread."""
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.loop.create_datagram_endpoint(
+            lambda: _Protocol(self), local_addr=self.address))
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       name='osc', daemon=True)
+        self.thread.start()
+        logger.info("Listening for OSC on %s:%d", *self.address)
+
+    def shutdown(self):
+        """Stop receiving and wait for the thread to end."""
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            self.loop = None
+
+    def receive(self, data):
+        """Decode a datagram and queue its messages for the next batch."""
+        now = time.perf_counter()
+        try:
+            messages = [timed.message for timed
+                        in osc_packet.OscPacket(data).messages]
+        except osc_packet.ParseError as err:
+            self.counts['errors'] += 1
+            logger.debug("Dropped bad OSC packet: %s", err)
+            return
+        with self.lock:
+            for message in messages:
+                self.counts['received'] += 1
+                entry = self.handlers.get(message.address)
+                if entry is None:
+                    continue
+                if entry[2]:
+                    if message.address in self.latest:
+                        self.counts['coalesced'] += 1
+                    self.latest[message.address] = (message.params, now)
+                else:
+                    self.events.append((message.address,
+                                        (message.params, now)))
+            if self.scheduled or not (self.latest or self.events):
+                return
+            self.scheduled = True
+        # Hand over at most one batch per frame.
+        delay = self.last_flush + self.interval - time.monotonic()
+        self.loop.call_later(max(0.0, delay), GLib.idle_add, self.__flush)
+
+    def __flush(self):
+        """Dispatch the pending batch in the main loop."""
+        with self.lock:
+            latest, self.latest = self.latest, {}
+            events, self.events = self.events, []
+            self.scheduled = False
+            self.last_flush = time.monotonic()
+            self.counts['dispatched'] += len(latest) + len(events)
+        for address, (params, received) in list(latest.items()) + events:
+            handler, args, continuous = self.handlers[address]
+            if self.tracer:
+                self.tracer.begin(received)
+            try:
+                handler(address, *args, *params)
+            except Exception:
+                logger.exception("OSC handler for %s failed", address)
+            finally:
+                if self.tracer:
+                    self.tracer.end()
+        return False
+
+    def rates(self):
+        """Return messages received, coalesced and dispatched per second
+        since the previous call."""
+        now = time.monotonic()
+        with self.lock:
+            counts = dict(self.counts)
+        then, before = self.last
+        self.last = (now, counts)
+        if now == then:
+            return {name : 0.0 for name in counts}
+        return {name : (counts[name] - before[name]) / (now - then)
+                for name in counts}
@@ -1,98 +1,337 @@
 #!/usr/bin/env python3
 
+import collections
 import logging
 import time
 
 import gi
 gi.require_version('Gst', '1.0')
-from gi.repository import Gst
+from gi.repository import GLib, Gst
+
+from framecache import CachePlayer
+from library import snap
+from mixer import deck_channel
 
 
 logger = logging.getLogger(__name__)
 
+# Smallest playback speed sent in a seek, a rate of 0 is invalid.
+MIN_RATE = 0.01
+
+# 'snap' moves targets onto indexed keyframes, so ACCURATE decodes
+# nothing extra; without an index it behaves like 'keyunit'.
+SEEK_MODES = {
+    'accurate' : Gst.SeekFlags.ACCURATE,
+    'keyunit' : Gst.SeekFlags.KEY_UNIT | Gst.SeekFlags.SNAP_NEAREST,
+    'snap' : Gst.SeekFlags.ACCURATE,
+    }
+
+
+# libav decoder 'skip-frame' value dropping non-reference frames.
+SKIP_NONREF = 1
+
+
+def loop_range(loop_in, loop_out):
+    """Return loop points in order, or None when they enclose nothing.
+
+    A seek with its start after its stop is refused, and an empty segment
+    ends as soon as it starts.
+    """
+    if loop_in is None or loop_out is None:
+        return loop_in, loop_out
+    if loop_in == loop_out:
+        return None
+    return min(loop_in, loop_out), max(loop_in, loop_out)
+
+
+def clamp_rate(rate):
+    """Return rate kept at least MIN_RATE away from a standstill."""
+    if abs(rate) < MIN_RATE:
+        return MIN_RATE if rate >= 0 else -MIN_RATE
+    return rate
+
+
+def instant_rate_supported():
+    """Return whether this GStreamer can change rate without flushing."""
+    return (Gst.version() >= (1, 18, 0, 0)
+            and hasattr(Gst.SeekFlags, 'INSTANT_RATE_CHANGE'))
+
+
 class TrickPlayer():
 
-    def __init__(self, ident):
+    def __init__(self, ident, frame_cache=None, keyframes=None, proxies=None):
         self.ident = ident
         self.file = None
+        # File the live pipeline plays, self.file until a switch is done.
+        self.live_file = None
         self.pipeline = None
         self.video_sink = None
         self.bus = None
         self.playing = False
         self.rate = 1.0
         self.loop = 1
+        # Second playbin kept prerolled on the next cue.
+        self.standby = None
+        self.standby_file = None
+        self.standby_source = None
+        self.standby_ready = False
+        self.standby_rate = 1.0
+        self.next_file = None
+        # Rate the next file will be played at, None for the deck's own.
+        self.next_rate = None
+        self.switch_requested = None
+        # Counts cue changes, so a switch's first buffer finds it is stale.
+        self.switches = 0
+        self.switch_latency = None
+        self.switch_latencies = collections.deque(maxlen=100)
+        # Called from the main loop with (file, seconds) after each switch.
+        self.on_switch = None
+        # Loop in/out points in ns per file, None meaning the clip bounds.
+        self.loop_points = {}
+        self.segment_pending = False
+        self.segment_done = None
+        self.last_buffer = None
+        self.loop_gap = None
+        self.loop_gaps = collections.deque(maxlen=100)
+        # Seek scheduler, only the latest rate and jump are applied.
+        self.seek_mode = 'snap'
+        # Returns the keyframe timestamps of a file, or None.
+        self.keyframes = keyframes
+        # Intra-only proxies are played instead of their sources if present.
+        self.proxies = proxies
+        self.instant_rate = instant_rate_supported()
+        self.applied_rate = 1.0
+        self.pending_jump = False
+        self.seek_source = None
+        self.seek_in_flight = False
+        self.seek_counts = collections.Counter()
+        # Optional RAM playback of the loop region through appsrc.
+        self.frame_cache = frame_cache
+        self.cache_mode = False
+        self.cache_player = None
+        self.cached_clip = None
+        # Decoders skip non-reference frames while the load governor asks.
+        self.low_quality = False
+        self.sync_pending = False
 
-    def set_pipeline(self):
-        """Initialize the pipeline."""
-        self.pipeline = Gst.parse_launch("playbin uri=file://%s flags=0x00000611" 
-            % self.file)
-        self.pipeline.set_state(Gst.State.READY)
+    def create_pipeline(self, filename, show_preroll=True):
+        """Create a playbin feeding this deck's intervideosink channel.
 
-    def set_video_sink(self):
-        """Initialize videosink"""
+        Colour balance is applied in the mix, so playbin adds none.
+        """
+        pipeline = Gst.parse_launch("playbin uri=file://%s flags=0x00000211"
+            % self.media_path(filename))
         intervidsink = Gst.ElementFactory.make("intervideosink")
         intervidsink.set_property("name", ("ivs_%d" % self.ident))
-        intervidsink.set_property("channel", self.ident)
-        self.pipeline.set_property('video_sink', intervidsink)
-        self.video_sink = self.pipeline.get_property('video_sink')
-        
+        intervidsink.set_property("channel", deck_channel(self.ident))
+        # The standby must not overwrite the live frame while prerolling.
+        intervidsink.set_property("show-preroll-frame", show_preroll)
+        pipeline.set_property('video_sink', intervidsink)
+        pipeline.connect('element-setup', self.__on_element_setup)
+        bus = pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self.on_message)
+        pipeline.set_state(Gst.State.READY)
+        return pipeline
+
     def run(self):
         """Setup and start playback."""
-        self.set_pipeline()
-        self.set_video_sink()
+        self.pipeline = self.create_pipeline(self.file)
+        self.live_file = self.file
+        self.video_sink = self.pipeline.get_property('video_sink')
         self.bus = self.pipeline.get_bus()
-        self.bus.add_signal_watch()
-        self.bus.connect("message", self.on_message)
-     
+        self.standby = self.create_pipeline(self.file, show_preroll=False)
+        # Enter segment mode once the first preroll is done.
+        self.segment_pending = True
+
     def on_message(self, bus, message):
-        """Handle EOS message."""
+        """Handle loop, EOS and standby preroll messages."""
         t = message.type
-        if t == Gst.MessageType.EOS:
-            self.jump_loop()    
-
-    def __send_seek_event(self):
-        """Format and send seek event."""
-        fmat = Gst.Format.TIME
-        ret, position = self.pipeline.query_position(fmat)
-        if (not ret):
-            logger.warning("Unable to retrieve current position.")
-            return 
-
-        if (self.rate > 0):
-            seek_event = Gst.Event.new_seek(self.rate,
-                Gst.Format.TIME,
-                (Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE),
-                Gst.SeekType.SET,
-                position,
-                Gst.SeekType.SET,
-                -1)
+        standby = (bus == self.standby.get_bus())
+        if t == Gst.MessageType.SEGMENT_DONE:
+            if not standby:
+                self.__on_segment_done()
+        elif t == Gst.MessageType.EOS:
+            # Only reached when the demuxer ignored the segment seek.
+            if not standby:
+                self.jump_loop()
+        elif t == Gst.MessageType.ASYNC_DONE:
+            if standby:
+                self.__on_standby_ready()
+                return
+            self.seek_in_flight = False
+            if self.segment_pending:
+                self.segment_pending = False
+                self.jump()
+            elif self.pending_jump or self.rate != self.applied_rate:
+                self.__schedule_seek()
+        elif t == Gst.MessageType.STATE_CHANGED:
+            if self.sync_pending and message.src == self.pipeline:
+                old, new, pending = message.parse_state_changed()
+                if new == Gst.State.PLAYING:
+                    # Later flushing seeks pick their own base time again.
+                    self.sync_pending = False
+                    self.pipeline.set_start_time(0)
+        elif t == Gst.MessageType.ERROR:
+            err, debug = message.parse_error()
+            logger.error("Deck %d: %s", self.ident, err.message)
+            if standby:
+                self.standby.set_state(Gst.State.READY)
+                self.standby_file = None
+                if self.switch_requested is not None:
+                    # The cue cannot play, stay on the live file.
+                    self.switch_requested = None
+                    self.file = self.live_file
+
+    def __schedule_seek(self):
+        """Apply pending rate and jump changes on the next idle cycle."""
+        self.seek_counts['requested'] += 1
+        if self.seek_source is None:
+            self.seek_source = GLib.idle_add(self.__apply_seek)
         else:
-            seek_event = Gst.Event.new_seek(self.rate,
+            self.seek_counts['coalesced'] += 1
+
+    def __apply_seek(self):
+        """Send one seek for the latest pending changes."""
+        self.seek_source = None
+        if self.seek_in_flight:
+            # Still prerolling after the last flush, ASYNC_DONE retries.
+            return False
+        rate = self.rate
+        if not (self.pending_jump or rate != self.applied_rate):
+            return False
+        if (not self.pending_jump and self.instant_rate
+                and rate * self.applied_rate > 0):
+            seek_event = Gst.Event.new_seek(rate,
                 Gst.Format.TIME,
-                (Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE),
-                Gst.SeekType.SET,
+                (Gst.SeekFlags.INSTANT_RATE_CHANGE | Gst.SeekFlags.SEGMENT),
+                Gst.SeekType.NONE,
                 -1,
-                Gst.SeekType.SET,
-                position)
-                
-        self.video_sink.send_event(seek_event)
-        logger.info("Current rate: %d", self.rate)
-
-    def update_color_channel(self, channel_name, value):
-        """Update color channel to new value."""
-        channels = self.pipeline.list_channels()
-        for ch in channels:
-            if (ch.label == channel_name):
-                channel = ch
-        if (not channel):
-            logger.error("Channel:%s not supported." % channel_name)
+                Gst.SeekType.NONE,
+                -1)
+            if self.video_sink.send_event(seek_event):
+                self.applied_rate = rate
+                self.seek_counts['instant'] += 1
+                return False
+            # Not handled upstream, fall back to flushing from now on.
+            self.instant_rate = False
+        position = None
+        if not self.pending_jump:
+            ret, position = self.pipeline.query_position(Gst.Format.TIME)
+            if (not ret):
+                logger.warning("Unable to retrieve current position.")
+                return False
+        self.pending_jump = False
+        self.jump(position)
+        logger.debug("Current rate: %.2f", self.rate)
+        return False
+
+    def __on_segment_done(self):
+        """Loop or bounce with a non-flushing segment seek."""
+        if not self.loop:
+            return
+        if self.loop > 1:
+            self.rate *= -1.0
+        self.applied_rate = self.rate
+        self.segment_done = time.perf_counter()
+        self.last_buffer = None
+        pad = self.video_sink.get_static_pad('sink')
+        pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM,
+                      self.__on_loop_buffer, [False])
+        self.video_sink.send_event(self.__make_seek(flush=False))
+
+    def __on_loop_buffer(self, pad, info, new_segment):
+        """Time the gap between the last and first buffer around a loop."""
+        now = time.perf_counter()
+        if info.type & Gst.PadProbeType.EVENT_DOWNSTREAM:
+            if info.get_event().type == Gst.EventType.SEGMENT:
+                new_segment[0] = True
+            return Gst.PadProbeReturn.OK
+        if not new_segment[0]:
+            self.last_buffer = now
+            return Gst.PadProbeReturn.OK
+        self.loop_gap = now - (self.last_buffer or self.segment_done)
+        self.loop_gaps.append(self.loop_gap)
+        logger.debug("Deck %d loop gap %.1fms", self.ident, self.loop_gap * 1000)
+        return Gst.PadProbeReturn.REMOVE
+
+    def set_loop_points(self, loop_in=None, loop_out=None):
+        """Set loop in/out points in ns for the current file."""
+        points = loop_range(loop_in, loop_out)
+        if points is None:
+            logger.warning("Deck %d: empty loop ignored", self.ident)
+            return
+        loop_in, loop_out = points
+        keyframes = self.get_keyframes()
+        if keyframes:
+            snapped_in = snap(keyframes, loop_in)
+            snapped_out = snap(keyframes, loop_out)
+            if (snapped_in is None or snapped_out is None
+                    or snapped_in < snapped_out):
+                loop_in, loop_out = snapped_in, snapped_out
+        self.__store_loop_points(self.file, (loop_in, loop_out))
+        if self.cached_clip:
+            # The cached region no longer matches, decode the new one.
+            self.__leave_cache()
+            self.__fill_cache()
             return
-        # Constrain the value.
-        if (value > channel.max_value):
-            value = channel.max_value
-        elif (value < channel.min_value):
-            value = channel.min_value
-        self.pipeline.set_value(channel, value)
+        # Re-enter segment mode with the new bounds from where we are.
+        self.jump(self.query_position())
+
+    def __store_loop_points(self, filename, loop_points):
+        """Keep a file's loop points in order, an empty range clears them.
+
+        Returns whether they changed. A standby prerolled on the file with
+        the old points seeks again when switched to.
+        """
+        loop_points = loop_range(*loop_points) or (None, None)
+        if loop_points == self.get_loop_points(filename):
+            return False
+        if loop_points == (None, None):
+            self.loop_points.pop(filename, None)
+        else:
+            self.loop_points[filename] = loop_points
+        if self.standby_file == filename:
+            self.standby_rate = None
+        return True
+
+    def set_loop_in(self):
+        """Mark the current position as the loop in point."""
+        position = self.query_position()
+        if position is not None:
+            self.set_loop_points(position, self.get_loop_points()[1])
+
+    def set_loop_out(self):
+        """Mark the current position as the loop out point."""
+        position = self.query_position()
+        if position is not None:
+            self.set_loop_points(self.get_loop_points()[0], position)
+
+    def query_position(self):
+        """Return the current position in ns, or None."""
+        if self.cached_clip:
+            return self.cache_player.get_position()
+        ret, position = self.pipeline.query_position(Gst.Format.TIME)
+        return position if ret else None
+
+    def media_path(self, filename):
+        """Return the file to decode for a clip, its proxy if current."""
+        if self.proxies is None:
+            return filename
+        return self.proxies.resolve(filename)
+
+    def get_keyframes(self, filename=None):
+        """Return the keyframe index of a file when seeks should snap."""
+        filename = filename or self.file
+        if (self.seek_mode != 'snap' or self.keyframes is None
+                or self.media_path(filename) != filename):
+            # Proxies are intra-only, every frame is a keyframe.
+            return None
+        return self.keyframes(filename)
+
+    def get_loop_points(self, filename=None):
+        """Return the (in, out) loop points of a file."""
+        return self.loop_points.get(filename or self.file, (None, None))
 
     def start(self):
         """Start the pipeline and set playing flag."""
@@ -102,76 +341,339 @@ class TrickPlayer():
     def stop(self):
         """Stop the pipeline and unset playing flag."""
         self.pipeline.set_state(Gst.State.NULL)
+        if self.standby:
+            self.standby.set_state(Gst.State.NULL)
+        if self.cache_player:
+            self.cache_player.stop()
         self.playing = False
 
+    def set_cache_mode(self, enabled):
+        """Play the loop region from the shared RAM frame cache."""
+        if self.frame_cache is None or enabled == self.cache_mode:
+            return
+        self.cache_mode = enabled
+        if enabled:
+            self.__fill_cache()
+        elif self.cached_clip:
+            self.jump(self.__leave_cache())
+
+    def __fill_cache(self):
+        """Use the cached frames of the loop region, decoding on a miss."""
+        loop_in, loop_out = self.get_loop_points()
+        source = self.media_path(self.file)
+        clip = self.frame_cache.get((source, loop_in, loop_out))
+        if clip:
+            self.__enter_cache(clip)
+        else:
+            self.frame_cache.fill(source, loop_in, loop_out,
+                                  self.__enter_cache)
+
+    def __enter_cache(self, clip):
+        """Pause decoding and push the cached frames instead."""
+        key = (self.media_path(self.file),) + self.get_loop_points()
+        if clip is None or not self.cache_mode or clip.key != key:
+            return False
+        self.frame_cache.acquire(clip)
+        position = self.query_position()
+        self.pipeline.set_state(Gst.State.PAUSED)
+        if self.cache_player is None:
+            self.cache_player = CachePlayer(self)
+        self.cached_clip = clip
+        self.cache_player.play(clip, position)
+        return False
+
+    def __leave_cache(self, resume=True):
+        """Stop pushing cached frames and return the position reached."""
+        if self.cached_clip is None:
+            return None
+        position = self.cache_player.stop()
+        self.frame_cache.release(self.cached_clip)
+        self.cached_clip = None
+        if resume and self.playing:
+            self.pipeline.set_state(Gst.State.PLAYING)
+        return position
+
+    def preload(self, newfile, rate=None, loop_points=None):
+        """Preroll the standby pipeline on the file expected next.
+
+        rate and loop_points are those the file will be played with, the
+        deck's own rate and the file's loop points when not given.
+        """
+        self.next_file = newfile
+        self.next_rate = None if rate is None else clamp_rate(rate)
+        if loop_points is not None and newfile not in (None, self.file):
+            self.__store_loop_points(newfile, loop_points)
+        # While a switch is pending the standby is still the live source.
+        if (newfile is None or self.switch_requested is not None
+                or (self.standby_file == newfile
+                    and self.standby_source == self.media_path(newfile))):
+            return
+        self.__load_standby(newfile)
+
+    def __load_standby(self, newfile):
+        """Load a file into the standby pipeline and preroll it."""
+        self.standby_ready = False
+        self.standby_file = newfile
+        self.standby_source = self.media_path(newfile)
+        self.standby_rate = None
+        self.standby.set_state(Gst.State.READY)
+        self.standby.set_property('uri', "file://%s" % self.standby_source)
+        self.standby.set_state(Gst.State.PAUSED)
+
     def change_file(self, newfile):
-        """Change the current file."""
+        """Change the current file by swapping in the standby pipeline."""
         self.file = newfile
-        # Set pipeline to NULL before messing with it.
-        self.pipeline.set_state(Gst.State.NULL)
-        self.pipeline.set_property('uri', "file://%s" % newfile)
-        # Reset the video sink.
-        self.set_video_sink()
-        # Return the pipeline to it's previous state.
+        self.switch_requested = time.perf_counter()
+        self.switches += 1
+        if self.standby_file != newfile:
+            # Cue miss: preroll it now and switch once it is ready.
+            self.__load_standby(newfile)
+        elif self.standby_ready:
+            self.__switch()
+
+    def __on_standby_ready(self):
+        """Standby reached PAUSED; align its rate and switch if wanted."""
+        rate = self.rate
+        if (self.next_rate is not None and self.switch_requested is None
+                and self.standby_file == self.next_file):
+            rate = self.next_rate
+        if self.standby_rate != rate:
+            # Enter segment mode at the loop start; prerolls again.
+            self.standby_rate = rate
+            self.standby.get_property('video_sink').send_event(
+                self.__make_seek(filename=self.standby_file, rate=rate))
+            return
+        self.standby_ready = True
+        if self.switch_requested is not None and self.standby_file == self.file:
+            self.__switch()
+
+    def __switch(self):
+        """Make the prerolled standby the live pipeline."""
+        self.__leave_cache(resume=False)
+        old = self.pipeline
+        self.pipeline, self.standby = self.standby, old
+        self.live_file = self.file
+        self.video_sink = self.pipeline.get_property('video_sink')
+        self.bus = self.pipeline.get_bus()
+        realign = self.standby_rate != self.rate or not self.playing
+        self.standby_file = None
+        self.standby_ready = False
+        self.applied_rate = self.standby_rate
+        self.seek_in_flight = False
+        self.video_sink.set_property("show-preroll-frame", True)
+        old.get_property('video_sink').set_property("show-preroll-frame", False)
+        pad = self.video_sink.get_static_pad('sink')
+        pad.add_probe(Gst.PadProbeType.BUFFER, self.__on_first_buffer, old,
+                      self.switches, self.switch_requested, self.file)
+        if realign:
+            # Rate changed since preroll, or paused and the frame must show.
+            self.jump()
         if self.playing:
             self.pipeline.set_state(Gst.State.PLAYING)
-        else:
-            self.pipeline.set_state(Gst.State.PAUSED)
-        # IMPORTANT: Give the pipeline some time before sending seek event.
-        time.sleep(.1)
-        self.__send_seek_event()
+        if self.cache_mode:
+            self.__fill_cache()
+
+    def __on_first_buffer(self, pad, info, old, switch, requested, filename):
+        """Record switch latency and retire the old pipeline.
+
+        A cue change made since this switch keeps its own request pending.
+        """
+        if switch == self.switches:
+            self.switch_requested = None
+        if requested is not None:
+            self.switch_latency = time.perf_counter() - requested
+            self.switch_latencies.append(self.switch_latency)
+            interval = self.frame_interval(pad)
+            if self.switch_latency > interval:
+                logger.warning("Deck %d cue switch took %.1fms (frame %.1fms)",
+                               self.ident, self.switch_latency * 1000,
+                               interval * 1000)
+            else:
+                logger.info("Deck %d cue switch took %.1fms",
+                            self.ident, self.switch_latency * 1000)
+            if self.on_switch:
+                GLib.idle_add(self.on_switch, filename, self.switch_latency)
+        GLib.idle_add(self.__retire, old)
+        return Gst.PadProbeReturn.REMOVE
+
+    def __retire(self, old):
+        """Stop the previous pipeline and reuse it as the standby.
+
+        Nothing is done when a later cue change has loaded it already, or
+        switched to it again.
+        """
+        if old is self.pipeline or self.standby_file is not None:
+            return False
+        old.set_state(Gst.State.READY)
+        if old is self.standby and self.next_file:
+            self.preload(self.next_file, self.next_rate)
+        return False
+
+    def __on_element_setup(self, pipeline, element):
+        if self.low_quality and element.find_property('skip-frame'):
+            element.set_property('skip-frame', SKIP_NONREF)
+
+    def set_low_quality(self, low):
+        """Have the deck's decoders skip non-reference frames, or not."""
+        self.low_quality = low
+        for pipeline in self.pipelines():
+            for element in pipeline.iterate_recurse():
+                if element.find_property('skip-frame'):
+                    element.set_property('skip-frame',
+                                         SKIP_NONREF if low else 0)
+
+    def sync_start(self, base_time):
+        """Restart the loop so its first frame is due at base_time.
+
+        Every pipeline here runs on the system clock, so decks started on
+        one base time stay frame-locked until a flushing seek or cue switch
+        gives one a base time of its own. Cached frames would keep their
+        own timing, so cache mode is left.
+        """
+        self.__leave_cache(resume=False)
+        self.cache_mode = False
+        self.pipeline.set_state(Gst.State.PAUSED)
+        self.jump()
+        self.pipeline.set_start_time(Gst.CLOCK_TIME_NONE)
+        self.pipeline.set_base_time(base_time)
+        self.sync_pending = True
+        self.playing = True
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+    def sink_pads(self):
+        """Return the sink pads this deck's frames may pass."""
+        pads = [pipeline.get_property('video_sink').get_static_pad('sink')
+                for pipeline in self.pipelines()]
+        if self.cache_player:
+            pads.append(self.cache_player.sink.get_static_pad('sink'))
+        return pads
 
+    def pipelines(self):
+        """Return the pipelines playing this deck."""
+        return [pipeline for pipeline in (self.pipeline, self.standby)
+                if pipeline]
+
+    def sink_pad(self):
+        """Return the sink pad the deck's frames currently pass."""
+        if self.cached_clip:
+            return self.cache_player.sink.get_static_pad('sink')
+        return self.video_sink.get_static_pad('sink')
+
+    def frame_interval(self, pad=None):
+        """Return the frame duration in seconds of the live pipeline."""
+        if pad is None:
+            pad = self.video_sink.get_static_pad('sink')
+        caps = pad.get_current_caps()
+        if caps:
+            ok, num, den = caps.get_structure(0).get_fraction('framerate')
+            if ok and num > 0:
+                return den / num
+        return 1 / 30
 
     def cleanup(self):
         """Cleanly stop everything."""
         self.pipeline.set_state(Gst.State.NULL)
-        if (self.video_sink):
-            self.video_sink.unref()
-        self.pipeline.unref()
+        if self.standby:
+            self.standby.set_state(Gst.State.NULL)
+        if self.cache_player:
+            self.cache_player.stop()
 
     def pause_play(self):
         """Toggle paused/playing status and set flag."""
-        self.pipeline.set_state(Gst.State.PAUSED if self.playing 
-                                                 else Gst.State.PLAYING)
+        state = Gst.State.PAUSED if self.playing else Gst.State.PLAYING
+        if self.cached_clip:
+            self.cache_player.pipeline.set_state(state)
+        else:
+            self.pipeline.set_state(state)
         self.playing = not self.playing
 
     def set_speed(self, rate):
         """Change playback speed."""
-        self.rate = rate
-        self.__send_seek_event()
+        self.rate = clamp_rate(rate)
+        if not self.cached_clip:
+            self.__schedule_seek()
 
     def reverse(self):
         """Reverse playback."""
         self.rate *= -1.0
-        self.__send_seek_event()
-    
+        if not self.cached_clip:
+            self.__schedule_seek()
+
+    def recall(self, filename, rate, loop, loop_points):
+        """Apply a stored file, rate, loop mode and loop points at once.
+
+        At most one seek is sent, or one cue switch when the file changes.
+        """
+        rate = clamp_rate(rate)
+        moved = self.__store_loop_points(filename, loop_points)
+        self.loop = loop
+        self.rate = rate
+        if filename != self.file:
+            self.change_file(filename)
+        elif self.cached_clip:
+            if moved:
+                self.__leave_cache()
+                self.__fill_cache()
+        elif moved:
+            self.jump(self.query_position())
+        elif rate != self.applied_rate:
+            self.__schedule_seek()
+
+    def settled(self):
+        """Return whether no cue switch or flushing seek is pending."""
+        return (self.switch_requested is None and not self.seek_in_flight
+                and self.seek_source is None)
+
     def jump_loop(self):
         """Restart clip or reverse."""
         if self.loop:
             if self.loop > 1:
-                self.reverse()
-            if (self.rate > 0):
-                self.jump(0)
-            else:
-                self.jump(-1)
-        
-    def jump(self, position):
-        """Restart clip from beginning or end."""
-        if (self.rate > 0):
-            seek_event = Gst.Event.new_seek(self.rate,
-                Gst.Format.TIME,
-                (Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE),
-                Gst.SeekType.SET,
-                position,
-                Gst.SeekType.SET,
-                -1)
-        else:
-            seek_event = Gst.Event.new_seek(self.rate,
-                Gst.Format.TIME,
-                (Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE),
-                Gst.SeekType.SET,
-                -1,
-                Gst.SeekType.SET,
-                position)
+                self.rate *= -1.0
+            if self.cached_clip:
+                self.cache_player.jump()
+                return
+            self.pending_jump = True
+            self.__schedule_seek()
+
+    def jump(self, position=None):
+        """Flushing seek to the loop start, or to position, right away."""
+        self.seek_counts['flushing'] += 1
+        self.applied_rate = self.rate
+        self.seek_in_flight = self.video_sink.send_event(
+            self.__make_seek(position))
 
-        self.video_sink.send_event(seek_event)
+    def __make_seek(self, position=None, flush=True, filename=None,
+                    rate=None):
+        """Build a segment seek from position in the current direction.
+
+        Without a position the seek starts at the loop in point, or at the
+        out point when playing backwards. rate defaults to the deck's.
+        """
+        if rate is None:
+            rate = self.rate
+        loop_in, loop_out = self.get_loop_points(filename)
+        keyframes = self.get_keyframes(filename)
+        start = loop_in if loop_in is not None else 0
+        stop = loop_out if loop_out is not None else -1
+        if position is not None and position >= 0:
+            if position < start or (stop >= 0 and position > stop):
+                position = None
+            else:
+                position = snap(keyframes, position)
+        flags = Gst.SeekFlags.SEGMENT | SEEK_MODES[self.seek_mode]
+        if self.seek_mode == 'snap' and not keyframes:
+            flags = Gst.SeekFlags.SEGMENT | SEEK_MODES['keyunit']
+        if flush:
+            flags |= Gst.SeekFlags.FLUSH
+        if (rate > 0):
+            if position is not None:
+                start = position
+        elif position is not None:
+            stop = position
+        return Gst.Event.new_seek(rate,
+            Gst.Format.TIME,
+            flags,
+            Gst.SeekType.SET,
+            start,
+            Gst.SeekType.SET,
+            stop)
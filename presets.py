@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+PRESET_FILE = '.pyvj_presets.json'
+PRESET_VERSION = 1
+
+# Preset slots offered in the control window and over OSC.
+SLOTS = 8
+
+
+class PresetStore():
+    """Snapshots of every deck and mixer parameter, kept on disk.
+
+    A preset is a dict with a 'decks' list and a 'mixer' dict, see
+    GTK_Main.snapshot().
+    """
+
+    def __init__(self, path):
+        self.path = os.path.join(path, PRESET_FILE)
+        self.presets = {}
+        self.load()
+
+    def load(self):
+        """Read the presets from disk."""
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return
+        if stored.get('version') == PRESET_VERSION:
+            self.presets = stored['presets']
+
+    def save(self):
+        """Write the presets to disk atomically."""
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({'version' : PRESET_VERSION,
+                           'presets' : self.presets}, f, indent=1)
+            os.replace(tmp, self.path)
+        except OSError as err:
+            logger.error("Cannot save presets: %s", err)
+
+    def store(self, name, preset):
+        """Keep a preset under name and save."""
+        self.presets[str(name)] = preset
+        self.save()
+        logger.info("Stored preset %s", name)
+
+    def get(self, name):
+        """Return the preset stored under name, or None."""
+        return self.presets.get(str(name))
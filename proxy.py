@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import os
+import threading
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+
+logger = logging.getLogger(__name__)
+
+PROXY_DIR = '.pyvj_proxies'
+
+# Proxies are made for clips with fewer keyframes per frame than this.
+MAX_KEYFRAME_RATIO = 0.5
+
+# Disk space all proxies may take, in MB.
+PROXY_BUDGET_MB = 4096
+
+# Bytes per pixel a proxy frame is expected to take, MJPEG at quality 85.
+PROXY_BYTES_PER_PIXEL = 0.3
+
+_progress = None
+
+
+def _init_worker(progress):
+    """Set up a transcoding process at the lowest CPU priority."""
+    global _progress
+    _progress = progress
+    os.nice(19)
+    Gst.init(None)
+
+
+def frame_count(entry):
+    """Return the number of frames of a library entry, 0 if unknown."""
+    if not entry or not entry.get('duration') or not entry.get('framerate'):
+        return 0
+    num, den = entry['framerate']
+    return entry['duration'] * num / (den * Gst.SECOND) if den else 0
+
+
+def transcode(source, target, width, height):
+    """Transcode source to an intra-only MJPEG proxy at width x height.
+
+    Progress is reported on the worker's queue, errors returned as text.
+    """
+    tmp = target + '.part'
+    pipeline = Gst.parse_launch("""
+        uridecodebin uri=%s caps=video/x-raw expose-all-streams=false !
+        videoconvert !
+        videoscale !
+        video/x-raw,width=%d,height=%d !
+        jpegenc quality=85 !
+        matroskamux !
+        filesink location="%s"
+        """ % (Gst.filename_to_uri(source), width, height, tmp))
+    pipeline.set_state(Gst.State.PLAYING)
+    bus = pipeline.get_bus()
+    error = None
+    while True:
+        msg = bus.timed_pop_filtered(Gst.SECOND // 2,
+            Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        if msg is None:
+            ok, position = pipeline.query_position(Gst.Format.TIME)
+            ok_d, duration = pipeline.query_duration(Gst.Format.TIME)
+            if ok and ok_d and duration > 0 and _progress is not None:
+                _progress.put((source, position / duration))
+            continue
+        if msg.type == Gst.MessageType.ERROR:
+            err, debug = msg.parse_error()
+            error = err.message
+        break
+    pipeline.set_state(Gst.State.NULL)
+    if error:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return error
+    os.replace(tmp, target)
+    return None
+
+
+class ProxyManager():
+    """Intra-only proxies of library clips, transcoded in the background.
+
+    Proxies are made when asked for, clip by clip, or for every long-GOP
+    clip of the library when auto is set, while their files stay within
+    the disk budget.
+    """
+
+    def __init__(self, library, width, height, workers=None, auto=False,
+                 budget_mb=PROXY_BUDGET_MB):
+        self.library = library
+        self.width = width
+        self.height = height
+        self.workers = workers or max(1, (os.cpu_count() or 1) // 4)
+        self.auto = auto
+        self.budget = budget_mb << 20
+        self.path = os.path.join(library.path, PROXY_DIR)
+        self.jobs = {}
+        # name -> expected proxy size of queued and running jobs
+        self.queued = {}
+        self.progress = {}
+        # path -> what resolve() returned, until a proxy job finishes.
+        self.resolved = {}
+        self.callback = None
+        self.lock = threading.Lock()
+        self.pool = None
+        self.queue = None
+
+    def proxy_path(self, name):
+        """Return the proxy file path for a library file name."""
+        return os.path.join(self.path, name + '.mkv')
+
+    def resolve(self, path):
+        """Return the proxy of a media file if it is current, else the file.
+
+        The answer is kept until a proxy job finishes or the proxies are
+        updated, as it is asked for on every seek and preroll.
+        """
+        with self.lock:
+            if path in self.resolved:
+                return self.resolved[path]
+        resolved = self.__resolve(path)
+        with self.lock:
+            self.resolved[path] = resolved
+        return resolved
+
+    def __resolve(self, path):
+        name = os.path.basename(path)
+        proxy = self.proxy_path(name)
+        try:
+            with open(proxy + '.json') as f:
+                stored = json.load(f)
+            stat = os.stat(path)
+        except (OSError, ValueError):
+            return path
+        if (stored['mtime'] != stat.st_mtime or stored['size'] != stat.st_size
+                or (stored['width'], stored['height'])
+                != (self.width, self.height)):
+            self.invalidate(name)
+            return path
+        return proxy
+
+    def invalidate(self, name):
+        """Remove the proxy of a file whose source has changed."""
+        self.forget(name)
+        proxy = self.proxy_path(name)
+        for stale in (proxy, proxy + '.json'):
+            if os.path.exists(stale):
+                os.remove(stale)
+        logger.info("Proxy of %s invalidated.", name)
+
+    def forget(self, name=None):
+        """Resolve a library file, or every file, again when next asked."""
+        with self.lock:
+            for path in list(self.resolved):
+                if name is None or os.path.basename(path) == name:
+                    del self.resolved[path]
+
+    def wanted(self, name):
+        """Return whether a clip is long-GOP and benefits from a proxy."""
+        entry = self.library.get(name)
+        frames = frame_count(entry)
+        if not entry.get('keyframes') or not frames:
+            return False
+        return entry['keyframes'] / frames < MAX_KEYFRAME_RATIO
+
+    def estimate(self, name):
+        """Return the bytes the proxy of a library file is expected to take."""
+        return int(frame_count(self.library.get(name))
+                   * self.width * self.height * PROXY_BYTES_PER_PIXEL)
+
+    def disk_used(self):
+        """Return the bytes the proxy directory takes."""
+        try:
+            return sum(entry.stat().st_size for entry in os.scandir(self.path)
+                       if entry.is_file())
+        except OSError:
+            return 0
+
+    def update(self, callback=None):
+        """Queue proxies for every long-GOP clip without a current proxy,
+        when made automatically.
+        """
+        self.callback = callback
+        # Sources may have changed since they were resolved.
+        self.forget()
+        if not self.auto:
+            return
+        for name in self.library.cues():
+            source = os.path.join(self.library.path, name)
+            if self.wanted(name) and self.resolve(source) == source:
+                if not self.enqueue(name):
+                    break
+
+    def enqueue(self, name):
+        """Queue a library file for transcoding.
+
+        Returns False when its proxy would not fit the disk budget.
+        """
+        source = os.path.join(self.library.path, name)
+        try:
+            stat = os.stat(source)
+            os.makedirs(self.path, exist_ok=True)
+        except OSError as err:
+            logger.warning("Cannot make a proxy of %s: %s", name, err)
+            return True
+        size = self.estimate(name)
+        with self.lock:
+            if name in self.jobs:
+                return True
+            if self.disk_used() + sum(self.queued.values()) + size > self.budget:
+                logger.warning("Proxy of %s not queued, proxies would take "
+                               "more than %d MB.", name, self.budget >> 20)
+                return False
+            if self.pool is None:
+                self.__start_pool()
+            job = self.pool.submit(transcode, source, self.proxy_path(name),
+                                   self.width, self.height)
+            self.jobs[name] = job
+            self.queued[name] = size
+            self.progress[source] = 0.0
+        job.add_done_callback(
+            lambda job: self.__on_done(name, source, stat, job))
+        logger.info("Proxy of %s queued.", name)
+        return True
+
+    def __start_pool(self):
+        """Start the transcoding processes and the progress reader."""
+        context = multiprocessing.get_context('spawn')
+        self.queue = context.Queue()
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            self.workers, mp_context=context,
+            initializer=_init_worker, initargs=(self.queue,))
+        thread = threading.Thread(target=self.__read_progress, daemon=True)
+        thread.start()
+
+    def __read_progress(self):
+        """Collect progress reports from the workers."""
+        while True:
+            source, fraction = self.queue.get()
+            with self.lock:
+                if source in self.progress:
+                    self.progress[source] = fraction
+
+    def __on_done(self, name, source, stat, job):
+        """Record a finished proxy with the source stat it was made from."""
+        with self.lock:
+            del self.jobs[name]
+            self.queued.pop(name, None)
+            self.progress.pop(source, None)
+        self.forget(name)
+        if job.cancelled():
+            return
+        error = job.exception() or job.result()
+        if error:
+            logger.error("Proxy of %s failed: %s", name, error)
+            return
+        try:
+            current = os.stat(source)
+        except OSError:
+            return
+        if (current.st_mtime, current.st_size) != (stat.st_mtime, stat.st_size):
+            # Changed while transcoding, start over.
+            self.enqueue(name)
+            return
+        with open(self.proxy_path(name) + '.json', 'w') as f:
+            json.dump({'mtime' : stat.st_mtime, 'size' : stat.st_size,
+                       'width' : self.width, 'height' : self.height}, f)
+        self.forget(name)
+        logger.info("Proxy of %s ready.", name)
+        if self.callback:
+            GLib.idle_add(self.callback, name)
+
+    def status(self):
+        """Return the progress of queued and running proxies by file name."""
+        with self.lock:
+            return {os.path.basename(source) : fraction
+                    for source, fraction in self.progress.items()}
+
+    def shutdown(self):
+        """Stop transcoding, abandoning queued jobs."""
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
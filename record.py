@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import logging
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+
+logger = logging.getLogger(__name__)
+
+# Encoded frames a recording may fall behind by before frames are
+# dropped; the display branch never waits for the encoder.
+RECORD_QUEUE_NS = 2 * Gst.SECOND
+
+# Seconds to wait on quitting for recordings to write their index.
+FINISH_TIMEOUT = 5
+
+
+def describe_encoder(bitrate=8000, gop=60, live=True):
+    """Return an H.264 encoder, or MJPEG when x264enc is missing."""
+    if Gst.ElementFactory.find('x264enc'):
+        return ("videoconvert ! x264enc bitrate=%d key-int-max=%d "
+                "speed-preset=veryfast%s ! h264parse"
+                % (bitrate, gop, " tune=zerolatency" if live else ""))
+    return "videoconvert ! jpegenc"
+
+
+def describe_file(path, bitrate=8000, live=True):
+    """Return a branch encoding into a Matroska file.
+
+    Matroska stays readable if the show ends without a clean EOS.
+    """
+    return ("%s ! matroskamux ! filesink location=\"%s\""
+            % (describe_encoder(bitrate, live=live), path))
+
+
+def describe_stream(host, port, bitrate=4000):
+    """Return a branch streaming RTP over UDP, e.g. to a projector box."""
+    encoder = describe_encoder(bitrate, gop=30)
+    if 'x264enc' in encoder:
+        payloader = "rtph264pay config-interval=1 pt=96"
+    else:
+        payloader = "rtpjpegpay pt=26"
+    return ("%s ! %s ! udpsink host=%s port=%d sync=false async=false"
+            % (encoder, payloader, host, port))
+
+
+class Recorder():
+    """Adds and removes encoding branches on the program tee while live.
+
+    Each branch starts with a leaky queue, so encoding runs in its own
+    thread and drops frames rather than holding up the display.
+    """
+
+    def __init__(self, pipeline, size=None, tee='program'):
+        self.pipeline = pipeline
+        # Recordings keep this size when the mix resolution is lowered.
+        self.size = size
+        self.tee = pipeline.get_by_name(tee)
+        self.branches = {}
+        self.dropped = {}
+        # name -> (probe id, drops at the start) while a queue is full.
+        self.overflows = {}
+        # name -> event set once the EOS of a stopped branch has passed.
+        self.finishing = {}
+
+    def start(self, name, description):
+        """Start a branch, e.g. describe_file(...), under a name."""
+        if name in self.branches:
+            return
+        if self.size:
+            description = ("videoscale ! video/x-raw,width=%d,height=%d ! %s"
+                           % (self.size + (description,)))
+        branch = Gst.parse_bin_from_description(
+            "queue name=%s_queue leaky=downstream max-size-buffers=0 "
+            "max-size-bytes=0 max-size-time=%d ! %s"
+            % (name, RECORD_QUEUE_NS, description), True)
+        branch.set_name(name)
+        queue = branch.get_by_name('%s_queue' % name)
+        self.dropped[name] = 0
+        self.overflows.pop(name, None)
+        queue.connect('overrun', self.on_overrun, name)
+        self.pipeline.add(branch)
+        branch.sync_state_with_parent()
+        pad = self.tee.request_pad(self.tee.get_pad_template('src_%u'),
+                                   None, None)
+        pad.link(branch.get_static_pad('sink'))
+        self.branches[name] = (branch, pad)
+        logger.info("Started %s: %s", name, description)
+
+    def stop(self, name):
+        """Finish a branch; its file is closed once the EOS has passed."""
+        if name not in self.branches:
+            return
+        branch, pad = self.branches.pop(name)
+        self.finishing[name] = threading.Event()
+        pad.add_probe(Gst.PadProbeType.IDLE, self.__unlink, branch)
+
+    def stop_all(self):
+        for name in list(self.branches):
+            self.stop(name)
+
+    def finish(self, timeout=FINISH_TIMEOUT):
+        """Stop every branch and wait until their files are complete.
+
+        Blocks the caller; the pipeline must keep running meanwhile.
+        """
+        self.stop_all()
+        deadline = time.monotonic() + timeout
+        for name, done in list(self.finishing.items()):
+            if not done.wait(max(0, deadline - time.monotonic())):
+                logger.warning("%s not finished after %ds, its file may "
+                               "lack an index", name, timeout)
+
+    def recording(self, name):
+        return name in self.branches
+
+    def on_overrun(self, queue, name):
+        # Emitted for every frame reaching the full queue, each of which
+        # makes the leaky queue drop its oldest frame.
+        self.dropped[name] += 1
+        if name in self.overflows:
+            return
+        pad = queue.get_static_pad('sink')
+        probe = pad.add_probe(Gst.PadProbeType.BUFFER, self.__on_drained,
+                              name)
+        self.overflows[name] = (probe, self.dropped[name] - 1)
+        logger.warning("%s encoder is falling behind, dropping frames", name)
+
+    def __on_drained(self, pad, info, name):
+        """Note when the queue has room again, ending the overflow."""
+        queue = pad.get_parent_element()
+        if (queue.get_property('current-level-time')
+                >= queue.get_property('max-size-time')):
+            return Gst.PadProbeReturn.OK
+        probe, dropped = self.overflows.pop(name)
+        logger.warning("%s encoder caught up after dropping %d frames",
+                       name, self.dropped[name] - dropped)
+        return Gst.PadProbeReturn.REMOVE
+
+    def __unlink(self, pad, info, branch):
+        """Detach a branch from the tee and drain it."""
+        sinkpad = branch.get_static_pad('sink')
+        pad.unlink(sinkpad)
+        self.tee.release_request_pad(pad)
+        for sink in branch.iterate_sinks():
+            sink.get_static_pad('sink').add_probe(
+                Gst.PadProbeType.EVENT_DOWNSTREAM, self.__on_eos, branch)
+        sinkpad.send_event(Gst.Event.new_eos())
+        return Gst.PadProbeReturn.REMOVE
+
+    def __on_eos(self, pad, info, branch):
+        if info.get_event().type != Gst.EventType.EOS:
+            return Gst.PadProbeReturn.OK
+        done = self.finishing.get(branch.get_name())
+        if done:
+            done.set()
+        GLib.idle_add(self.__remove, branch)
+        return Gst.PadProbeReturn.REMOVE
+
+    def __remove(self, branch):
+        self.finishing.pop(branch.get_name(), None)
+        branch.set_state(Gst.State.NULL)
+        self.pipeline.remove(branch)
+        logger.info("Finished %s", branch.get_name())
+        return False
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Render a scripted set to a file offline, faster than real time.
+
+A set script is JSON:
+
+    {"output" : "show.mkv",
+     "width" : 800, "height" : 600, "fps" : 30, "duration" : 120,
+     "decks" : [["intro.mp4", "loop1.mp4"], ["loop2.mp4"]],
+     "automation" : [
+        {"at" : 0, "deck" : 1, "control" : "alpha", "value" : 0.0},
+        {"at" : 8, "deck" : 1, "control" : "alpha", "value" : 1.0},
+        {"at" : 20, "deck" : 0, "control" : "HUE", "value" : 500}]}
+
+Each deck plays its clips back to back. Automation points of a control
+are joined by linear ramps; colour channels take slider values from
+-1000 to 1000. Nothing syncs to a clock, so rendering runs as fast as
+decoding and encoding allow.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstController', '1.0')
+from gi.repository import Gst, GstController
+
+from mixer import (COLOR_CHANNELS, Mixer, OUTPUT_HEIGHT, OUTPUT_WIDTH,
+                   color_property)
+from record import describe_file
+
+
+logger = logging.getLogger(__name__)
+
+
+def describe_deck(ident, clips, fps):
+    """Return the clips of a deck joined into one stream at fps.
+
+    The joined stream is one segment, so automation of the deck's colour
+    balance runs on the set's time rather than each clip's.
+    """
+    lines = ["uridecodebin uri=%s caps=video/x-raw expose-all-streams=false ! "
+             "queue ! concat_%d." % (Gst.filename_to_uri(clip), ident)
+             for clip in clips]
+    # The chain into the mix must come last to be continued by the mixer.
+    lines.append("concat name=concat_%d ! identity single-segment=true ! "
+                 "videoconvert ! videorate ! video/x-raw,framerate=%d/1"
+                 % (ident, fps))
+    return "\n".join(lines)
+
+
+def automate(mixer, points):
+    """Bind every automated control to its points in stream time."""
+    controls = {}
+    for point in sorted(points, key=lambda point: point['at']):
+        deck, control = point['deck'], point['control']
+        if control == 'alpha':
+            target, prop, value = mixer.pads[deck], 'alpha', point['value']
+        elif control in COLOR_CHANNELS:
+            target = mixer.balances[deck]
+            prop, value = color_property(control, point['value'])
+        else:
+            raise ValueError("Unknown control %s" % control)
+        source = controls.get((target, prop))
+        if source is None:
+            source = GstController.InterpolationControlSource()
+            source.set_property('mode', GstController.InterpolationMode.LINEAR)
+            target.add_control_binding(
+                GstController.DirectControlBinding.new_absolute(
+                    target, prop, source))
+            controls[(target, prop)] = source
+        source.set(int(point['at'] * Gst.SECOND), value)
+
+
+def render(script, base='.'):
+    """Render a set script, return the seconds of output per wall second."""
+    fps = script.get('fps', 30)
+    duration = int(script['duration'] * Gst.SECOND)
+    decks = script['decks']
+    mixer = Mixer(len(decks), script.get('width', OUTPUT_WIDTH),
+                  script.get('height', OUTPUT_HEIGHT))
+    clips = [[os.path.join(base, clip) for clip in deck] for deck in decks]
+    pipeline = mixer.build(describe_file(os.path.join(base, script['output']),
+                                         script.get('bitrate', 8000),
+                                         live=False),
+                           [describe_deck(i, deck, fps)
+                            for i, deck in enumerate(clips)])
+    automate(mixer, script.get('automation', []))
+    # End the render at the set's duration, even if decks run longer.
+    ended = [False]
+    rendered = [0]
+
+    def on_mix_buffer(pad, info):
+        if ended[0]:
+            return Gst.PadProbeReturn.DROP
+        rendered[0] = info.get_buffer().pts
+        if rendered[0] >= duration:
+            ended[0] = True
+            pad.get_peer().send_event(Gst.Event.new_eos())
+            return Gst.PadProbeReturn.DROP
+        return Gst.PadProbeReturn.OK
+
+    pipeline.get_by_name('mix').get_static_pad('src').add_probe(
+        Gst.PadProbeType.BUFFER, on_mix_buffer)
+    start = time.perf_counter()
+    pipeline.set_state(Gst.State.PLAYING)
+    bus = pipeline.get_bus()
+    error = None
+    while True:
+        msg = bus.timed_pop_filtered(5 * Gst.SECOND,
+            Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        if msg is None:
+            logger.info("Rendered %.1f of %.1fs", rendered[0] / Gst.SECOND,
+                        duration / Gst.SECOND)
+            continue
+        if msg.type == Gst.MessageType.ERROR:
+            err, debug = msg.parse_error()
+            error = err.message
+        break
+    pipeline.set_state(Gst.State.NULL)
+    if error:
+        raise RuntimeError(error)
+    speed = rendered[0] / Gst.SECOND / (time.perf_counter() - start)
+    logger.info("Rendered %s at %.1fx real time", script['output'], speed)
+    return speed
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Render a pyvj set offline.")
+    parser.add_argument('script', help="JSON set script")
+    parser.add_argument('--output', help="file to write instead of the "
+                                         "script's output")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    with open(args.script) as f:
+        script = json.load(f)
+    if args.output:
+        script['output'] = os.path.abspath(args.output)
+    Gst.init(None)
+    render(script, os.path.dirname(os.path.abspath(args.script)))
+
+
+if __name__=='__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Set lists: the clips each deck plays, in order, with their settings.
+
+A set list is JSON:
+
+    {"version" : 1,
+     "decks" : [
+        [{"file" : "intro.mp4"},
+         {"file" : "loop1.mp4", "loop" : "bounce", "rate" : 0.5,
+          "in" : 2.0, "out" : 6.5}],
+        [{"file" : "loop2.mp4", "loop" : "off"}]]}
+
+Files are relative to the clip directory. loop is one of 'off', 'loop'
+(the default) and 'bounce'; in and out are loop points in seconds.
+"""
+
+import json
+import logging
+import os
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+
+logger = logging.getLogger(__name__)
+
+SETLIST_VERSION = 1
+
+# TrickPlayer loop values of the set list's loop modes.
+LOOP_MODES = {'off' : 0, 'loop' : 1, 'bounce' : 2}
+
+
+def number(entry, key, default=None):
+    """Return a number of an entry, raise ValueError if it is not one."""
+    value = entry.get(key, default)
+    if value is not None and (isinstance(value, bool)
+                              or not isinstance(value, (int, float))):
+        raise ValueError("%s of %s is not a number" % (key, entry))
+    return value
+
+
+def parse_cue(entry):
+    """Return a set list entry as file, rate, loop and loop points in ns.
+
+    Raises ValueError when the entry is malformed.
+    """
+    if isinstance(entry, str):
+        entry = {'file' : entry}
+    if not isinstance(entry, dict) or not isinstance(entry.get('file'), str):
+        raise ValueError("Set list entry %s has no file" % (entry,))
+    mode = entry.get('loop', 'loop')
+    if not isinstance(mode, str) or mode not in LOOP_MODES:
+        raise ValueError("Unknown loop mode %s" % mode)
+    points = tuple(None if number(entry, key) is None
+                   else int(entry[key] * Gst.SECOND) for key in ('in', 'out'))
+    return {'file' : entry['file'],
+            'rate' : float(number(entry, 'rate', 1.0)),
+            'loop' : LOOP_MODES[mode],
+            'loop_points' : points,
+            }
+
+
+def load_setlist(path, clips):
+    """Read a set list, return each deck's cues found in clips.
+
+    Raises OSError or ValueError when the set list cannot be used.
+    """
+    with open(path) as f:
+        stored = json.load(f)
+    if not isinstance(stored, dict):
+        raise ValueError("Set list is not an object")
+    if stored.get('version') != SETLIST_VERSION:
+        raise ValueError("Unsupported set list version %s"
+                         % stored.get('version'))
+    if not isinstance(stored.get('decks'), list):
+        raise ValueError("Set list has no decks")
+    decks = []
+    for i, deck in enumerate(stored['decks']):
+        if not isinstance(deck, list):
+            raise ValueError("Set list deck %d is not a list" % i)
+        cues = []
+        for entry in deck:
+            cue = parse_cue(entry)
+            if not os.path.isfile(os.path.join(clips, cue['file'])):
+                logger.warning("Set list deck %d: %s is missing",
+                               i, cue['file'])
+                continue
+            cues.append(cue)
+        decks.append(cues)
+    return decks
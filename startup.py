@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import logging
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which pipelines still not PLAYING are reported as such.
+REPORT_TIMEOUT = 10
+
+
+class StartupProfile():
+    """Times the phases of start-up and each pipeline reaching PLAYING.
+
+    Phases are consecutive; phase(name) ends the running one. Pipelines
+    are followed through their bus and the profile is logged once all of
+    them play, or after REPORT_TIMEOUT.
+    """
+
+    def __init__(self, began=None):
+        self.began = began or time.perf_counter()
+        self.last = self.began
+        self.phases = []
+        # pipeline name -> (bus, handler id) until it plays
+        self.pending = {}
+        # pipeline name -> seconds from start until PLAYING
+        self.playing = {}
+        self.reported = False
+
+    def elapsed(self):
+        return time.perf_counter() - self.began
+
+    def phase(self, name):
+        """End the running phase, naming it."""
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def watch(self, name, pipeline):
+        """Note when a pipeline first reaches PLAYING."""
+        if name in self.pending or name in self.playing:
+            return
+        bus = pipeline.get_bus()
+        bus.add_signal_watch()
+        handler = bus.connect('message::state-changed', self.on_state_changed,
+                              name, pipeline)
+        self.pending[name] = (bus, handler)
+
+    def start_reports(self):
+        GLib.timeout_add_seconds(REPORT_TIMEOUT, self.report)
+
+    def on_state_changed(self, bus, message, name, pipeline):
+        if message.src != pipeline:
+            return
+        old, new, pending = message.parse_state_changed()
+        if new != Gst.State.PLAYING or name not in self.pending:
+            return
+        self.playing[name] = self.elapsed()
+        bus.disconnect(self.pending.pop(name)[1])
+        if not self.pending:
+            self.report()
+
+    def report(self):
+        """Log where the start-up time went."""
+        if self.reported:
+            return False
+        self.reported = True
+        logger.info("Start-up phases: %s", ", ".join(
+            "%s %.0fms" % (name, seconds * 1000)
+            for name, seconds in self.phases))
+        for name, seconds in sorted(self.playing.items(),
+                                    key=lambda item: item[1]):
+            logger.info("Start-up: %s PLAYING at %.0fms", name, seconds * 1000)
+        for name in self.pending:
+            logger.warning("Start-up: %s not PLAYING after %.1fs",
+                           name, self.elapsed())
+        return False
+
+    def stats(self):
+        return {'phases' : dict(self.phases),
+                'playing' : dict(self.playing),
+                'pending' : list(self.pending),
+                }
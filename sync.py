@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import collections
+import logging
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+
+logger = logging.getLogger(__name__)
+
+# Time given to decks to preroll before a synchronized start.
+SYNC_LEAD = 200 * Gst.MSECOND
+
+
+def next_frame_boundary(pipeline, frame, lead=SYNC_LEAD):
+    """Return the clock time of the pipeline's first frame after lead.
+
+    frame is the pipeline's frame duration in ns.
+    """
+    clock = pipeline.get_clock() or Gst.SystemClock.obtain()
+    base = pipeline.get_base_time()
+    running = clock.get_time() + lead - base
+    return base + -(-running // frame) * frame
+
+
+class InterStats():
+    """Follows one deck's frames across its intervideo channel.
+
+    Every frame the deck hands to the channel is counted, and every
+    frame the mix takes from it is compared with that count: the same
+    count again is a repeated frame, a jump of more than one means
+    frames were dropped. The age of the deck frame when the mix takes it
+    shows the offset between the two; its change is the drift.
+    """
+
+    def __init__(self, ident):
+        self.ident = ident
+        self.clock = Gst.SystemClock.obtain()
+        self.deck_pads = []
+        self.produced = 0
+        self.mixed = 0
+        self.seen = 0
+        self.arrival = None
+        self.repeated = 0
+        self.dropped = 0
+        self.ages = collections.deque(maxlen=1000)
+        self.offset = None
+        self.drift = None
+
+    def attach_deck(self, pads):
+        """Count the frames passing the deck's sink pads, once each."""
+        for pad in pads:
+            if pad not in self.deck_pads:
+                self.deck_pads.append(pad)
+                pad.add_probe(Gst.PadProbeType.BUFFER, self.on_deck_buffer)
+
+    def attach_mix(self, pad):
+        """Compare every frame passing a pad of the mix with the count."""
+        pad.add_probe(Gst.PadProbeType.BUFFER, self.on_mix_buffer)
+
+    def on_deck_buffer(self, pad, info):
+        self.produced += 1
+        self.arrival = self.clock.get_time()
+        return Gst.PadProbeReturn.OK
+
+    def on_mix_buffer(self, pad, info):
+        self.mixed += 1
+        produced = self.produced
+        if produced == self.seen:
+            self.repeated += 1
+        elif produced > self.seen + 1:
+            self.dropped += produced - self.seen - 1
+        self.seen = produced
+        if self.arrival is not None:
+            self.ages.append(self.clock.get_time() - self.arrival)
+        return Gst.PadProbeReturn.OK
+
+    def sample(self):
+        """Update offset and drift from the frames mixed since last time."""
+        ages = list(self.ages)
+        self.ages.clear()
+        if not ages:
+            return
+        offset = sum(ages) / len(ages) / Gst.MSECOND
+        if self.offset is not None:
+            self.drift = offset - self.offset
+        self.offset = offset
+
+    def stats(self):
+        return {'repeated' : self.repeated,
+                'dropped' : self.dropped,
+                'offset_ms' : self.offset,
+                'drift_ms' : self.drift,
+                }
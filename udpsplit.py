@@ -1,20 +1,198 @@
 #!/usr/bin/env python3
 
+import argparse
+import logging
+import select
 import socket
+import struct
+import sys
+import time
 
-source_ip = '10.42.0.1'
-source_port = 7700
 
-dest_ip = '127.0.0.1'
-dest_ports = [7700,7701]
+logger = logging.getLogger(__name__)
 
-sock_in = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-sock_in.bind((source_ip,source_port))
-sock_out_0 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-sock_out_1 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+# Largest UDP payload, so OSC bundles are never truncated.
+MAX_DATAGRAM = 65535
 
-while True:
-    data, addr = sock_in.recvfrom(1024)
-    sock_out_0.sendto(data, (dest_ip,dest_ports[0]))
-    sock_out_1.sendto(data, (dest_ip,dest_ports[1]))
+# Datagrams read per wakeup before forwarding control to the poll.
+BATCH = 64
 
+BUNDLE = b'#bundle\0'
+
+
+def rewrite(data, prefix, replacement=None):
+    """Return an OSC packet with only the messages under an address prefix.
+
+    Addresses starting with prefix have it replaced by replacement when
+    given. Bundles are filtered message by message. Returns None when
+    nothing is left to send, or when a bundle is malformed.
+    """
+    if data.startswith(BUNDLE):
+        # Keep the bundle header and time tag.
+        out = [data[:16]]
+        pos = 16
+        while pos + 4 <= len(data):
+            size, = struct.unpack('>i', data[pos:pos + 4])
+            if size < 0 or pos + 4 + size > len(data):
+                logger.debug("Dropping malformed OSC bundle")
+                return None
+            element = rewrite(data[pos + 4:pos + 4 + size], prefix, replacement)
+            pos += 4 + size
+            if element is not None:
+                out.append(struct.pack('>i', len(element)))
+                out.append(element)
+        return b''.join(out) if len(out) > 1 else None
+    end = data.find(b'\0')
+    if end < 0:
+        return None
+    address = data[:end]
+    if not address.startswith(prefix):
+        return None
+    if replacement is None:
+        return data
+    address = replacement + address[len(prefix):]
+    # OSC strings are null terminated and padded to 4 bytes.
+    return (address + b'\0' * (4 - len(address) % 4)
+            + data[(end + 4) & ~3:])
+
+
+class Destination():
+    """A relay target, optionally limited to one OSC address prefix."""
+
+    def __init__(self, host, port, prefix=None, replacement=None):
+        self.address = (host, port)
+        self.prefix = prefix.encode() if prefix else None
+        self.replacement = replacement.encode() if replacement else None
+        self.packets = 0
+        self.bytes = 0
+        self.drops = 0
+        self.filtered = 0
+
+    @classmethod
+    def parse(cls, spec):
+        """Parse HOST:PORT[/PREFIX[=REPLACEMENT]]."""
+        target, slash, route = spec.partition('/')
+        host, port = target.rsplit(':', 1)
+        prefix, equals, replacement = (slash + route).partition('=')
+        return cls(host, int(port), prefix or None, replacement or None)
+
+    def translate(self, data):
+        """Return the datagram to send here, or None to skip it."""
+        if self.prefix is None:
+            return data
+        data = rewrite(bytes(data), self.prefix, self.replacement)
+        if data is None:
+            self.filtered += 1
+        return data
+
+    def stats(self):
+        return {'packets' : self.packets,
+                'bytes' : self.bytes,
+                'drops' : self.drops,
+                'filtered' : self.filtered,
+                }
+
+
+class Relay():
+    """Fans datagrams from one socket out to many through one send socket."""
+
+    def __init__(self, source, destinations, batch=BATCH):
+        self.destinations = destinations
+        self.batch = batch
+        self.received = 0
+        self.running = False
+        self.sock_in = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock_in.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock_in.bind(source)
+        self.sock_in.setblocking(False)
+        self.sock_out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock_out.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+        # A slow destination drops packets rather than stalling the others.
+        self.sock_out.setblocking(False)
+        self.buffer = bytearray(MAX_DATAGRAM)
+        self.view = memoryview(self.buffer)
+
+    @property
+    def address(self):
+        return self.sock_in.getsockname()
+
+    def poll(self, timeout=None):
+        """Wait for input, then relay up to one batch of datagrams."""
+        readable, _, _ = select.select([self.sock_in], [], [], timeout)
+        if not readable:
+            return 0
+        for count in range(self.batch):
+            try:
+                size = self.sock_in.recv_into(self.buffer)
+            except BlockingIOError:
+                return count
+            self.received += 1
+            self.forward(self.view[:size])
+        return self.batch
+
+    def forward(self, data):
+        """Send one datagram to every destination that wants it."""
+        for dest in self.destinations:
+            out = dest.translate(data)
+            if out is None:
+                continue
+            try:
+                self.sock_out.sendto(out, dest.address)
+            except OSError:
+                dest.drops += 1
+                continue
+            dest.packets += 1
+            dest.bytes += len(out)
+
+    def run(self, report=0):
+        """Relay until stop() is called, logging stats every report s."""
+        self.running = True
+        next_report = time.monotonic() + report
+        while self.running:
+            self.poll(0.5)
+            if report and time.monotonic() >= next_report:
+                next_report += report
+                logger.info("%s", self.stats())
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        """Return the received count and per-destination counters."""
+        stats = {'received' : self.received}
+        for dest in self.destinations:
+            stats['%s:%d' % dest.address] = dest.stats()
+        return stats
+
+    def close(self):
+        self.sock_in.close()
+        self.sock_out.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Relay OSC to many ports.")
+    parser.add_argument('--listen', default='10.42.0.1:7700',
+                        help="address to receive on, HOST:PORT")
+    parser.add_argument('--report', type=float, default=10,
+                        help="seconds between stats reports, 0 for none")
+    parser.add_argument('destinations', nargs='*',
+                        default=['127.0.0.1:7700', '127.0.0.1:7701'],
+                        help="HOST:PORT[/PREFIX[=REPLACEMENT]] to relay to, "
+                             "e.g. 127.0.0.1:7702/video/speed0=/speed")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    host, port = args.listen.rsplit(':', 1)
+    relay = Relay((host, int(port)),
+                  [Destination.parse(spec) for spec in args.destinations])
+    try:
+        relay.run(args.report)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info("%s", relay.stats())
+        relay.close()
+
+
+if __name__=='__main__':
+    main(sys.argv[1:])